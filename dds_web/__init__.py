@@ -6,7 +6,6 @@
 
 # Standard library
 import logging
-import datetime
 import pathlib
 import sys
 import re
@@ -184,6 +183,8 @@ def create_app(testing=False, database_uri=None):
         if testing:
             # Simplifies testing as we don't test the session protection anyway
             login_manager.session_protection = "basic"
+            # The tests run the project jobs themselves
+            app.config["RUN_PROJECT_JOBS"] = False
 
         @app.before_request
         def prepare():
@@ -259,6 +260,7 @@ def create_app(testing=False, database_uri=None):
         app.cli.add_command(create_new_unit)
         app.cli.add_command(update_uploaded_file_with_log)
         app.cli.add_command(lost_files_s3_db)
+        app.cli.add_command(recompute_project_counters)
 
         with app.app_context():  # Everything in here has access to sessions
             from dds_web.database import models
@@ -410,163 +412,201 @@ def create_new_unit(
     db.session.add(new_unit)
     db.session.commit()
 
+    # Do not reuse connections or settings from before the unit was created
+    from dds_web.api import s3_client_pool
+
+    s3_client_pool.pool.invalidate(endpoint=safespring_endpoint, access_key=safespring_access)
+    s3_client_pool.units.invalidate(unit_id=new_unit.id)
+
     flask.current_app.logger.info(f"Unit '{name}' created")
 
 
 @click.command("update-uploaded-file")
 @click.option("--project", "-p", type=str, required=True)
 @click.option("--path-to-log-file", "-fp", type=str, required=True)
+@click.option("--workers", "-w", type=click.IntRange(min=1), default=16, show_default=True)
 @flask.cli.with_appcontext
-def update_uploaded_file_with_log(project, path_to_log_file):
-    """Update file details that weren't properly uploaded to db from cli log"""
+def update_uploaded_file_with_log(project, path_to_log_file, workers):
+    """Update file details that weren't properly uploaded to db from cli log
+
+    The files are checked in S3 in parallel (with one connection) and added to the database in
+    batches of 1000, with one query for the names already in the project per batch. A batch
+    which can not be added is rolled back and the command fails after the remaining batches.
+    """
     import botocore
+    import concurrent.futures
+    import json
+    import time
     from dds_web.database import models
     from dds_web import db
     from dds_web.api.api_s3_connector import ApiS3Connector
-    import json
+    from dds_web.api import db_tools
+    import dds_web.utils
 
+    start = time.perf_counter()
     proj_in_db = models.Project.query.filter_by(public_id=project).one_or_none()
     assert proj_in_db
 
     with open(path_to_log_file, "r") as f:
         log = json.load(f)
+    failed = [
+        (file, vals)
+        for file, vals in log.items()
+        if (vals.get("status") or {}).get("failed_op") == "add_file_db"
+    ]
+
     errors = {}
     files_added = []
-    for file, vals in log.items():
-        status = vals.get("status")
-        if not status or not status.get("failed_op") == "add_file_db":
-            continue
+    failed_batches = 0
+    batch_size = 1000
+    with ApiS3Connector(project=proj_in_db) as s3conn:
 
-        with ApiS3Connector(project=proj_in_db) as s3conn:
+        def in_s3(vals):
+            """Error message if the object can not be found, None otherwise."""
             try:
-                _ = s3conn.resource.meta.client.head_object(
-                    Bucket=s3conn.project.bucket, Key=vals["path_remote"]
-                )
+                s3conn.storage.head_object(bucket=proj_in_db.bucket, key=vals["path_remote"])
             except botocore.client.ClientError as err:
                 if err.response["Error"]["Code"] == "404":
-                    errors[file] = {"error": "File not found in S3", "traceback": err.__traceback__}
-            else:
-                file_object = models.File.query.filter(
-                    sqlalchemy.and_(
-                        models.File.name == sqlalchemy.func.binary(file),
-                        models.File.project_id == proj_in_db.id,
+                    return "File not found in S3"
+                return f"Could not check file in S3: {err.response['Error']['Code']}"
+            return None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for i in range(0, len(failed), batch_size):
+                batch = dict(failed[i : i + batch_size])
+                try:
+                    # One query for the files which are already in the database
+                    existing = db_tools.get_existing_names(project=proj_in_db, names=list(batch))
+                    for file in existing:
+                        errors[file] = {"error": "File already in database."}
+                        batch.pop(file)
+
+                    # Check the remaining files in S3 in parallel
+                    for file, error in zip(batch.copy(), executor.map(in_s3, batch.values())):
+                        if error:
+                            errors[file] = {"error": error}
+                            batch.pop(file)
+
+                    db_tools.insert_files_in_bulk(
+                        project=proj_in_db,
+                        files_info=[
+                            {
+                                "name": file,
+                                "name_in_bucket": vals["path_remote"],
+                                "subpath": vals["subpath"],
+                                "size_original": vals["size_raw"],
+                                "size_stored": vals["size_processed"],
+                                "compressed": not vals["compressed"],
+                                "public_key": vals["public_key"],
+                                "salt": vals["salt"],
+                                "checksum": vals["checksum"],
+                            }
+                            for file, vals in batch.items()
+                        ],
+                        time_uploaded=dds_web.utils.current_time(),
                     )
-                ).first()
-                if file_object:
-                    errors[file] = {"error": "File already in database."}
-                else:
-                    new_file = models.File(
-                        name=file,
-                        name_in_bucket=vals["path_remote"],
-                        subpath=vals["subpath"],
-                        project_id=proj_in_db.id,
-                        size_original=vals["size_raw"],
-                        size_stored=vals["size_processed"],
-                        compressed=not vals["compressed"],
-                        public_key=vals["public_key"],
-                        salt=vals["salt"],
-                        checksum=vals["checksum"],
-                    )
-                    new_version = models.Version(
-                        size_stored=new_file.size_stored, time_uploaded=datetime.datetime.utcnow()
-                    )
-                    proj_in_db.file_versions.append(new_version)
-                    proj_in_db.files.append(new_file)
-                    new_file.versions.append(new_version)
-
-                    db.session.add(new_file)
-                    files_added.append(new_file)
-                db.session.commit()
-
-        flask.current_app.logger.info(f"Files added: {files_added}")
-        flask.current_app.logger.info(f"Errors while adding files: {errors}")
+                    db.session.commit()
+                    files_added.extend(batch)
+                except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
+                    # Later batches need a working session
+                    db.session.rollback()
+                    failed_batches += 1
+                    flask.current_app.logger.error(f"Batch {i // batch_size} not added: {err}")
+                    for file in batch:
+                        errors[file] = {"error": "Could not add file to database."}
+
+    seconds = time.perf_counter() - start
+    flask.current_app.logger.info(f"Files added: {files_added}")
+    flask.current_app.logger.info(f"Errors while adding files: {errors}")
+    flask.current_app.logger.info(
+        f"Checked {len(failed)} files in {seconds:.2f} s ({len(failed) / seconds:.0f} files/s): "
+        f"{len(files_added)} added, {len(errors)} errors"
+    )
+    if failed_batches:
+        flask.current_app.logger.critical(f"{failed_batches} batches could not be added")
+        sys.exit(1)
 
 
 @click.command("lost-files")
 @click.argument("action_type", type=click.Choice(["find", "list", "delete"]))
+@click.option("--workers", "-w", type=click.IntRange(min=1), default=4, show_default=True)
+@click.option("--json", "as_json", is_flag=True, help="Print the results as JSON lines.")
 @flask.cli.with_appcontext
-def lost_files_s3_db(action_type: str):
+def lost_files_s3_db(action_type: str, workers: int, as_json: bool):
     """
     Identify (and optionally delete) files that are present in S3 or in the db, but not both.
 
+    The bucket and the database are compared with a merge join of the sorted keys, several
+    projects at a time. With --json, every lost file ("list") and every project is printed as a
+    JSON object on its own line. The command fails if lost files are found ("find", "list"), or
+    if a project can not be checked or cleaned for another reason than a missing bucket.
+
     Args:
         action_type (str): "find", "list", or "delete"
+        workers (int): Number of projects processed at the same time
+        as_json (bool): Print machine-readable results
     """
-    from dds_web.database import models
-    import boto3
+    import json
+    import threading
 
-    for unit in models.Unit.query:
-        session = boto3.session.Session()
+    from dds_web.api import lost_files
 
-        resource = session.resource(
-            service_name="s3",
-            endpoint_url=unit.safespring_endpoint,
-            aws_access_key_id=unit.safespring_access,
-            aws_secret_access_key=unit.safespring_secret,
-        )
+    output_lock = threading.Lock()
 
-        db_count = 0
-        s3_count = 0
-        for project in unit.projects:
-            try:
-                s3_filenames = set(
-                    entry.key for entry in resource.Bucket(project.bucket).objects.all()
+    def emit(entry):
+        with output_lock:
+            if as_json:
+                click.echo(json.dumps({"type": "file", **entry}))
+            else:
+                flask.current_app.logger.info(
+                    "Entry %s (%s, %s) not found in %s",
+                    entry["key"],
+                    entry["project"],
+                    entry["unit"],
+                    "S3" if entry["in"] == "db" else "database",
                 )
-            except resource.meta.client.exceptions.NoSuchBucket:
-                flask.current_app.logger.warning("Missing bucket %s", project.bucket)
-                continue
 
-            try:
-                db_filenames = set(entry.name_in_bucket for entry in project.files)
-            except sqlalchemy.exc.OperationalError:
-                flask.current_app.logger.critical("Unable to connect to db")
-
-            diff_db = db_filenames.difference(s3_filenames)
-            diff_s3 = s3_filenames.difference(db_filenames)
-            if action_type == "list":
-                for file_entry in diff_db:
-                    flask.current_app.logger.info(
-                        "Entry %s (%s, %s) not found in S3", file_entry, project, unit
-                    )
-                for file_entry in diff_s3:
-                    flask.current_app.logger.info(
-                        "Entry %s (%s, %s) not found in database", file_entry, project, unit
-                    )
-            elif action_type == "delete":
-                # s3 can only delete 1000 objects per request
-                batch_size = 1000
-                s3_to_delete = list(diff_s3)
-                for i in range(0, len(s3_to_delete), batch_size):
-                    resource.meta.client.delete_objects(
-                        Bucket=project.bucket,
-                        Delete={
-                            "Objects": [
-                                {"Key": entry} for entry in s3_to_delete[i : i + batch_size]
-                            ]
-                        },
-                    )
-
-                db_entries = models.File.query.filter(
-                    sqlalchemy.and_(
-                        models.File.name_in_bucket.in_(diff_db),
-                        models.File.project_id == project.id,
-                    )
-                )
-                for db_entry in db_entries:
-                    try:
-                        for db_entry_version in db_entry.versions:
-                            if db_entry_version.time_deleted is None:
-                                db_entry_version.time_deleted = datetime.datetime.utcnow()
-                        db.session.delete(db_entry)
-                        db.session.commit()
-                    except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError):
-                        db.session.rollback()
-                        flask.current_app.logger.critical("Unable to delete the database entries")
-                        sys.exit(1)
-
-            # update the counters at the end of the loop to have accurate numbers for delete
-            s3_count += len(diff_s3)
-            db_count += len(diff_db)
+    db_count = 0
+    s3_count = 0
+    failed = set()
+    for summary in lost_files.reconcile(
+        delete=action_type == "delete",
+        workers=workers,
+        emit=emit if action_type == "list" else None,
+    ):
+        if as_json:
+            with output_lock:
+                click.echo(json.dumps({"type": "project", **summary}))
+        if summary["error"]:
+            flask.current_app.logger.warning(
+                "Project %s (bucket %s) not checked: %s",
+                summary["project"],
+                summary["bucket"],
+                summary["error"],
+            )
+            # Missing buckets are skipped, any other error fails the command
+            if summary["error"] != "NoSuchBucket":
+                failed.add(summary["project"])
+        if summary["not_deleted"]:
+            flask.current_app.logger.warning(
+                "Project %s (bucket %s): %d objects not deleted: %s",
+                summary["project"],
+                summary["bucket"],
+                len(summary["not_deleted"]),
+                summary["not_deleted"],
+            )
+            failed.add(summary["project"])
+        # Objects which could not be deleted are not counted as deleted
+        s3_count += summary["in_s3_only"] - len(summary["not_deleted"])
+        db_count += summary["in_db_only"]
+
+    if failed:
+        flask.current_app.logger.critical(
+            "Unable to %s %d projects: %s",
+            "delete the lost files of" if action_type == "delete" else "check",
+            len(failed),
+            ", ".join(sorted(failed)),
+        )
 
     if s3_count or db_count:
         action_word = "Found" if action_type in ("find", "list") else "Deleted"
@@ -582,3 +622,48 @@ def lost_files_s3_db(action_type: str):
 
     else:
         flask.current_app.logger.info("Found no lost files")
+
+    if failed:
+        sys.exit(1)
+
+
+@click.command("recompute-project-counters")
+@click.option("--project", "-p", type=str, required=False, help="Public id of one project.")
+@flask.cli.with_appcontext
+def recompute_project_counters(project):
+    """Set the number of files and bytes of projects from their files.
+
+    The counters are kept up to date when files are added and removed, this is for repairing
+    them after the files have been changed directly in the database.
+    """
+    from dds_web.api import db_tools
+    from dds_web.database import models
+    from dds_web.utils import keyset_query
+
+    query = models.Project.query
+    if project:
+        query = query.filter(models.Project.public_id == project)
+        if not query.count():
+            flask.current_app.logger.error(f"No project with public id {project}")
+            sys.exit(1)
+
+    checked = changed = 0
+    for proj in keyset_query(query, key=models.Project.id, page_size=100):
+        checked += 1
+        before = (proj.file_count, proj.bytes_stored, proj.bytes_original)
+        db_tools.recompute_project_counters(project=proj)
+        if before != (proj.file_count, proj.bytes_stored, proj.bytes_original):
+            changed += 1
+            flask.current_app.logger.info(
+                "Project %s: %s files, %s bytes stored (was %s files, %s bytes)",
+                proj.public_id,
+                proj.file_count,
+                proj.bytes_stored,
+                before[0],
+                before[1],
+            )
+        db.session.commit()
+
+    flask.current_app.logger.info(
+        "Recomputed the counters of %d projects, %d changed", checked, changed
+    )
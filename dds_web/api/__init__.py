@@ -40,15 +40,22 @@ api.add_resource(user.SecondFactor, "/user/second_factor", endpoint="second_fact
 
 # S3 ########################################################################################## S3 #
 api.add_resource(s3.S3Info, "/s3/proj", endpoint="proj_s3_info")
+api.add_resource(s3.MultipartUpload, "/s3/multipart", endpoint="multipart_upload")
+api.add_resource(s3.MultipartUploadUrls, "/s3/multipart/urls", endpoint="multipart_upload_urls")
+api.add_resource(
+    s3.MultipartUploadComplete, "/s3/multipart/complete", endpoint="multipart_upload_complete"
+)
 
 # Files #################################################################################### Files #
 api.add_resource(files.NewFile, "/file/new", endpoint="new_file")
+api.add_resource(files.NewFileBatch, "/file/new/batch", endpoint="new_file_batch")
 api.add_resource(files.MatchFiles, "/file/match", endpoint="match_files")
 api.add_resource(files.ListFiles, "/files/list", endpoint="list_files")
 api.add_resource(files.RemoveFile, "/file/rm", endpoint="remove_file")
 api.add_resource(files.RemoveDir, "/file/rmdir", endpoint="remove_dir")
 api.add_resource(files.FileInfo, "/file/info", endpoint="file_info")
 api.add_resource(files.FileInfoAll, "/file/all/info", endpoint="all_file_info")
+api.add_resource(files.FileUrls, "/file/urls", endpoint="file_urls")
 api.add_resource(files.UpdateFile, "/file/update", endpoint="update_file")
 
 # Projects ############################################################################## Projects #
@@ -59,6 +66,7 @@ api.add_resource(project.GetPrivate, "/proj/private", endpoint="private_key")
 api.add_resource(project.CreateProject, "/proj/create", endpoint="create_project")
 api.add_resource(project.ProjectUsers, "/proj/users", endpoint="list_project_users")
 api.add_resource(project.ProjectStatus, "/proj/status", endpoint="project_status")
+api.add_resource(project.ProjectJobStatus, "/proj/job", endpoint="project_job_status")
 api.add_resource(project.ProjectAccess, "/proj/access", endpoint="project_access")
 
 # User management ################################################################ User management #
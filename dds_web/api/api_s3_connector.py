@@ -9,6 +9,7 @@ import logging
 import traceback
 
 # Installed
+import botocore
 
 # Own modules
 from dds_web.api.dds_decorators import (
@@ -16,9 +17,19 @@ from dds_web.api.dds_decorators import (
     bucket_must_exists,
 )
 
+from dds_web.api import bucket_teardown
+from dds_web.api import s3_client_pool
+from dds_web.api import storage
 from dds_web.database import models
+from dds_web.errors import DeletionError
 
 
+####################################################################################################
+# GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
+####################################################################################################
+
+UPLOAD_PART_URL_EXPIRES_IN = 86400  # 1 day in seconds
+
 ####################################################################################################
 # LOGGING ################################################################################ LOGGING #
 ####################################################################################################
@@ -27,6 +38,30 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
+####################################################################################################
+# FUNCTIONS ############################################################################ FUNCTIONS #
+####################################################################################################
+
+
+def get_unit_s3_info(unit_id):
+    """Get the S3 endpoint, name, access key and secret key of a unit."""
+
+    def load():
+        info = (
+            models.Unit.query.filter_by(id=unit_id)
+            .with_entities(
+                models.Unit.safespring_endpoint,
+                models.Unit.safespring_name,
+                models.Unit.safespring_access,
+                models.Unit.safespring_secret,
+            )
+            .one_or_none()
+        )
+        return tuple(info) if info is not None else None
+
+    return s3_client_pool.units.get(unit_id=unit_id, load=load) or (None, None, None, None)
+
+
 ####################################################################################################
 # CLASSES ################################################################################ CLASSES #
 ####################################################################################################
@@ -37,12 +72,17 @@ class ApiS3Connector:
 
     def __init__(self, project=None):
         self.project = project
-        self.resource = None
+        self.storage = None
 
     @connect_cloud
     def __enter__(self):
         return self
 
+    @connect_cloud
+    def connect(self):
+        """Connect without a with statement, e.g. for a streamed response which outlives it."""
+        return self
+
     def __exit__(self, exc_type, exc_value, tb):
         if exc_type is not None:
             traceback.print_exception(exc_type, exc_value, tb)
@@ -51,17 +91,11 @@ class ApiS3Connector:
         return True
 
     def get_s3_info(self):
-        """Get information required to connect to cloud."""
-        endpoint, name, accesskey, secretkey = (
-            models.Unit.query.filter_by(id=self.project.responsible_unit.id)
-            .with_entities(
-                models.Unit.safespring_endpoint,
-                models.Unit.safespring_name,
-                models.Unit.safespring_access,
-                models.Unit.safespring_secret,
-            )
-            .one_or_none()
-        )
+        """Get information required to connect to cloud.
+
+        The unit settings are cached, see s3_client_pool.UnitInfoCache.
+        """
+        endpoint, name, accesskey, secretkey = get_unit_s3_info(unit_id=self.project.unit_id)
         bucket = self.project.bucket
 
         return (
@@ -71,42 +105,106 @@ class ApiS3Connector:
             bucket,
         )
 
-    @bucket_must_exists
-    def remove_bucket(self, *args, **kwargs):
-        """Removes all contents from the project specific s3 bucket."""
-        # Get bucket object
-        bucket = self.resource.Bucket(self.project.bucket)
+    def create_bucket(self):
+        """Create the project specific s3 bucket."""
+        self.storage.create_bucket(bucket=self.project.bucket)
+        s3_client_pool.buckets.add(endpoint=self.url, bucket=self.project.bucket)
 
-        # Delete objects first
-        bucket.objects.all().delete()
+    @bucket_must_exists
+    def remove_bucket(self, checkpoint=None, on_checkpoint=None, *args, **kwargs):
+        """Removes all contents from the project specific s3 bucket, and then the bucket.
+
+        The objects are deleted in parallel. If the teardown of the bucket has been interrupted,
+        pass the last checkpoint to continue after the objects already deleted.
+        """
+        result = bucket_teardown.BucketTeardown(
+            storage=self.storage,
+            bucket=self.project.bucket,
+            checkpoint=checkpoint,
+            on_checkpoint=on_checkpoint,
+        ).run()
+        if result["errors"]:
+            raise DeletionError(
+                project=self.project.public_id,
+                message=f"Could not delete {len(result['errors'])} objects from the bucket.",
+            )
 
-        # Delete bucket
-        bucket.delete()
-        bucket = None
+        s3_client_pool.buckets.invalidate(endpoint=self.url, bucket=self.bucketname)
+        return result
 
     @bucket_must_exists
     def remove_multiple(self, items, batch_size: int = 1000, *args, **kwargs):
-        """Removes all with prefix."""
+        """Removes multiple objects from s3.
+
+        Returns a dict with the keys which could not be deleted and the reason.
+        """
+        errors = {}
         # s3 can only delete 1000 objects per request
         for i in range(0, len(items), batch_size):
-            _ = self.resource.meta.client.delete_objects(
-                Bucket=self.project.bucket,
-                Delete={"Objects": [{"Key": x} for x in items[i : i + batch_size]]},
+            errors.update(
+                self.storage.delete_objects(
+                    bucket=self.project.bucket, keys=items[i : i + batch_size]
+                )
             )
 
+        return errors
+
     @bucket_must_exists
     def remove_one(self, file, *args, **kwargs):
-        """Removes file from s3"""
-        _ = self.resource.meta.client.delete_object(Bucket=self.project.bucket, Key=file)
+        """Removes file from s3, returns the error if it could not be deleted."""
+        return self.storage.delete_objects(bucket=self.project.bucket, keys=[file])
 
-    def generate_get_url(self, key):
-        """Generate presigned urls for get requests."""
+    def get_url_signer(self):
+        """Get the signer for presigned urls to objects in the project bucket."""
+        return self.storage.get_url_signer(bucket=self.project.bucket)
+
+    def generate_get_urls(self, keys):
+        """Generate presigned urls for get requests, returned as a dict with the keys as keys."""
 
         # This does not perform any requests, the signing is "local"
-        # and it doesn't check if the item exists before creating the link
-        url = self.resource.meta.client.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": self.project.bucket, "Key": key},
-            ExpiresIn=604800,  # 7 days in seconds
+        # and it doesn't check if the items exist before creating the links
+        return self.get_url_signer().generate_get_urls(
+            keys=keys, expires_in=604800  # 7 days in seconds
         )
-        return url
+
+    @bucket_must_exists
+    def create_multipart_upload(self, key, *args, **kwargs):
+        """Start a multipart upload of an object, returns the upload id."""
+        return self.storage.create_multipart_upload(bucket=self.project.bucket, key=key)
+
+    def generate_upload_part_urls(self, key, upload_id, part_numbers):
+        """Generate presigned urls for uploading parts, returned as a dict with the part numbers
+        as keys."""
+        return self.get_url_signer().generate_upload_part_urls(
+            key=key,
+            upload_id=upload_id,
+            part_numbers=part_numbers,
+            expires_in=UPLOAD_PART_URL_EXPIRES_IN,
+        )
+
+    @bucket_must_exists
+    def complete_multipart_upload(self, key, upload_id, parts, *args, **kwargs):
+        """Combine the uploaded parts to the object.
+
+        parts should be a list of dicts with the part numbers and ETags returned by S3.
+        """
+        self.storage.complete_multipart_upload(
+            bucket=self.project.bucket, key=key, upload_id=upload_id, parts=parts
+        )
+
+    def abort_multipart_upload(self, key, upload_id):
+        """Abort a multipart upload and remove the uploaded parts.
+
+        Uploads or buckets which do not exist (anymore) are ignored.
+        """
+        try:
+            self.storage.abort_multipart_upload(
+                bucket=self.project.bucket, key=key, upload_id=upload_id
+            )
+        except botocore.client.ClientError as err:
+            if err.response.get("Error", {}).get("Code") not in ["NoSuchUpload", "NoSuchBucket"]:
+                raise
+
+    def generate_get_url(self, key):
+        """Generate presigned urls for get requests."""
+        return self.generate_get_urls(keys=[key])[key]
@@ -0,0 +1,185 @@
+"""Parallel removal of all objects in a bucket, and the bucket itself."""
+
+####################################################################################################
+# IMPORTS ################################################################################ IMPORTS #
+####################################################################################################
+
+# Standard library
+import concurrent.futures
+import logging
+import threading
+import time
+
+####################################################################################################
+# LOGGING ################################################################################ LOGGING #
+####################################################################################################
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+####################################################################################################
+# GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
+####################################################################################################
+
+PAGE_SIZE = 1000  # max number of keys per list and delete request in s3
+MAX_WORKERS = 8
+
+####################################################################################################
+# CLASSES ################################################################################ CLASSES #
+####################################################################################################
+
+
+class BucketTeardown:
+    """Lists the keys in a bucket page by page and deletes the pages concurrently.
+
+    Listing is sequential (each page needs the previous one) but each page is deleted in a thread
+    of a bounded pool, with at most two pages per thread waiting, so that memory use does not
+    depend on the size of the bucket.
+
+    The checkpoint is the last key of the listing up to which all objects have been deleted. It is
+    passed to on_checkpoint, with the number of objects deleted so far, when it moves. An
+    interrupted teardown can be resumed by passing the last checkpoint, the listing then starts
+    after that key. on_checkpoint is called outside of the lock shared by the threads, so a slow
+    callback (e.g. a database write) only holds up the thread calling it.
+    """
+
+    def __init__(
+        self,
+        storage,
+        bucket,
+        checkpoint=None,
+        on_checkpoint=None,
+        max_workers=MAX_WORKERS,
+        page_size=PAGE_SIZE,
+    ):
+        self.storage = storage
+        self.bucket = bucket
+        self.checkpoint = checkpoint
+        self.on_checkpoint = on_checkpoint
+        self.max_workers = max_workers
+        self.page_size = page_size
+
+        self.deleted = 0
+        self.errors = {}
+
+        # Pages which have been deleted but are not yet part of the checkpoint:
+        # page number -> (last key, deleted without errors)
+        self._finished = {}
+        self._next_page = 0
+        self._failed = False
+        self._lock = threading.Lock()
+
+        # The latest checkpoint not yet passed to on_checkpoint, and the lock of the thread
+        # passing it
+        self._unsaved = None
+        self._save_lock = threading.Lock()
+
+    def list_pages(self):
+        """Generate the keys in the bucket, one list per page, starting after the checkpoint."""
+        return self.storage.list_pages(
+            bucket=self.bucket, start_after=self.checkpoint, page_size=self.page_size
+        )
+
+    def delete_page(self, page_number, keys):
+        """Delete the objects in a page and move the checkpoint if possible."""
+        errors = self.storage.delete_objects(bucket=self.bucket, keys=keys)
+
+        with self._lock:
+            self.deleted += len(keys) - len(errors)
+            self.errors.update(errors)
+            self._finished[page_number] = (keys[-1], not errors)
+            if self._advance_checkpoint():
+                self._unsaved = (self.checkpoint, self.deleted)
+
+        if self.on_checkpoint is not None:
+            self._save_checkpoint()
+
+    def _advance_checkpoint(self):
+        """Move the checkpoint past all consecutive pages deleted without errors. Needs the lock.
+
+        Returns True if the checkpoint moved.
+        """
+        moved = False
+        while not self._failed and self._next_page in self._finished:
+            last_key, ok = self._finished.pop(self._next_page)
+            if not ok:
+                # Keys which could not be deleted must be listed again when resuming
+                self._failed = True
+                break
+            self.checkpoint = last_key
+            self._next_page += 1
+            moved = True
+
+        return moved
+
+    def _save_checkpoint(self):
+        """Pass the latest checkpoint to on_checkpoint, unless another thread is doing it.
+
+        That thread then passes the latest checkpoint when it is done, so checkpoints may be
+        skipped but the last one is always passed, and never an older one after a newer one.
+        """
+        while self._save_lock.acquire(blocking=False):
+            try:
+                with self._lock:
+                    unsaved, self._unsaved = self._unsaved, None
+                if unsaved is not None:
+                    self.on_checkpoint(*unsaved)
+            finally:
+                self._save_lock.release()
+
+            # A checkpoint may have been added by a thread which could not get the save lock
+            with self._lock:
+                if self._unsaved is None:
+                    return
+
+    def run(self, delete_bucket=True):
+        """Delete all objects and then the bucket, unless some objects could not be deleted.
+
+        Returns a dict with the number of deleted objects, errors per key, time and throughput.
+        """
+        start = time.perf_counter()
+
+        # Limits the number of listed pages waiting for a thread
+        slots = threading.BoundedSemaphore(self.max_workers * 2)
+        futures = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for page_number, keys in enumerate(self.list_pages()):
+                    slots.acquire()
+                    future = executor.submit(self.delete_page, page_number, keys)
+                    future.add_done_callback(lambda _: slots.release())
+                    futures.add(future)
+                    futures = {x for x in futures if not x.done() or x.exception() is not None}
+
+                    # Stop listing if a delete request has failed. A page may have finished
+                    # since the filter, so done alone does not mean failed.
+                    if any(x.done() and x.exception() is not None for x in futures):
+                        break
+            finally:
+                # Wait for the submitted pages, also if the listing failed
+                done, _ = concurrent.futures.wait(futures)
+
+        # Raise the first error from a delete request
+        for future in done:
+            future.result()
+
+        if delete_bucket and not self.errors:
+            self.storage.delete_bucket(bucket=self.bucket)
+
+        seconds = time.perf_counter() - start
+        result = {
+            "deleted": self.deleted,
+            "errors": self.errors,
+            "checkpoint": self.checkpoint,
+            "seconds": seconds,
+            "objects_per_second": self.deleted / seconds if seconds else 0.0,
+        }
+        log.info(
+            "Bucket %s: deleted %s objects in %.1f s (%.0f objects/s), %s errors",
+            self.bucket,
+            self.deleted,
+            seconds,
+            result["objects_per_second"],
+            len(self.errors),
+        )
+        return result
@@ -5,11 +5,15 @@
 ####################################################################################################
 
 # Standard library
+import collections
+import os
 
 # Installed
 import sqlalchemy
+import sqlalchemy.dialects.mysql
 
 # Own modules
+import dds_web.utils
 from dds_web.database import models
 from dds_web import db
 from dds_web.errors import (
@@ -49,3 +53,263 @@ def remove_user_self_deletion_request(user):
         ) from err
 
     return email
+
+
+def get_existing_names(project, names, batch_size: int = 1000):
+    """Get the names which already exist in the project."""
+    existing = set()
+    for i in range(0, len(names), batch_size):
+        existing.update(
+            x.name
+            for x in models.File.query.filter(
+                sqlalchemy.and_(
+                    models.File.project_id == project.id,
+                    models.File.name.in_(names[i : i + batch_size]),
+                )
+            ).with_entities(models.File.name)
+        )
+
+    # The database comparison is case insensitive, file names are not
+    return existing.intersection(names)
+
+
+def get_uploading_names(project, names, batch_size: int = 1000):
+    """Get the names which have an unfinished multipart upload in the project."""
+    uploading = set()
+    for i in range(0, len(names), batch_size):
+        uploading.update(
+            x.name
+            for x in models.MultipartUpload.query.filter(
+                sqlalchemy.and_(
+                    models.MultipartUpload.project_id == project.id,
+                    models.MultipartUpload.name.in_(names[i : i + batch_size]),
+                )
+            ).with_entities(models.MultipartUpload.name)
+        )
+
+    return uploading.intersection(names)
+
+
+def insert_files_in_bulk(project, files_info, time_uploaded, batch_size: int = 1000):
+    """Insert new file rows and their first versions in bulk.
+
+    files_info should be a list of dicts with the File column names as keys.
+    The session is not committed here - that is up to the caller.
+
+    Returns a dict with the file names as keys and the new file ids as values.
+    """
+    new_ids = {}
+    for i in range(0, len(files_info), batch_size):
+        batch = files_info[i : i + batch_size]
+
+        # Insert all files in one statement
+        db.session.bulk_insert_mappings(
+            models.File, [{**x, "project_id": project.id} for x in batch]
+        )
+
+        # Collect the generated ids with one query - names are unique within the project
+        batch_names = [x["name"] for x in batch]
+        inserted = dict(
+            models.File.query.filter(
+                sqlalchemy.and_(
+                    models.File.project_id == project.id,
+                    models.File.name.in_(batch_names),
+                )
+            )
+            .with_entities(models.File.name, models.File.id)
+            .all()
+        )
+        batch_ids = {x: inserted[x] for x in batch_names}
+
+        # Insert the first version of all files in one statement
+        db.session.bulk_insert_mappings(
+            models.Version,
+            [
+                {
+                    "project_id": project.id,
+                    "active_file": batch_ids[x["name"]],
+                    "size_stored": x["size_stored"],
+                    "time_uploaded": time_uploaded,
+                }
+                for x in batch
+            ],
+        )
+        new_ids.update(batch_ids)
+
+    update_folder_index(
+        project=project, added=[(x["subpath"], x["size_original"]) for x in files_info]
+    )
+    update_project_counters(
+        project=project,
+        files=len(files_info),
+        bytes_stored=sum(x["size_stored"] for x in files_info),
+        bytes_original=sum(x["size_original"] for x in files_info),
+    )
+
+    return new_ids
+
+
+def delete_files_in_bulk(project, files, time_deleted=None):
+    """Close the current versions of the files and delete the file rows, one statement each.
+
+    files should be rows with the id, subpath, size_original and size_stored of the files to
+    delete.
+    The session is not committed here - that is up to the caller.
+    """
+    if not files:
+        return
+
+    if time_deleted is None:
+        time_deleted = dds_web.utils.current_time()
+    file_ids = [x.id for x in files]
+
+    # Uses the (active_file, time_deleted) index
+    models.Version.query.filter(
+        sqlalchemy.and_(
+            models.Version.active_file.in_(file_ids),
+            models.Version.time_deleted.is_(None),
+        )
+    ).update({"time_deleted": time_deleted}, synchronize_session=False)
+    models.File.query.filter(models.File.id.in_(file_ids)).delete(synchronize_session=False)
+
+    update_folder_index(project=project, removed=[(x.subpath, x.size_original) for x in files])
+    update_project_counters(
+        project=project,
+        files=-len(files),
+        bytes_stored=-sum(x.size_stored for x in files),
+        bytes_original=-sum(x.size_original for x in files),
+    )
+    project.date_updated = time_deleted
+
+
+def in_folder(folder):
+    """Condition matching the files in a folder or its subfolders.
+
+    Both parts can use the (project_id, subpath) index. LIKE is case insensitive in the
+    database so the subpaths should also be checked in Python if that matters.
+    """
+    like_folder = folder.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return sqlalchemy.or_(
+        models.File.subpath == sqlalchemy.func.binary(folder),
+        models.File.subpath.like(f"{like_folder}{os.sep}%", escape="\\"),
+    )
+
+
+def parent_folders(subpath):
+    """Get all folders a file with the specified subpath is located in, top level first."""
+    subpath = subpath.rstrip(os.sep)
+    if subpath in ["", "."]:
+        return []
+
+    parts = subpath.split(os.sep)
+    return [os.sep.join(parts[: i + 1]) for i in range(len(parts))]
+
+
+def parent_of_folder(folder):
+    """Get the parent of a folder, "." if in the project root."""
+    return folder.rpartition(os.sep)[0] or "."
+
+
+def update_folder_index(project, added=None, removed=None):
+    """Update the folder rows after files have been added to or removed from the project.
+
+    added and removed should be iterables of (subpath, size_original) tuples, one per
+    added or removed file. The session is not committed here - that is up to the caller.
+    """
+    # Number of files and bytes added (positive) or removed (negative) per folder
+    file_changes = collections.Counter()
+    size_changes = collections.Counter()
+    for entries, sign in [(added or [], 1), (removed or [], -1)]:
+        for subpath, size in entries:
+            for folder in parent_folders(subpath):
+                file_changes[folder] += sign
+                size_changes[folder] += sign * size
+
+    changes = {
+        folder: (file_changes[folder], size_changes[folder])
+        for folder in file_changes
+        if file_changes[folder] != 0 or size_changes[folder] != 0
+    }
+    if not changes:
+        return
+
+    # Sorted so that concurrent updates lock the rows in the same order
+    folders = sorted(changes)
+    for i in range(0, len(folders), 1000):
+        batch = folders[i : i + 1000]
+
+        # Create the new folders and add to the existing ones in one statement.
+        # The unique (project_id, path_hash) key makes this safe for concurrent uploads.
+        statement = sqlalchemy.dialects.mysql.insert(models.Folder.__table__)
+        statement = statement.on_duplicate_key_update(
+            num_files=models.Folder.num_files + statement.inserted.num_files,
+            size_original=models.Folder.size_original + statement.inserted.size_original,
+        )
+        db.session.execute(
+            statement,
+            [
+                {
+                    "project_id": project.id,
+                    "path": x,
+                    "path_hash": models.folder_path_hash(x),
+                    "parent": parent_of_folder(x),
+                    "num_files": changes[x][0],
+                    "size_original": changes[x][1],
+                }
+                for x in batch
+            ],
+        )
+
+    # Folders without files do not exist
+    if any(x[0] < 0 for x in changes.values()):
+        models.Folder.query.filter(
+            sqlalchemy.and_(
+                models.Folder.project_id == project.id,
+                models.Folder.num_files <= 0,
+            )
+        ).delete(synchronize_session=False)
+
+
+def rebuild_folder_index(project):
+    """Recreate all folder rows for a project from the files table."""
+    models.Folder.query.filter(models.Folder.project_id == project.id).delete(
+        synchronize_session=False
+    )
+    update_folder_index(
+        project=project,
+        added=models.File.query.filter(models.File.project_id == project.id)
+        .with_entities(models.File.subpath, models.File.size_original)
+        .yield_per(10000),
+    )
+
+
+def update_project_counters(project, files=0, bytes_stored=0, bytes_original=0):
+    """Add to (or subtract from) the number of files and bytes in a project.
+
+    The columns are updated relative to their values in the database, so concurrent changes
+    are not lost. The update is flushed, so that the new values can be read from the project,
+    but not committed - that is up to the caller.
+    """
+    if not (files or bytes_stored or bytes_original):
+        return
+
+    project.file_count = models.Project.file_count + files
+    project.bytes_stored = models.Project.bytes_stored + bytes_stored
+    project.bytes_original = models.Project.bytes_original + bytes_original
+    db.session.flush()
+
+
+def recompute_project_counters(project):
+    """Set the number of files and bytes in a project from the files table."""
+    file_count, bytes_stored, bytes_original = (
+        models.File.query.filter(models.File.project_id == project.id)
+        .with_entities(
+            sqlalchemy.func.count(models.File.id),
+            sqlalchemy.func.coalesce(sqlalchemy.func.sum(models.File.size_stored), 0),
+            sqlalchemy.func.coalesce(sqlalchemy.func.sum(models.File.size_original), 0),
+        )
+        .one()
+    )
+    project.file_count = file_count
+    project.bytes_stored = bytes_stored
+    project.bytes_original = bytes_original
@@ -8,7 +8,6 @@
 import functools
 
 # Installed
-import boto3
 import botocore
 import flask
 import structlog
@@ -17,6 +16,8 @@ import marshmallow
 
 # Own modules
 from dds_web import db
+from dds_web.api import s3_client_pool
+from dds_web.api import storage
 from dds_web.errors import (
     BucketNotFoundError,
     DatabaseError,
@@ -137,13 +138,11 @@ def connect_cloud(func):
 
         try:
             _, self.keys, self.url, self.bucketname = self.get_s3_info()
-            # Connect to service
-            session = boto3.session.Session()
-            self.resource = session.resource(
-                service_name="s3",
-                endpoint_url=self.url,
-                aws_access_key_id=self.keys["access_key"],
-                aws_secret_access_key=self.keys["secret_key"],
+            # Connect to service - reuses the connection for the unit if there is one
+            self.storage = storage.get_backend(
+                endpoint=self.url,
+                access_key=self.keys["access_key"],
+                secret_key=self.keys["secret_key"],
             )
         except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as sqlerr:
             raise DatabaseError(
@@ -170,12 +169,21 @@ def bucket_must_exists(func):
 
     @functools.wraps(func)
     def check_bucket_exists(self, *args, **kwargs):
+        # Only ask S3 if the bucket has not been seen recently
+        if not s3_client_pool.buckets.exists(endpoint=self.url, bucket=self.bucketname):
+            try:
+                self.storage.head_bucket(bucket=self.bucketname)
+            except botocore.client.ClientError as err:
+                raise BucketNotFoundError(message=str(err)) from err
+            s3_client_pool.buckets.add(endpoint=self.url, bucket=self.bucketname)
+
         try:
-            self.resource.meta.client.head_bucket(Bucket=self.bucketname)
+            return func(self, *args, **kwargs)
         except botocore.client.ClientError as err:
-            raise BucketNotFoundError(message=str(err)) from err
-
-        return func(self, *args, **kwargs)
+            # The bucket has been removed since it was cached
+            if err.response.get("Error", {}).get("Code") == "NoSuchBucket":
+                s3_client_pool.buckets.invalidate(endpoint=self.url, bucket=self.bucketname)
+            raise
 
     return check_bucket_exists
 
@@ -5,13 +5,15 @@
 ####################################################################################################
 
 # Standard library
+import itertools
+import json
 import os
-import re
 
 # Installed
 import botocore
 import flask
 import flask_restful
+import marshmallow
 import sqlalchemy
 import werkzeug
 
@@ -21,6 +23,8 @@ from dds_web import auth
 from dds_web.database import models
 from dds_web import db
 from dds_web.api.api_s3_connector import ApiS3Connector
+from dds_web.api import db_tools
+from dds_web.api import project_jobs
 from dds_web.api.dds_decorators import (
     logging_bind_request,
     json_required,
@@ -31,6 +35,7 @@ from dds_web.errors import (
     BucketNotFoundError,
     DatabaseError,
     DDSArgumentError,
+    EmptyProjectException,
     NoSuchFileError,
 )
 from dds_web.api.schemas import file_schemas
@@ -54,6 +59,35 @@ def check_eligibility_for_download(status, user_role):
     raise DDSArgumentError("Current Project status limits file download.")
 
 
+def check_contents_not_removed(project):
+    """Check that the project contents are not being removed by a project job.
+
+    The project is deactivated when the job is queued and stays inactive unless the job fails.
+    """
+    if not project.is_active:
+        raise DDSArgumentError(
+            "The project contents are being removed. Files cannot be uploaded, downloaded or "
+            "modified."
+        )
+    return True
+
+
+def urls_requested():
+    """Check if presigned urls should be included in the file info.
+
+    The urls are skipped if "metadata_only" is set in the query string. They can then be
+    requested just in time with the FileUrls endpoint.
+    """
+    try:
+        metadata_only = marshmallow.fields.Boolean().deserialize(
+            flask.request.args.get("metadata_only", False)
+        )
+    except marshmallow.ValidationError as err:
+        raise DDSArgumentError(message="metadata_only must be a boolean.") from err
+
+    return not metadata_only
+
+
 def check_eligibility_for_deletion(status, has_been_available):
     """Check if a project status is eligible for deletion"""
     if status not in ["In Progress"]:
@@ -85,6 +119,7 @@ class NewFile(flask_restful.Resource):
 
         # Verify that project has correct status for upload
         check_eligibility_for_upload(status=project.current_status)
+        check_contents_not_removed(project=project)
 
         # Create new files
         new_file = file_schemas.NewFileSchema().load(
@@ -92,6 +127,15 @@ class NewFile(flask_restful.Resource):
         )
 
         try:
+            db_tools.update_folder_index(
+                project=project, added=[(new_file.subpath, new_file.size_original)]
+            )
+            db_tools.update_project_counters(
+                project=project,
+                files=1,
+                bytes_stored=new_file.size_stored,
+                bytes_original=new_file.size_original,
+            )
             db.session.commit()
         except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
             flask.current_app.logger.debug(err)
@@ -118,6 +162,7 @@ class NewFile(flask_restful.Resource):
 
         # Verify that projet has correct status for upload
         check_eligibility_for_upload(status=project.current_status)
+        check_contents_not_removed(project=project)
 
         file_info = flask.request.json
         if not all(x in file_info for x in ["name", "name_in_bucket", "subpath", "size"]):
@@ -160,6 +205,18 @@ class NewFile(flask_restful.Resource):
                 if version.time_deleted is None:
                     version.time_deleted = new_timestamp
 
+            # Move the file in the folder index
+            db_tools.update_folder_index(
+                project=project,
+                added=[(file_info.get("subpath"), file_info.get("size"))],
+                removed=[(existing_file.subpath, existing_file.size_original)],
+            )
+            db_tools.update_project_counters(
+                project=project,
+                bytes_stored=(file_info.get("size_processed") or 0) - existing_file.size_stored,
+                bytes_original=(file_info.get("size") or 0) - existing_file.size_original,
+            )
+
             # Update file info
             existing_file.subpath = file_info.get("subpath")
             existing_file.size_original = file_info.get("size")
@@ -199,6 +256,104 @@ class NewFile(flask_restful.Resource):
         return {"message": f"File '{file_info.get('name')}' updated in db."}
 
 
+class NewFileBatch(flask_restful.Resource):
+    """Inserts multiple files into the database in one request."""
+
+    @auth.login_required(role=["Unit Admin", "Unit Personnel"])
+    @logging_bind_request
+    @json_required
+    @handle_validation_errors
+    def post(self):
+        """Add new files to DB."""
+        # Verify project id and access
+        project = project_schemas.ProjectRequiredSchema().load(flask.request.args)
+
+        # Verify that project has correct status for upload
+        check_eligibility_for_upload(status=project.current_status)
+        check_contents_not_removed(project=project)
+
+        files = flask.request.json
+        if not isinstance(files, list):
+            raise DDSArgumentError("A list of files is required.")
+
+        # Validate all entries in one pass
+        valid_files, not_added = self.validate_files(files=files)
+
+        try:
+            # Check for already existing files with one query
+            existing_files = db_tools.get_existing_names(project=project, names=list(valid_files))
+            for name in existing_files:
+                not_added[name] = "File already exists in database."
+                valid_files.pop(name)
+            for name in db_tools.get_uploading_names(project=project, names=list(valid_files)):
+                not_added[name] = "An upload of the file is already in progress."
+                valid_files.pop(name)
+
+            # Insert files and versions in bulk
+            db_tools.insert_files_in_bulk(
+                project=project,
+                files_info=list(valid_files.values()),
+                time_uploaded=dds_web.utils.current_time(),
+            )
+            db.session.commit()
+        except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
+            flask.current_app.logger.debug(err)
+            db.session.rollback()
+            raise DatabaseError(
+                message=str(err),
+                alt_message="Failed to add new files to database"
+                + (
+                    ": Database malfunction."
+                    if isinstance(err, sqlalchemy.exc.OperationalError)
+                    else "."
+                ),
+            ) from err
+
+        return {"added": list(valid_files), "not_added": not_added}
+
+    @staticmethod
+    def validate_files(files):
+        """Validate the file information and return the valid files and the errors."""
+        fileschema = file_schemas.FileInfoSchema()
+        valid_files, not_added = ({}, {})
+        for index, entry in enumerate(files):
+            if not isinstance(entry, dict):
+                not_added[f"Entry {index}"] = "File information must be an object."
+                continue
+
+            # Only strings can be used as keys, other names are reported per entry
+            name = entry.get("name")
+            if not isinstance(name, str) or not name:
+                not_added[f"Entry {index}"] = fileschema.validate(entry) or {
+                    "name": ["The file name must be a string."]
+                }
+                continue
+
+            errors = fileschema.validate(entry)
+            if errors:
+                not_added[name] = errors
+                continue
+
+            if name in valid_files:
+                not_added[name] = "File specified more than once. Only the first entry is added."
+                continue
+
+            file_info = fileschema.load(entry)
+            valid_files[name] = {
+                "name": file_info["name"],
+                "name_in_bucket": file_info["name_in_bucket"],
+                "subpath": file_info["subpath"],
+                "size_original": file_info["size"],
+                "size_stored": file_info["size_processed"],
+                "compressed": file_info["compressed"],
+                "salt": file_info["salt"],
+                "public_key": file_info["public_key"],
+                "checksum": file_info["checksum"],
+            }
+
+        return valid_files, not_added
+
+
 class MatchFiles(flask_restful.Resource):
     """Checks for matching files in database"""
 
@@ -213,6 +368,7 @@ class MatchFiles(flask_restful.Resource):
 
         # Verify project has correct status for upload
         check_eligibility_for_upload(status=project.current_status)
+        check_contents_not_removed(project=project)
 
         # Get files specified
         try:
@@ -287,103 +443,54 @@ class ListFiles(flask_restful.Resource):
         if distinct_folders:
             for x in distinct_folders:
                 info = {
-                    "name": x if subpath == "." else x.split(os.sep)[-1],
+                    "name": x.path if subpath == "." else x.path.split(os.sep)[-1],
                     "folder": True,
                 }
 
+                # Folder sizes and file counts are kept up to date in the folder index
                 if show_size:
-                    folder_size = self.get_folder_size(project=project, folder_name=x)
-                    info.update({"size": float(folder_size)})
+                    info.update({"size": float(x.size_original), "num_files": x.num_files})
                 files_folders.append(info)
 
         return {"files_folders": files_folders}
 
-    def get_folder_size(self, project, folder_name):
-        """Get total size of folder."""
-        # Sum up folder file sizes
-        try:
-            file_info = (
-                models.File.query.with_entities(
-                    sqlalchemy.func.sum(models.File.size_original).label("sizeSum")
-                )
-                .filter(
-                    sqlalchemy.and_(
-                        models.File.project_id == sqlalchemy.func.binary(project.id),
-                        models.File.subpath.like(f"{folder_name}%"),
-                    )
-                )
-                .first()
-            )
-
-        except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
-            raise DatabaseError(
-                message=str(err),
-                alt_message=f"Could not get size of folder '{folder_name}'"
-                + (
-                    ": Database malfunction."
-                    if isinstance(err, sqlalchemy.exc.OperationalError)
-                    else "."
-                ),
-            ) from err
-        return file_info.sizeSum
-
     @staticmethod
     def items_in_subpath(project, folder="."):
         """Get all items in root folder of project."""
         distinct_files = []
         distinct_folders = []
         # Get everything in root:
-        # Files have subpath "." and folders do not have child folders
+        # Files have subpath "." and folders have parent "."
         # Get everything in folder:
-        # Files have subpath == folder and folders have child folders (regexp)
+        # Files have subpath == folder and folders have parent == folder
         if folder[-1] == "/":
             folder = folder[:-1]
         try:
-            # All files in project
-            files = models.File.query.filter(
-                models.File.project_id == sqlalchemy.func.binary(project.id)
-            )
-
-            # File names in root
+            # File names in folder (or root)
             distinct_files = (
-                files.filter(models.File.subpath == sqlalchemy.func.binary(folder))
+                models.File.query.filter(
+                    sqlalchemy.and_(
+                        models.File.project_id == project.id,
+                        models.File.subpath == sqlalchemy.func.binary(folder),
+                    )
+                )
                 .with_entities(models.File.name, models.File.size_original)
                 .all()
             )
 
-            # Folder names in folder (or root)
-            if folder == ".":
-                # Get distinct folders in root, subpath should not be "."
-                distinct_folders = (
-                    files.filter(models.File.subpath != sqlalchemy.func.binary(folder))
-                    .with_entities(models.File.subpath)
-                    .distinct()
-                    .all()
+            # Folders in folder (or root), with their total size and number of files
+            distinct_folders = (
+                models.Folder.query.filter(
+                    sqlalchemy.and_(
+                        models.Folder.project_id == project.id,
+                        models.Folder.parent == sqlalchemy.func.binary(folder),
+                    )
                 )
-
-                # Get first subpath (may be many and first may not have files in)
-                first_parts = set(x[0].split(os.sep)[0] for x in distinct_folders)
-                distinct_folders = list(first_parts)
-
-            else:
-                # Get distinct sub folders in specific folder with regex
-                # Match /<something that is not /> x number of times
-                re_folder = re.escape(folder)
-                distinct_folders = (
-                    files.filter(models.File.subpath.regexp_match(rf"^{re_folder}(/[^/]+)+$"))
-                    .with_entities(models.File.subpath)
-                    .distinct()
-                    .all()
+                .with_entities(
+                    models.Folder.path, models.Folder.size_original, models.Folder.num_files
                 )
-
-                # Get length of specified folder
-                len_folder = len(folder.split(os.sep))
-
-                # Get subfolders in level under specified folder
-                split_paths = set(
-                    f"{os.sep}".join(x[0].split(os.sep)[: len_folder + 1]) for x in distinct_folders
-                )
-                distinct_folders = list(split_paths)
+                .all()
+            )
 
         except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
             raise DatabaseError(
@@ -415,6 +522,7 @@ class RemoveFile(flask_restful.Resource):
         check_eligibility_for_deletion(
             status=project.current_status, has_been_available=project.has_been_available
         )
+        check_contents_not_removed(project=project)
 
         # Delete file(s) from db and cloud
         not_removed_dict, not_exist_list = self.delete_multiple(
@@ -424,100 +532,106 @@ class RemoveFile(flask_restful.Resource):
         # Return deleted and not deleted files
         return {"not_removed": not_removed_dict, "not_exists": not_exist_list}
 
-    def delete_multiple(self, project, files):
-        """Delete multiple files."""
+    def delete_multiple(self, project, files, batch_size: int = 1000):
+        """Delete multiple files, in batches of at most 1000 files (max for s3 delete_objects)."""
 
         not_removed_dict, not_exist_list = ({}, [])
 
+        # Get all requested files with one query
+        names = list(dict.fromkeys(files))
+        try:
+            files_in_db = self.get_files(project=project, names=names)
+        except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
+            flask.current_app.logger.exception(err)
+            message = "Could not collect the remote file name" + (
+                ": Database malfunction."
+                if isinstance(err, sqlalchemy.exc.OperationalError)
+                else "."
+            )
+            return {x: message for x in names}, not_exist_list
+
+        not_exist_list = [x for x in names if x not in files_in_db]
+        found = [x for x in names if x in files_in_db]
+
         with ApiS3Connector(project=project) as s3conn:
-            # Delete each file
-            for entry in files:
-                # Delete from db
-                try:
-                    name_in_bucket = self.delete_one(project=project, filename=entry)
-                    if not name_in_bucket:
-                        raise DatabaseError(
-                            message="Remote file name not found.", pass_message=True
-                        )
-                except FileNotFoundError:
-                    db.session.rollback()
-                    not_exist_list.append(entry)
-                    continue
-                except (
-                    sqlalchemy.exc.SQLAlchemyError,
-                    DatabaseError,
-                    sqlalchemy.exc.OperationalError,
-                ) as err:
-                    db.session.rollback()
-                    flask.current_app.logger.exception(err)
-                    not_removed_dict[entry] = (
-                        str(err)
-                        if isinstance(err, DatabaseError)
-                        else (
-                            "Could not collect the remote file name"
-                            + (
-                                ": Database malfunction."
-                                if isinstance(err, sqlalchemy.exc.OperationalError)
-                                else "."
-                            )
-                        )
-                    )
-                    continue
+            for i in range(0, len(found), batch_size):
+                batch = found[i : i + batch_size]
 
                 # Remove from s3 bucket
                 try:
-                    s3conn.remove_one(file=name_in_bucket)
+                    s3_errors = s3conn.remove_multiple(
+                        items=[files_in_db[x].name_in_bucket for x in batch],
+                        batch_size=batch_size,
+                    )
                 except (BucketNotFoundError, botocore.client.ClientError) as err:
-                    db.session.rollback()
-                    not_removed_dict[entry] = str(err)
+                    not_removed_dict.update({x: str(err) for x in batch})
                     continue
 
-                # Commit to db if ok
+                removed = []
+                for entry in batch:
+                    if files_in_db[entry].name_in_bucket in s3_errors:
+                        not_removed_dict[entry] = s3_errors[files_in_db[entry].name_in_bucket]
+                    else:
+                        removed.append(entry)
+
+                # Remove the batch from db in one transaction
                 try:
+                    db_tools.delete_files_in_bulk(
+                        project=project, files=[files_in_db[x] for x in removed]
+                    )
                     db.session.commit()
                 except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
                     db.session.rollback()
                     flask.current_app.logger.exception(err)
-                    not_removed_dict[entry] = "Could not remove data" + (
-                        ": Database malfunction."
-                        if isinstance(err, sqlalchemy.exc.OperationalError)
-                        else "."
+                    not_removed_dict.update(
+                        {
+                            x: "Could not remove data"
+                            + (
+                                ": Database malfunction."
+                                if isinstance(err, sqlalchemy.exc.OperationalError)
+                                else "."
+                            )
+                            for x in removed
+                        }
                     )
-                    continue
 
         return not_removed_dict, not_exist_list
 
-    def delete_one(self, project, filename):
-        """Delete a single file in project."""
-        # Get matching files in project
-        file = models.File.query.filter(
-            models.File.name == sqlalchemy.func.binary(filename),
-            models.File.project_id == sqlalchemy.func.binary(project.id),
-        ).one_or_none()
-
-        if not file:
-            raise FileNotFoundError("Could not find the specified file.")
-
-        name_in_bucket = file.name_in_bucket
-
-        # get current version
-        current_file_version = models.Version.query.filter(
-            sqlalchemy.and_(
-                models.Version.active_file == sqlalchemy.func.binary(file.id),
-                models.Version.time_deleted.is_(None),
+    @staticmethod
+    def get_files(project, names, batch_size: int = 1000):
+        """Get the id, remote name, subpath and size of the specified files, by file name."""
+        files_in_db = {}
+        for i in range(0, len(names), batch_size):
+            files_in_db.update(
+                {
+                    x.name: x
+                    for x in models.File.query.filter(
+                        sqlalchemy.and_(
+                            models.File.project_id == project.id,
+                            models.File.name.in_(names[i : i + batch_size]),
+                        )
+                    ).with_entities(
+                        models.File.id,
+                        models.File.name,
+                        models.File.name_in_bucket,
+                        models.File.subpath,
+                        models.File.size_original,
+                        models.File.size_stored,
+                    )
+                }
             )
-        ).first()
-        current_file_version.time_deleted = dds_web.utils.current_time()
 
-        db.session.delete(file)
-        project.date_updated = dds_web.utils.current_time()
-
-        return name_in_bucket
+        # The database comparison is case insensitive, file names are not
+        requested = set(names)
+        return {x: y for x, y in files_in_db.items() if x in requested}
 
 
 class RemoveDir(flask_restful.Resource):
     """Removes one or more full directories from the database and s3."""
 
+    # Files per chunk - s3 can only delete 1000 files per request
+    BATCH_SIZE = 1000
+
     @auth.login_required(role=["Unit Admin", "Unit Personnel"])
     @logging_bind_request
     @json_required
@@ -530,37 +644,33 @@ class RemoveDir(flask_restful.Resource):
         check_eligibility_for_deletion(
             status=project.current_status, has_been_available=project.has_been_available
         )
+        check_contents_not_removed(project=project)
 
-        # Remove folder(s)
+        # Remove folder(s), one chunk of files at a time
         not_removed, not_exist = ({}, [])
         fail_type = None
+        nr_deleted_per_chunk = {}
         with ApiS3Connector(project=project) as s3conn:
             for folder_name in flask.request.json:
-                # Get all files in the folder
-                files = self.get_files_for_deletion(project=project, folder=folder_name)
-                if not files:
-                    not_exist.append(folder_name)
-                    continue
+                found = False
+                nr_deleted_per_chunk[folder_name] = []
+                for files in self.get_files_for_deletion(project=project, folder=folder_name):
+                    found = True
 
-                # S3 can only delete 1000 files per request
-                # The deletion will thus be divided into batches of at most 1000 files
-                batch_size: int = 1000
-                for i in range(0, len(files), batch_size):
                     # Delete from s3
-                    bucket_names = tuple(
-                        entry.name_in_bucket for entry in files[i : i + batch_size]
-                    )
                     try:
-                        s3conn.remove_multiple(items=bucket_names, batch_size=batch_size)
-                    except botocore.client.ClientError as err:
+                        s3_errors = s3conn.remove_multiple(
+                            items=[x.name_in_bucket for x in files], batch_size=self.BATCH_SIZE
+                        )
+                    except (BucketNotFoundError, botocore.client.ClientError) as err:
                         not_removed[folder_name] = str(err)
                         fail_type = "s3"
                         break
 
-                    # Commit to db if no error so far
+                    # Commit the files deleted from s3 to db before reading the next chunk
+                    removed = [x for x in files if x.name_in_bucket not in s3_errors]
                     try:
-                        self.queue_file_entry_deletion(files[i : i + batch_size])
-                        project.date_updated = dds_web.utils.current_time()
+                        db_tools.delete_files_in_bulk(project=project, files=removed)
                         db.session.commit()
                     except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
                         db.session.rollback()
@@ -576,57 +686,77 @@ class RemoveDir(flask_restful.Resource):
                         fail_type = "db"
                         break
 
+                    nr_deleted_per_chunk[folder_name].append(len(removed))
+                    if s3_errors:
+                        not_removed[folder_name] = (
+                            f"Could not remove {len(s3_errors)} file(s) in folder from the bucket: "
+                            f"{next(iter(s3_errors.values()))}"
+                        )
+                        fail_type = "s3"
+                        break
+
+                if not found:
+                    not_exist.append(folder_name)
+                    nr_deleted_per_chunk.pop(folder_name)
+
+        # The deleted chunks are committed - a failed deletion can be resumed by running it again
         return {
             "not_removed": not_removed,
             "fail_type": fail_type,
             "not_exists": not_exist,
-            "nr_deleted": len(files) if not not_removed else i,
+            "nr_deleted": sum(sum(x) for x in nr_deleted_per_chunk.values()),
+            "nr_deleted_per_chunk": nr_deleted_per_chunk,
         }
 
-    def get_files_for_deletion(self, project: str, folder: str):
-        """Get all file entries from db"""
+    def get_files_for_deletion(self, project, folder: str):
+        """Yield the files in a folder and its subfolders, in chunks ordered by subpath and id.
+
+        The chunks are read one at a time with keyset pagination on (subpath, id), so each chunk
+        is found with the (project_id, subpath) index, only one chunk is in memory and the files
+        in it can be deleted before the next one is read.
+        """
         if folder[-1] == "/":
             folder = folder[:-1]
-        re_folder = re.escape(folder)
-        try:
-            # File names in root
-            files = (
-                models.File.query.filter(
-                    models.File.project_id == sqlalchemy.func.binary(project.id)
-                )
-                .filter(
-                    sqlalchemy.or_(
-                        models.File.subpath == sqlalchemy.func.binary(folder),
-                        models.File.subpath.regexp_match(rf"^{re_folder}(/[^/]+)*$"),
-                    )
-                )
-                .all()
+
+        query = models.File.query.filter(
+            sqlalchemy.and_(
+                models.File.project_id == project.id,
+                db_tools.in_folder(folder=folder),
             )
-        except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
-            raise DatabaseError(
-                message=str(err),
-                alt_message="Could not collect files for deletion"
-                + (
-                    ": Database malfunction."
-                    if isinstance(err, sqlalchemy.exc.OperationalError)
-                    else "."
-                ),
-            ) from err
+        ).with_entities(
+            models.File.id,
+            models.File.name_in_bucket,
+            models.File.subpath,
+            models.File.size_original,
+            models.File.size_stored,
+        )
+        rows = dds_web.utils.keyset_query(
+            query,
+            key=models.File.subpath,
+            tiebreaker=models.File.id,
+            page_size=self.BATCH_SIZE,
+        )
+        while True:
+            try:
+                chunk = list(itertools.islice(rows, self.BATCH_SIZE))
+            except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
+                raise DatabaseError(
+                    message=str(err),
+                    alt_message="Could not collect files for deletion"
+                    + (
+                        ": Database malfunction."
+                        if isinstance(err, sqlalchemy.exc.OperationalError)
+                        else "."
+                    ),
+                ) from err
 
-        return files
+            if not chunk:
+                return
 
-    def queue_file_entry_deletion(self, files: list):
-        """Prepare queries in the db session for deletion of files in the database."""
-        for entry in files:
-            # get current version
-            current_file_version = models.Version.query.filter(
-                sqlalchemy.and_(
-                    models.Version.active_file == sqlalchemy.func.binary(entry.id),
-                    models.Version.time_deleted.is_(None),
-                )
-            ).first()
-            current_file_version.time_deleted = dds_web.utils.current_time()
-            db.session.delete(entry)
+            # LIKE is case insensitive in the database, folder names are not
+            files = [x for x in chunk if x.subpath == folder or x.subpath.startswith(f"{folder}/")]
+            if files:
+                yield files
 
 
 class FileInfo(flask_restful.Resource):
@@ -644,11 +774,12 @@ class FileInfo(flask_restful.Resource):
         # Verify project status ok for download
         user_role = auth.current_user().role
         check_eligibility_for_download(status=project.current_status, user_role=user_role)
+        check_contents_not_removed(project=project)
 
         # Get project contents
         input_ = {
             "project": project.public_id,
-            **{"requested_items": flask.request.json, "url": True},
+            **{"requested_items": flask.request.json, "url": urls_requested()},
         }
         (
             found_files,
@@ -666,6 +797,22 @@ class FileInfo(flask_restful.Resource):
 class FileInfoAll(flask_restful.Resource):
     """Get info on all project files."""
 
+    # Number of files per page - default and max
+    DEFAULT_PAGE_SIZE = 1000
+    MAX_PAGE_SIZE = 10000
+
+    # File info returned for each file
+    INFO_COLUMNS = (
+        "name_in_bucket",
+        "subpath",
+        "size_original",
+        "size_stored",
+        "salt",
+        "public_key",
+        "checksum",
+        "compressed",
+    )
+
     @auth.login_required(role=["Unit Admin", "Unit Personnel", "Project Owner", "Researcher"])
     @logging_bind_request
     @handle_validation_errors
@@ -677,13 +824,207 @@ class FileInfoAll(flask_restful.Resource):
         # Verify project status ok for download
         user_role = auth.current_user().role
         check_eligibility_for_download(status=project.current_status, user_role=user_role)
+        check_contents_not_removed(project=project)
+
+        # Sign urls unless only metadata requested
+        url = urls_requested()
+
+        extra_args = flask.request.json
+        if extra_args is None:
+            extra_args = {}
+
+        # Stream one json object per line (NDJSON)
+        if extra_args.get("stream"):
+            # Check what can be checked before the response, and its status code, has started
+            if self.files_query(project=project).first() is None:
+                raise EmptyProjectException(project=project.public_id)
+            s3 = ApiS3Connector(project=project).connect() if url else None
+
+            return flask.Response(
+                flask.stream_with_context(self.stream_files(project=project, s3=s3, url=url)),
+                mimetype="application/x-ndjson",
+            )
+
+        # Return one page of files, starting after the file id in the cursor
+        if "limit" in extra_args or "cursor" in extra_args:
+            return self.get_page(
+                project=project,
+                cursor=extra_args.get("cursor"),
+                limit=extra_args.get("limit", self.DEFAULT_PAGE_SIZE),
+                url=url,
+            )
 
         files, _, _ = project_schemas.ProjectContentSchema().dump(
-            {"project": project.public_id, "get_all": True, "url": True}
+            {"project": project.public_id, "get_all": True, "url": url}
         )
 
         return {"files": files}
 
+    def files_query(self, project, cursor=None):
+        """Query for the project files ordered by id, optionally only the ones after the cursor."""
+        query = models.File.query.filter(models.File.project_id == project.id)
+        if cursor is not None:
+            query = query.filter(models.File.id > cursor)
+
+        return query.order_by(models.File.id).with_entities(
+            models.File.id, models.File.name, *(getattr(models.File, x) for x in self.INFO_COLUMNS)
+        )
+
+    def file_info(self, row, url):
+        """Get the info and the signed url for a file row."""
+        return {**{x: getattr(row, x) for x in self.INFO_COLUMNS}, "url": url}
+
+    def get_page(self, project, cursor, limit, url=True):
+        """Get info on one page of files, ordered by file id.
+
+        The returned next_cursor should be passed as cursor to get the following page.
+        It is None when there are no more files.
+        """
+        if cursor is not None and (not isinstance(cursor, int) or isinstance(cursor, bool)):
+            raise DDSArgumentError(message="The cursor must be an integer.")
+        if (
+            not isinstance(limit, int)
+            or isinstance(limit, bool)
+            or not 0 < limit <= self.MAX_PAGE_SIZE
+        ):
+            raise DDSArgumentError(
+                message=f"The limit must be an integer between 1 and {self.MAX_PAGE_SIZE}."
+            )
+
+        try:
+            rows = self.files_query(project=project, cursor=cursor).limit(limit).all()
+        except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
+            raise DatabaseError(
+                message=str(err),
+                alt_message="Could not get the project files"
+                + (
+                    ": Database malfunction."
+                    if isinstance(err, sqlalchemy.exc.OperationalError)
+                    else "."
+                ),
+            ) from err
+
+        if not rows and cursor is None:
+            raise EmptyProjectException(project=project.public_id)
+
+        urls = {}
+        if rows and url:
+            with ApiS3Connector(project=project) as s3:
+                urls = s3.generate_get_urls(keys=[x.name_in_bucket for x in rows])
+        files = {x.name: self.file_info(row=x, url=urls.get(x.name_in_bucket)) for x in rows}
+
+        return {
+            "files": files,
+            "next_cursor": rows[-1].id if len(rows) == limit else None,
+        }
+
+    def stream_files(self, project, s3, url=True):
+        """Yield the info on all files as json lines, read from the database in chunks.
+
+        The last line is {"complete": true, "num_files": <number of files>}. Errors after the
+        response has started cannot change the status code, so they end the stream with
+        {"complete": false, "error": <message>} instead. s3 should be a connected ApiS3Connector,
+        it is only needed if urls are requested.
+        """
+        num_files = 0
+        try:
+            # yield_per streams the results with a server side cursor
+            rows = iter(self.files_query(project=project).yield_per(self.DEFAULT_PAGE_SIZE))
+            while True:
+                chunk = list(itertools.islice(rows, self.DEFAULT_PAGE_SIZE))
+                if not chunk:
+                    break
+
+                # Sign the urls for one chunk at a time
+                urls = {}
+                if url:
+                    urls = s3.generate_get_urls(keys=[x.name_in_bucket for x in chunk])
+                for row in chunk:
+                    info = self.file_info(row=row, url=urls.get(row.name_in_bucket))
+                    yield json.dumps({"name": row.name, **info}) + "\n"
+                    num_files += 1
+        except (
+            sqlalchemy.exc.SQLAlchemyError,
+            sqlalchemy.exc.OperationalError,
+            botocore.client.ClientError,
+        ) as err:
+            flask.current_app.logger.exception(err)
+            yield json.dumps(
+                {"complete": False, "error": "Could not get the info on all project files."}
+            ) + "\n"
+            return
+
+        yield json.dumps({"complete": True, "num_files": num_files}) + "\n"
+
+
+class FileUrls(flask_restful.Resource):
+    """Issue presigned urls just in time for files listed in metadata only mode."""
+
+    # Max number of urls per request
+    MAX_KEYS = 10000
+
+    @auth.login_required(role=["Unit Admin", "Unit Personnel", "Project Owner", "Researcher"])
+    @logging_bind_request
+    @json_required
+    @handle_validation_errors
+    def get(self):
+        """Get presigned urls for the specified name_in_bucket keys."""
+        # Verify project ID and access
+        project = project_schemas.ProjectRequiredSchema().load(flask.request.args)
+
+        # Verify project status ok for download
+        user_role = auth.current_user().role
+        check_eligibility_for_download(status=project.current_status, user_role=user_role)
+        check_contents_not_removed(project=project)
+
+        keys = flask.request.json
+        if not isinstance(keys, list) or not all(isinstance(x, str) for x in keys):
+            raise DDSArgumentError("A list of file keys (name_in_bucket) is required.")
+        if len(keys) > self.MAX_KEYS:
+            raise DDSArgumentError(f"Urls can be requested for at most {self.MAX_KEYS} files.")
+
+        # Only sign urls for files in the project
+        existing_keys = self.get_existing_keys(project=project, keys=list(set(keys)))
+
+        urls = {}
+        if existing_keys:
+            with ApiS3Connector(project=project) as s3:
+                urls = s3.generate_get_urls(keys=sorted(existing_keys))
+
+        return {
+            "urls": urls,
+            "not_found": sorted(set(keys).difference(existing_keys)),
+        }
+
+    @staticmethod
+    def get_existing_keys(project, keys, batch_size: int = 1000):
+        """Get the keys which belong to files in the project."""
+        existing = set()
+        try:
+            for i in range(0, len(keys), batch_size):
+                existing.update(
+                    x.name_in_bucket
+                    for x in models.File.query.filter(
+                        sqlalchemy.and_(
+                            models.File.project_id == project.id,
+                            models.File.name_in_bucket.in_(keys[i : i + batch_size]),
+                        )
+                    ).with_entities(models.File.name_in_bucket)
+                )
+        except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
+            raise DatabaseError(
+                message=str(err),
+                alt_message="Could not get the file keys"
+                + (
+                    ": Database malfunction."
+                    if isinstance(err, sqlalchemy.exc.OperationalError)
+                    else "."
+                ),
+            ) from err
+
+        # The database comparison is case insensitive, the keys are not
+        return existing.intersection(keys)
+
 
 class UpdateFile(flask_restful.Resource):
     """Update file info after download"""
@@ -696,6 +1037,7 @@ class UpdateFile(flask_restful.Resource):
         """Update info in db."""
         # Verify project ID and access
         project = project_schemas.ProjectRequiredSchema().load(flask.request.args)
+        check_contents_not_removed(project=project)
 
         # Get file name from request from CLI
         file_name = flask.request.json.get("name")
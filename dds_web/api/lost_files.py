@@ -0,0 +1,226 @@
+"""Find files which are in the bucket of a project or in the database, but not both."""
+
+####################################################################################################
+# IMPORTS ################################################################################ IMPORTS #
+####################################################################################################
+
+# Standard library
+import concurrent.futures
+
+# Installed
+import botocore
+import flask
+import sqlalchemy
+
+# Own modules
+import dds_web.utils
+from dds_web import db
+from dds_web.api import db_tools
+from dds_web.api import storage
+from dds_web.database import models
+
+####################################################################################################
+# GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
+####################################################################################################
+
+BATCH_SIZE = 1000  # keys per list, query and delete request
+
+####################################################################################################
+# FUNCTIONS ############################################################################ FUNCTIONS #
+####################################################################################################
+
+
+def in_order(keys, source):
+    """Pass on the keys, checking that they are sorted like in S3 (by their UTF-8 bytes).
+
+    The merge join would report wrong files otherwise.
+    """
+    previous = None
+    for key in keys:
+        encoded = key.encode("utf-8")
+        if previous is not None and encoded <= previous:
+            raise ValueError(f"Keys from {source} are not in S3 order: '{key}'")
+        previous = encoded
+        yield key
+
+
+def s3_keys(storage, bucket, page_size=BATCH_SIZE):
+    """Generate the keys in a bucket, in S3 order, one page in memory at a time."""
+    for keys in storage.list_pages(bucket=bucket, page_size=page_size):
+        yield from keys
+
+
+def db_keys(project_id, batch_size=BATCH_SIZE):
+    """Generate the bucket names of the files in a project, in S3 order.
+
+    Streams the result of one ordered query, with its own connection so that the session can
+    be used while the keys are read.
+    """
+    query = (
+        sqlalchemy.select(models.File.name_in_bucket)
+        .where(models.File.project_id == project_id)
+        .order_by(sqlalchemy.func.binary(models.File.name_in_bucket))
+    )
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query)
+        for rows in iter(lambda: result.fetchmany(batch_size), []):
+            for row in rows:
+                yield row.name_in_bucket
+
+
+def merge_diff(s3, database):
+    """Compare two streams of keys in S3 order.
+
+    Generates ("s3", key) for keys only in S3 and ("db", key) for keys only in the database.
+    """
+    s3 = in_order(keys=s3, source="s3")
+    database = in_order(keys=database, source="the database")
+    s3_key = next(s3, None)
+    db_key = next(database, None)
+    while s3_key is not None or db_key is not None:
+        if db_key is None or (s3_key is not None and s3_key.encode() < db_key.encode()):
+            yield "s3", s3_key
+            s3_key = next(s3, None)
+        elif s3_key is None or db_key.encode() < s3_key.encode():
+            yield "db", db_key
+            db_key = next(database, None)
+        else:
+            s3_key = next(s3, None)
+            db_key = next(database, None)
+
+
+def delete_s3_objects(storage, bucket, keys):
+    """Delete objects which are not in the database, returns the errors per key."""
+    return storage.delete_objects(bucket=bucket, keys=keys)
+
+
+def delete_db_files(project_id, keys):
+    """Delete files which are not in the bucket, and close their versions."""
+    project = models.Project.query.get(project_id)
+    exact_keys = set(keys)
+    files = [
+        x
+        for x in models.File.query.filter(
+            sqlalchemy.and_(
+                models.File.project_id == project_id,
+                models.File.name_in_bucket.in_(keys),
+            )
+        ).with_entities(
+            models.File.id,
+            models.File.name_in_bucket,
+            models.File.subpath,
+            models.File.size_original,
+            models.File.size_stored,
+        )
+        if x.name_in_bucket in exact_keys
+    ]
+    try:
+        db_tools.delete_files_in_bulk(project=project, files=files)
+        db.session.commit()
+    except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError):
+        db.session.rollback()
+        raise
+
+
+def reconcile_project(project, delete=False, emit=None):
+    """Compare the bucket of a project with the database, and optionally remove the lost files.
+
+    project is a dict with the project and unit info, see reconcile. Each lost file is passed
+    to emit. Returns a summary for the project, with the objects which could not be deleted and
+    their errors in not_deleted.
+    """
+    summary = {
+        "unit": project["unit"],
+        "project": project["public_id"],
+        "bucket": project["bucket"],
+        "in_db_only": 0,
+        "in_s3_only": 0,
+        "deleted": delete,
+        "not_deleted": {},
+        "error": None,
+    }
+    backend = storage.get_backend(
+        endpoint=project["endpoint"],
+        access_key=project["access_key"],
+        secret_key=project["secret_key"],
+    )
+
+    to_delete = {"s3": [], "db": []}
+
+    def flush(source):
+        if not to_delete[source]:
+            return
+        if source == "s3":
+            summary["not_deleted"].update(
+                delete_s3_objects(storage=backend, bucket=project["bucket"], keys=to_delete[source])
+            )
+        else:
+            delete_db_files(project_id=project["id"], keys=to_delete[source])
+        to_delete[source] = []
+
+    try:
+        for source, key in merge_diff(
+            s3=s3_keys(storage=backend, bucket=project["bucket"]),
+            database=db_keys(project_id=project["id"]),
+        ):
+            summary["in_s3_only" if source == "s3" else "in_db_only"] += 1
+            if emit is not None:
+                emit(
+                    {
+                        **{k: summary[k] for k in ["unit", "project", "bucket"]},
+                        "key": key,
+                        "in": source,
+                    }
+                )
+
+            if delete:
+                to_delete[source].append(key)
+                if len(to_delete[source]) >= BATCH_SIZE:
+                    flush(source=source)
+
+        for source in to_delete:
+            flush(source=source)
+    except botocore.exceptions.ClientError as err:
+        summary["error"] = err.response.get("Error", {}).get("Code") or str(err)
+    except (ValueError, sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
+        summary["error"] = str(err)
+
+    return summary
+
+
+def reconcile(delete=False, workers=4, emit=None):
+    """Compare all projects with their buckets, several projects at a time.
+
+    Generates one summary per project, in the order they finish.
+    """
+    projects = [
+        {
+            "id": project.id,
+            "public_id": project.public_id,
+            "bucket": project.bucket,
+            "unit": unit.public_id,
+            "endpoint": unit.safespring_endpoint,
+            "access_key": unit.safespring_access,
+            "secret_key": unit.safespring_secret,
+        }
+        for project, unit in dds_web.utils.keyset_query(
+            db.session.query(models.Project, models.Unit).join(
+                models.Unit, models.Unit.id == models.Project.unit_id
+            ),
+            key=models.Project.id,
+        )
+    ]
+    app = flask.current_app._get_current_object()
+
+    def run(project):
+        # Each thread has its own app context and database session
+        with app.app_context():
+            try:
+                return reconcile_project(project=project, delete=delete, emit=emit)
+            finally:
+                db.session.remove()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run, project) for project in projects]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
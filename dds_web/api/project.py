@@ -19,6 +19,8 @@ import marshmallow
 import dds_web.utils
 from dds_web import auth, db
 from dds_web.database import models
+from dds_web.api import project_jobs
+from dds_web.api import project_listing
 from dds_web.api.api_s3_connector import ApiS3Connector
 from dds_web.api.dds_decorators import (
     logging_bind_request,
@@ -88,13 +90,34 @@ class ProjectStatus(flask_restful.Resource):
         if not new_status:
             raise DDSArgumentError(message="No status transition provided. Specify the new status.")
 
+        # Lock the project until the change is committed, so that concurrent requests are
+        # checked one at a time and only one job can be queued
+        project = (
+            db.session.query(models.Project)
+            .filter(models.Project.id == project.id)
+            .with_for_update()
+            .populate_existing()
+            .one()
+        )
+
+        # No other changes while the contents are being removed
+        if project_jobs.unfinished_job(project=project):
+            raise DDSArgumentError(
+                message=(
+                    "The project contents are being removed. Check the progress with the "
+                    "project job status."
+                )
+            )
+
+        # Removing the contents can take long, so it is done by a project job
+        if new_status in ["Deleted", "Archived"]:
+            return self.queue_removal(project=project, new_status=new_status, json_input=json_input)
+
         # Override default to send email
         send_email = json_input.get("send_email", True)
 
         # Initial variable definition
         curr_date = dds_web.utils.current_time()
-        delete_message = ""
-        is_aborted = False
 
         # Moving to Available
         if new_status == "Available":
@@ -109,15 +132,6 @@ class ProjectStatus(flask_restful.Resource):
             new_status_row = self.expire_project(
                 project=project, current_time=curr_date, deadline_in=deadline_in
             )
-        elif new_status == "Deleted":
-            new_status_row, delete_message = self.delete_project(
-                project=project, current_time=curr_date
-            )
-        elif new_status == "Archived":
-            is_aborted = json_input.get("is_aborted", False)
-            new_status_row, delete_message = self.archive_project(
-                project=project, current_time=curr_date, aborted=is_aborted
-            )
         else:
             raise DDSArgumentError(message="Invalid status")
 
@@ -146,18 +160,57 @@ class ProjectStatus(flask_restful.Resource):
                     userobj=user.researchuser, mail_type="project_release", project=project
                 )
 
-        return_message = f"{project.public_id} updated to status {new_status}" + (
-            " (aborted)" if new_status == "Archived" and is_aborted else ""
-        )
+        return_message = f"{project.public_id} updated to status {new_status}"
 
         if new_status != "Available":
-            return_message += delete_message + "."
+            return_message += "."
         else:
             return_message += (
                 f". An e-mail notification has{' not ' if not send_email else ' '}been sent."
             )
         return {"message": return_message}
 
+    def queue_removal(self, project, new_status, json_input):
+        """Check that the project can be deleted or archived and queue the job doing it."""
+        is_aborted = False
+        if new_status == "Deleted":
+            self.check_delete_possible(project=project)
+        else:
+            is_aborted = json_input.get("is_aborted", False)
+            self.check_archive_possible(project=project, aborted=is_aborted)
+
+        try:
+            job = project_jobs.enqueue(
+                project=project,
+                new_status=new_status,
+                is_aborted=is_aborted,
+                requested_by=auth.current_user().username,
+            )
+            db.session.commit()
+        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+            flask.current_app.logger.exception(err)
+            db.session.rollback()
+            raise DatabaseError(
+                message=str(err),
+                alt_message=(
+                    "Status was not updated"
+                    + (
+                        ": Database malfunction."
+                        if isinstance(err, sqlalchemy.exc.OperationalError)
+                        else ": Server Error."
+                    )
+                ),
+            ) from err
+
+        return {
+            "message": (
+                f"{project.public_id} will be updated to status {new_status}"
+                + (" (aborted)" if new_status == "Archived" and is_aborted else "")
+                + " when all files have been deleted."
+            ),
+            "job_id": job.id,
+        }
+
     def check_transition_possible(self, current_status, new_status):
         """Check if the transition is valid."""
         valid_statuses = {
@@ -263,11 +316,8 @@ class ProjectStatus(flask_restful.Resource):
             status="Expired", date_created=current_time, deadline=deadline
         )
 
-    def delete_project(self, project: models.Project, current_time: datetime.datetime):
-        """Delete project: Make status Deleted.
-
-        Only possible from In Progress.
-        """
+    def check_delete_possible(self, project: models.Project):
+        """Check that the project can be deleted: Only possible from In Progress."""
         # Check if valid status transition
         self.check_transition_possible(current_status=project.current_status, new_status="Deleted")
 
@@ -277,11 +327,19 @@ class ProjectStatus(flask_restful.Resource):
                 "You cannot delete a project that has been made available previously. "
                 "Please abort the project if you wish to proceed."
             )
-        project.is_active = False
+
+    def delete_project(self, project: models.Project, current_time: datetime.datetime, job=None):
+        """Delete project: Make status Deleted.
+
+        Only possible from In Progress.
+        """
+        self.check_delete_possible(project=project)
 
         try:
             # Deletes files (also commits session in the function - possibly refactor later)
-            RemoveContents().delete_project_contents(project=project)
+            # No changes are flushed before, so no rows are locked while the bucket is emptied
+            RemoveContents().delete_project_contents(project=project, job=job)
+            project.is_active = False
             self.rm_project_user_keys(project=project)
 
             # Delete metadata from project row
@@ -299,14 +357,9 @@ class ProjectStatus(flask_restful.Resource):
 
         return models.ProjectStatuses(status="Deleted", date_created=current_time), delete_message
 
-    def archive_project(
-        self, project: models.Project, current_time: datetime.datetime, aborted: bool = False
-    ):
-        """Archive project: Make status Archived.
-
-        Only possible from In Progress, Available and Expired. Optional aborted flag if something
-        has gone wrong.
-        """
+    def check_archive_possible(self, project: models.Project, aborted: bool = False):
+        """Check that the project can be archived: Only possible from In Progress, Available and
+        Expired."""
         # Check if valid status transition
         self.check_transition_possible(current_status=project.current_status, new_status="Archived")
         if project.current_status == "In Progress":
@@ -315,11 +368,26 @@ class ProjectStatus(flask_restful.Resource):
                     "You cannot archive a project that has been made available previously. "
                     "Please abort the project if you wish to proceed."
                 )
-        project.is_active = False
+
+    def archive_project(
+        self,
+        project: models.Project,
+        current_time: datetime.datetime,
+        aborted: bool = False,
+        job=None,
+    ):
+        """Archive project: Make status Archived.
+
+        Only possible from In Progress, Available and Expired. Optional aborted flag if something
+        has gone wrong.
+        """
+        self.check_archive_possible(project=project, aborted=aborted)
 
         try:
             # Deletes files (also commits session in the function - possibly refactor later)
-            RemoveContents().delete_project_contents(project=project)
+            # No changes are flushed before, so no rows are locked while the bucket is emptied
+            RemoveContents().delete_project_contents(project=project, job=job)
+            project.is_active = False
             delete_message = f"\nAll files in {project.public_id} deleted"
             self.rm_project_user_keys(project=project)
 
@@ -359,6 +427,32 @@ class ProjectStatus(flask_restful.Resource):
             db.session.delete(user)
 
 
+class ProjectJobStatus(flask_restful.Resource):
+    """Get the status and progress of the jobs deleting or archiving a project."""
+
+    @auth.login_required(role=["Unit Admin", "Unit Personnel"])
+    @logging_bind_request
+    @handle_validation_errors
+    def get(self):
+        """Get a project job, the latest one if no job_id is specified."""
+        # Verify project ID and access
+        project = project_schemas.ProjectRequiredSchema().load(flask.request.args)
+
+        query = models.ProjectJob.query.filter(models.ProjectJob.project_id == project.id)
+        job_id = flask.request.args.get("job_id")
+        if job_id is not None:
+            try:
+                query = query.filter(models.ProjectJob.id == int(job_id))
+            except ValueError as err:
+                raise DDSArgumentError(message="The job ID must be an integer.") from err
+
+        job = query.order_by(models.ProjectJob.id.desc()).first()
+        if not job:
+            raise DDSArgumentError(message="There is no such job for the project.")
+
+        return project_jobs.job_info(job=job)
+
+
 class GetPublic(flask_restful.Resource):
     """Gets the public key beloning to the current project."""
 
@@ -409,6 +503,7 @@ class UserProjects(flask_restful.Resource):
 
     @auth.login_required
     @logging_bind_request
+    @handle_validation_errors
     def get(self):
         """Get info regarding all projects which user is involved in."""
         return self.format_project_dict(current_user=auth.current_user())
@@ -416,69 +511,52 @@ class UserProjects(flask_restful.Resource):
     def format_project_dict(self, current_user):
         """Given a logged in user, fetch projects and return as dict.
 
+        The projects can be filtered, sorted and paged, see ProjectListingSchema. The totals
+        are for the projects returned.
+
         Also used by web/user.py projects_info()
         """
         # TODO: Return different things depending on if unit or not
-        all_projects = list()
 
         # Total number of GB hours and cost saved in the db for the specific unit
         total_bhours_db = 0.0
         total_cost_db = 0.0
         total_size = 0
 
-        usage_arg = flask.request.json.get("usage") if flask.request.json else False
-        usage = bool(usage_arg) and current_user.role in [
+        options = project_schemas.ProjectListingSchema().load(flask.request.json or {})
+        usage = options.pop("usage") and current_user.role in [
             "Super Admin",
             "Unit Admin",
             "Unit Personnel",
         ]
 
-        # Get info for all projects
-        for p in current_user.projects:
-            project_info = {
-                "Project ID": p.public_id,
-                "Title": p.title,
-                "PI": p.pi,
-                "Status": p.current_status,
-                "Last updated": p.date_updated if p.date_updated else p.date_created,
-            }
-
-            # Get proj size and update total size
-            proj_size = p.size
-            total_size += proj_size
-            project_info["Size"] = proj_size
-
-            if usage:
-                proj_bhours, proj_cost = self.project_usage(project=p)
-                total_bhours_db += proj_bhours
-                total_cost_db += proj_cost
-                # return ByteHours
-                project_info.update({"Usage": proj_bhours, "Cost": proj_cost})
-
-            try:
-                project_info["Access"] = (
-                    models.ProjectUserKeys.query.filter_by(
-                        project_id=p.id, user_id=current_user.username
-                    ).count()
-                    > 0
-                )
-            except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
-                raise DatabaseError(
-                    message=str(err),
-                    alt_message=(
-                        "Could not get users project access information."
-                        + (
-                            ": Database malfunction."
-                            if isinstance(err, sqlalchemy.exc.OperationalError)
-                            else "."
-                        ),
+        # Get info for the requested projects
+        try:
+            all_projects, next_cursor = project_listing.list_projects(
+                user=current_user, usage=usage, **options
+            )
+        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+            raise DatabaseError(
+                message=str(err),
+                alt_message=(
+                    "Could not get the project information."
+                    + (
+                        ": Database malfunction."
+                        if isinstance(err, sqlalchemy.exc.OperationalError)
+                        else "."
                     ),
-                ) from err
+                ),
+            ) from err
 
-            all_projects.append(project_info)
+        for project_info in all_projects:
+            total_size += project_info["Size"]
+            if usage:
+                total_bhours_db += project_info["Usage"]
+                total_cost_db += project_info["Cost"]
 
         return_info = {
             "project_info": all_projects,
+            "next_cursor": next_cursor,
             "total_size": total_size,
             "always_show": current_user.role in ["Super Admin", "Unit Admin", "Unit Personnel"],
         }
@@ -493,27 +571,8 @@ class UserProjects(flask_restful.Resource):
 
     @staticmethod
     def project_usage(project):
-
-        bhours = 0.0
-        cost = 0.0
-
-        for v in project.file_versions:
-            # Calculate hours of the current file
-            time_deleted = v.time_deleted if v.time_deleted else dds_web.utils.current_time()
-            time_uploaded = v.time_uploaded
-
-            file_hours = (time_deleted - time_uploaded).seconds / (60 * 60)
-
-            # Calculate BHours
-            bhours += v.size_stored * file_hours
-
-            # Calculate approximate cost per gbhour: kr per gb per month / (days * hours)
-            cost_gbhour = 0.09 / (30 * 24)
-
-            # Save file cost to project info and increase total unit cost
-            cost += bhours / 1e9 * cost_gbhour
-
-        return bhours, cost
+        """Calculate the byte hours and approximate cost of a project."""
+        return project_listing.versions_usage(versions=project.file_versions)
 
 
 class RemoveContents(flask_restful.Resource):
@@ -534,7 +593,7 @@ class RemoveContents(flask_restful.Resource):
         )
 
         # Check if project contains anything
-        if not project.files:
+        if not models.File.query.filter(models.File.project_id == project.id).first():
             raise EmptyProjectException(
                 project=project, message="There are no project contents to delete."
             )
@@ -545,20 +604,41 @@ class RemoveContents(flask_restful.Resource):
         return {"removed": True}
 
     @staticmethod
-    def delete_project_contents(project):
-        """Remove project contents"""
+    def delete_project_contents(project, job=None):
+        """Remove project contents.
+
+        When run by a project job, the bucket teardown continues from the checkpoint of the job
+        and the progress is saved in it.
+        """
+        # A job which is run again may have removed the bucket before it was interrupted
+        teardown_started = job is not None and (job.checkpoint is not None or job.objects_deleted)
+
         # Delete from cloud
         with ApiS3Connector(project=project) as s3conn:
             try:
-                s3conn.remove_bucket()
-            except botocore.client.ClientError as err:
-                raise DeletionError(message=str(err), project=project.public_id) from err
+                if job is None:
+                    s3conn.remove_bucket()
+                else:
+                    s3conn.remove_bucket(
+                        checkpoint=job.checkpoint,
+                        on_checkpoint=project_jobs.progress_saver(job=job),
+                    )
+            except (BucketNotFoundError, botocore.client.ClientError) as err:
+                # BucketNotFoundError is raised from the ClientError of head_bucket
+                client_error = err.__cause__ if isinstance(err, BucketNotFoundError) else err
+                code = getattr(client_error, "response", {}).get("Error", {}).get("Code")
+                if not (teardown_started and code in ["404", "NoSuchBucket"]):
+                    if isinstance(err, BucketNotFoundError):
+                        raise
+                    raise DeletionError(message=str(err), project=project.public_id) from err
+
+                flask.current_app.logger.info(
+                    f"Bucket of project {project.public_id} already removed, removing the files"
+                )
 
-        # If ok delete from database
+        # If ok delete from database - one statement per table
         try:
-            models.File.query.filter(models.File.project_id == project.id).delete()
-            # TODO: put in class
-            project.date_updated = dds_web.utils.current_time()
+            current_time = dds_web.utils.current_time()
 
             # Update all versions associated with project
             models.Version.query.filter(
@@ -566,7 +646,17 @@ class RemoveContents(flask_restful.Resource):
                     models.Version.project_id == project.id,
                     models.Version.time_deleted.is_(None),
                 )
-            ).update({"time_deleted": dds_web.utils.current_time()})
+            ).update({"time_deleted": current_time}, synchronize_session=False)
+
+            models.File.query.filter(models.File.project_id == project.id).delete(
+                synchronize_session=False
+            )
+            models.Folder.query.filter(models.Folder.project_id == project.id).delete(
+                synchronize_session=False
+            )
+            project.file_count = project.bytes_stored = project.bytes_original = 0
+            # TODO: put in class
+            project.date_updated = current_time
         except (
             sqlalchemy.exc.SQLAlchemyError,
             sqlalchemy.exc.OperationalError,
@@ -580,7 +670,7 @@ class RemoveContents(flask_restful.Resource):
                     "database. Please contact SciLifeLab Data Centre."
                     + (
                         "Database malfunction."
-                        if isinstance(err, sqlalchemy.exc.OperationalError)
+                        if isinstance(sqlerr, sqlalchemy.exc.OperationalError)
                         else "."
                     )
                 ),
@@ -621,7 +711,7 @@ class CreateProject(flask_restful.Resource):
         # This is a quick fix so that things do not break
         with ApiS3Connector(project=new_project) as s3:
             try:
-                s3.resource.create_bucket(Bucket=new_project.bucket)
+                s3.create_bucket()
             except (
                 botocore.exceptions.ClientError,
                 botocore.exceptions.ParamValidationError,
@@ -0,0 +1,229 @@
+"""Queue of project deletions and archivals, processed by a worker."""
+
+####################################################################################################
+# IMPORTS ################################################################################ IMPORTS #
+####################################################################################################
+
+# Standard library
+import contextlib
+import datetime
+import threading
+
+# Installed
+import flask
+import sqlalchemy
+
+# Own modules
+import dds_web.utils
+from dds_web import db
+from dds_web.database import models
+from dds_web.errors import LoggedHTTPException
+
+####################################################################################################
+# GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
+####################################################################################################
+
+# A running job without a heartbeat for this long is assumed to be interrupted, and is resumed
+STALE_AFTER = datetime.timedelta(minutes=15)
+
+# How often a running job updates its heartbeat, whether or not the teardown makes progress
+HEARTBEAT_INTERVAL = datetime.timedelta(minutes=1)
+
+####################################################################################################
+# FUNCTIONS ############################################################################ FUNCTIONS #
+####################################################################################################
+
+
+def enqueue(project, new_status, is_aborted=False, requested_by=None):
+    """Add a job removing the project contents, the project status is changed when it is done.
+
+    The project is deactivated straight away. The caller commits the session.
+    """
+    job = models.ProjectJob(
+        new_status=new_status,
+        is_aborted=is_aborted,
+        requested_by=requested_by,
+        status="Queued",
+        created=dds_web.utils.current_time(),
+    )
+    project.jobs.append(job)
+    project.is_active = False
+    db.session.flush()
+
+    return job
+
+
+def unfinished_job(project):
+    """Get the queued or running job for the project, if any."""
+    return (
+        models.ProjectJob.query.filter(
+            sqlalchemy.and_(
+                models.ProjectJob.project_id == project.id,
+                models.ProjectJob.status.in_(["Queued", "Running"]),
+            )
+        )
+        .order_by(models.ProjectJob.id.desc())
+        .first()
+    )
+
+
+def job_info(job):
+    """Get the status and progress of a job."""
+    return {
+        "job_id": job.id,
+        "new_status": job.new_status,
+        "is_aborted": job.is_aborted,
+        "status": job.status,
+        "created": job.created,
+        "started": job.started,
+        "finished": job.finished,
+        "objects_deleted": job.objects_deleted,
+        "error": job.error,
+    }
+
+
+def claim_next_job():
+    """Mark the oldest queued (or interrupted) job as running and return it.
+
+    The status is changed with a conditional update, so a job is only claimed by one worker.
+    """
+    while True:
+        now = dds_web.utils.current_time()
+        claimable = sqlalchemy.or_(
+            models.ProjectJob.status == "Queued",
+            sqlalchemy.and_(
+                models.ProjectJob.status == "Running",
+                models.ProjectJob.heartbeat < now - STALE_AFTER,
+            ),
+        )
+        candidate = (
+            models.ProjectJob.query.filter(claimable)
+            .with_entities(models.ProjectJob.id)
+            .order_by(models.ProjectJob.id)
+            .first()
+        )
+        if candidate is None:
+            return None
+
+        claimed = models.ProjectJob.query.filter(
+            sqlalchemy.and_(models.ProjectJob.id == candidate.id, claimable)
+        ).update(
+            {"status": "Running", "started": now, "last_update": now, "heartbeat": now},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if claimed:
+            return models.ProjectJob.query.get(candidate.id)
+
+
+def progress_saver(job):
+    """Get a callback saving the bucket teardown checkpoint of the job.
+
+    The callback is called from the teardown threads, so it uses its own connection.
+    """
+    engine = db.engine
+    job_id = job.id
+    deleted_before = job.objects_deleted or 0
+
+    def save_progress(checkpoint, deleted):
+        with engine.begin() as conn:
+            conn.execute(
+                sqlalchemy.update(models.ProjectJob.__table__)
+                .where(models.ProjectJob.__table__.c.id == job_id)
+                .values(
+                    checkpoint=checkpoint,
+                    objects_deleted=deleted_before + deleted,
+                    last_update=dds_web.utils.current_time(),
+                )
+            )
+
+    return save_progress
+
+
+@contextlib.contextmanager
+def heartbeat(job, interval=HEARTBEAT_INTERVAL):
+    """Update the heartbeat of a running job every interval until the block is left.
+
+    The heartbeat is updated from a thread with its own connection, so that a job is not
+    claimed by another worker while it is running, also when its checkpoint does not move.
+    """
+    engine = db.engine
+    logger = flask.current_app.logger
+    job_id = job.id
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(timeout=interval.total_seconds()):
+            try:
+                with engine.begin() as conn:
+                    conn.execute(
+                        sqlalchemy.update(models.ProjectJob.__table__)
+                        .where(models.ProjectJob.__table__.c.id == job_id)
+                        .values(heartbeat=dds_web.utils.current_time())
+                    )
+            except sqlalchemy.exc.SQLAlchemyError as err:
+                logger.warning(f"Heartbeat of project job {job_id} not updated: {err}")
+
+    thread = threading.Thread(target=beat, name=f"project-job-{job_id}-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_job(job):
+    """Remove the project contents and add the new project status, or mark the job as failed."""
+    from dds_web.api.project import ProjectStatus
+
+    project = job.project
+    status = ProjectStatus()
+    try:
+        with heartbeat(job=job):
+            if job.new_status == "Deleted":
+                new_status_row, _ = status.delete_project(
+                    project=project, current_time=dds_web.utils.current_time(), job=job
+                )
+            else:
+                new_status_row, _ = status.archive_project(
+                    project=project,
+                    current_time=dds_web.utils.current_time(),
+                    aborted=job.is_aborted,
+                    job=job,
+                )
+        project.project_statuses.append(new_status_row)
+        job.status = "Done"
+        job.finished = job.last_update = dds_web.utils.current_time()
+        db.session.commit()
+    except (
+        sqlalchemy.exc.SQLAlchemyError,
+        sqlalchemy.exc.OperationalError,
+        LoggedHTTPException,
+    ) as err:
+        flask.current_app.logger.exception(err)
+        db.session.rollback()
+
+        # The project keeps its current status and can be deleted or archived again
+        job.status = "Failed"
+        job.error = getattr(err, "description", None) or str(err)
+        job.finished = job.last_update = dds_web.utils.current_time()
+        project.is_active = True
+        db.session.commit()
+
+    return job
+
+
+def process_jobs(max_jobs=None):
+    """Run queued jobs, oldest first, until there are none left or max_jobs have been run."""
+    processed = []
+    while max_jobs is None or len(processed) < max_jobs:
+        job = claim_next_job()
+        if job is None:
+            break
+        flask.current_app.logger.info(
+            "Project job %s: %s project %s", job.id, job.new_status, job.project.public_id
+        )
+        processed.append(run_job(job))
+
+    return processed
@@ -0,0 +1,251 @@
+"""Information about many projects at a time, with a fixed number of queries."""
+
+####################################################################################################
+# IMPORTS ################################################################################ IMPORTS #
+####################################################################################################
+
+# Standard library
+import base64
+import datetime
+import json
+
+# Installed
+import sqlalchemy
+
+# Own modules
+import dds_web.utils
+from dds_web import db
+from dds_web.database import models
+
+####################################################################################################
+# GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
+####################################################################################################
+
+BATCH_SIZE = 1000  # project ids per query
+MAX_PAGE_SIZE = 1000
+
+STATUSES = ["In Progress", "Available", "Expired", "Deleted", "Archived"]
+SORT_KEYS = ["id", "created", "updated", "title", "pi", "status"]
+
+####################################################################################################
+# FUNCTIONS ############################################################################ FUNCTIONS #
+####################################################################################################
+
+
+def in_batches(ids, batch_size=BATCH_SIZE):
+    """Split a list of ids into lists small enough for an IN clause."""
+    for i in range(0, len(ids), batch_size):
+        yield ids[i : i + batch_size]
+
+
+def user_projects_query(user):
+    """Get a query for the projects a user can see, the same ones as user.projects."""
+    if user.role == "Super Admin":
+        query = models.Project.query
+    elif user.role == "Researcher":
+        query = models.Project.query.join(
+            models.ProjectUsers, models.ProjectUsers.project_id == models.Project.id
+        ).filter(models.ProjectUsers.user_id == user.username)
+    else:
+        query = models.Project.query.filter(models.Project.unit_id == user.unit_id)
+
+    return query
+
+
+def sort_columns():
+    """Get the expressions the listing can be sorted by, none of them NULL."""
+    return {
+        "id": models.Project.id,
+        "created": models.Project.date_created,
+        "updated": sqlalchemy.func.coalesce(
+            models.Project.date_updated, models.Project.date_created
+        ),
+        "title": sqlalchemy.func.coalesce(models.Project.title, ""),
+        "pi": sqlalchemy.func.coalesce(models.Project.pi, ""),
+        "status": sqlalchemy.func.coalesce(models.Project.current_status, ""),
+    }
+
+
+def encode_cursor(sort, descending, value, project_id):
+    """Make the opaque cursor pointing after a project in a listing."""
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    cursor = json.dumps({"sort": sort, "descending": descending, "value": value, "id": project_id})
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Get the sort key, direction, sort value and project id in a cursor.
+
+    Raises ValueError for cursors not made by encode_cursor.
+    """
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        sort, descending, value, project_id = (
+            decoded["sort"],
+            decoded["descending"],
+            decoded["value"],
+            int(decoded["id"]),
+        )
+        if sort not in SORT_KEYS:
+            raise ValueError(sort)
+        if sort in ["created", "updated"]:
+            value = datetime.datetime.fromisoformat(value)
+        elif sort == "id":
+            value = int(value)
+    except (ValueError, TypeError, KeyError, AttributeError) as err:
+        raise ValueError("Invalid cursor.") from err
+
+    return {"sort": sort, "descending": bool(descending), "value": value, "id": project_id}
+
+
+def projects_with_access(user, project_ids):
+    """Get the ids of the projects which the user has a project key for."""
+    with_access = set()
+    for batch in in_batches(project_ids):
+        with_access.update(
+            x.project_id
+            for x in models.ProjectUserKeys.query.filter(
+                sqlalchemy.and_(
+                    models.ProjectUserKeys.user_id == user.username,
+                    models.ProjectUserKeys.project_id.in_(batch),
+                )
+            ).with_entities(models.ProjectUserKeys.project_id)
+        )
+
+    return with_access
+
+
+def versions_usage(versions, now=None):
+    """Calculate the byte hours and approximate cost of file versions.
+
+    versions are rows (or objects) with size_stored, time_uploaded and time_deleted.
+    """
+    now = now or dds_web.utils.current_time()
+    bhours = 0.0
+    cost = 0.0
+    for v in versions:
+        # Calculate hours of the current file
+        time_deleted = v.time_deleted if v.time_deleted else now
+        file_hours = (time_deleted - v.time_uploaded).seconds / (60 * 60)
+
+        # Calculate BHours
+        bhours += v.size_stored * file_hours
+
+        # Calculate approximate cost per gbhour: kr per gb per month / (days * hours)
+        cost_gbhour = 0.09 / (30 * 24)
+
+        # Save file cost to project info and increase total unit cost
+        cost += bhours / 1e9 * cost_gbhour
+
+    return bhours, cost
+
+
+def usage_per_project(project_ids, now=None):
+    """Get the byte hours and cost of each project, by project id."""
+    now = now or dds_web.utils.current_time()
+    versions = {x: [] for x in project_ids}
+    for batch in in_batches(project_ids):
+        for row in (
+            models.Version.query.filter(models.Version.project_id.in_(batch))
+            .with_entities(
+                models.Version.project_id,
+                models.Version.size_stored,
+                models.Version.time_uploaded,
+                models.Version.time_deleted,
+            )
+            .order_by(models.Version.id)
+        ):
+            versions[row.project_id].append(row)
+
+    return {x: versions_usage(versions=rows, now=now) for x, rows in versions.items()}
+
+
+def list_projects(
+    user,
+    usage=False,
+    statuses=None,
+    active_only=False,
+    created_after=None,
+    created_before=None,
+    updated_after=None,
+    updated_before=None,
+    pi=None,
+    sort="id",
+    descending=False,
+    limit=None,
+    cursor=None,
+):
+    """Get the listing info of the projects the user can see.
+
+    The filters, sorting and paging are done in the database, on the status summary columns of
+    the projects, so only the projects on the requested page are loaded. cursor is a decoded
+    cursor from a previous page, see decode_cursor. Returns a dict per project with the status,
+    size, access and optionally usage, and the cursor of the next page (None on the last page).
+    """
+    sort_value = sort_columns()[sort]
+    updated = sort_columns()["updated"]
+
+    query = user_projects_query(user=user).add_columns(sort_value.label("sort_value"))
+
+    conditions = []
+    if statuses:
+        conditions.append(models.Project.current_status.in_(statuses))
+    if active_only:
+        conditions.append(models.Project.is_active.is_(True))
+    if created_after:
+        conditions.append(models.Project.date_created >= created_after)
+    if created_before:
+        conditions.append(models.Project.date_created < created_before)
+    if updated_after:
+        conditions.append(updated >= updated_after)
+    if updated_before:
+        conditions.append(updated < updated_before)
+    if pi:
+        conditions.append(models.Project.pi == pi)
+    if cursor:
+        conditions.append(
+            dds_web.utils.keyset_condition(
+                key=sort_value,
+                last_key=cursor["value"],
+                tiebreaker=models.Project.id,
+                last_tiebreaker=cursor["id"],
+                descending=descending,
+            )
+        )
+    if conditions:
+        query = query.filter(sqlalchemy.and_(*conditions))
+
+    if descending:
+        query = query.order_by(sort_value.desc(), models.Project.id.desc())
+    else:
+        query = query.order_by(sort_value, models.Project.id)
+
+    rows = query.limit(limit + 1).all() if limit else query.all()
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(
+            sort=sort, descending=descending, value=rows[-1].sort_value, project_id=rows[-1][0].id
+        )
+
+    project_ids = [x[0].id for x in rows]
+    with_access = projects_with_access(user=user, project_ids=project_ids)
+    usages = usage_per_project(project_ids=project_ids) if usage else {}
+
+    listing = []
+    for p, _ in rows:
+        info = {
+            "Project ID": p.public_id,
+            "Title": p.title,
+            "PI": p.pi,
+            "Status": p.current_status,
+            "Last updated": p.date_updated if p.date_updated else p.date_created,
+            "Size": p.size,
+        }
+        if usage:
+            info["Usage"], info["Cost"] = usages[p.id]
+        info["Access"] = p.id in with_access
+        listing.append(info)
+
+    return listing, next_cursor
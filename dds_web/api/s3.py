@@ -5,22 +5,40 @@
 ####################################################################################################
 
 # Standard library
+import itertools
 
 # Installed
+import botocore
 import flask_restful
 import flask
 import sqlalchemy
 
 # Own modules
-from dds_web import auth
+import dds_web.utils
+from dds_web import auth, db
+from dds_web.api import db_tools
 from dds_web.api.api_s3_connector import ApiS3Connector
-from dds_web.api.dds_decorators import logging_bind_request, handle_validation_errors
+from dds_web.api.dds_decorators import (
+    logging_bind_request,
+    handle_validation_errors,
+    json_required,
+)
+from dds_web.database import models
 from dds_web.errors import (
     S3ProjectNotFoundError,
+    S3ConnectionError,
     DatabaseError,
+    DDSArgumentError,
 )
-from dds_web.api.schemas import project_schemas
-from dds_web.api.files import check_eligibility_for_upload
+from dds_web.api.schemas import file_schemas, project_schemas
+from dds_web.api.files import check_contents_not_removed, check_eligibility_for_upload
+
+####################################################################################################
+# GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
+####################################################################################################
+
+MAX_PART_NUMBER = 10000  # S3 limit
+MAX_PARTS_PER_REQUEST = 1000  # Presigned part urls per request
 
 ####################################################################################################
 # ENDPOINTS ############################################################################ ENDPOINTS #
@@ -39,6 +57,7 @@ class S3Info(flask_restful.Resource):
         project = project_schemas.ProjectRequiredSchema().load(flask.request.args)
 
         check_eligibility_for_upload(status=project.current_status)
+        check_contents_not_removed(project=project)
 
         try:
             sfsp_proj, keys, url, bucketname = ApiS3Connector(project=project).get_s3_info()
@@ -62,3 +81,330 @@ class S3Info(flask_restful.Resource):
             "keys": keys,
             "bucket": bucketname,
         }
+
+
+class MultipartUpload(flask_restful.Resource):
+    """Starts and aborts multipart uploads of large files."""
+
+    @auth.login_required(role=["Unit Admin", "Unit Personnel"])
+    @logging_bind_request
+    @json_required
+    @handle_validation_errors
+    def post(self):
+        """Start a multipart upload.
+
+        The file information is saved and the file is added to the database when the upload
+        is completed.
+        """
+        project = project_schemas.ProjectRequiredSchema().load(flask.request.args)
+        check_eligibility_for_upload(status=project.current_status)
+        check_contents_not_removed(project=project)
+
+        file_info = file_schemas.FileInfoSchema().load(flask.request.json)
+        if db_tools.get_existing_names(project=project, names=[file_info["name"]]):
+            raise DDSArgumentError(f"File '{file_info['name']}' already exists in the database.")
+
+        # Lock the project until the upload is saved, so that only one upload per file is started
+        project = (
+            db.session.query(models.Project)
+            .filter(models.Project.id == project.id)
+            .with_for_update()
+            .populate_existing()
+            .one()
+        )
+        open_upload = next(
+            (
+                x
+                for x in models.MultipartUpload.query.filter(
+                    sqlalchemy.and_(
+                        models.MultipartUpload.project_id == project.id,
+                        models.MultipartUpload.name == file_info["name"],
+                    )
+                )
+                # The database comparison is case insensitive, file names are not
+                if x.name == file_info["name"]
+            ),
+            None,
+        )
+        if open_upload:
+            raise DDSArgumentError(
+                f"An upload of '{file_info['name']}' is already in progress "
+                f"(upload id {open_upload.upload_id}). Complete or abort it first."
+            )
+
+        try:
+            with ApiS3Connector(project=project) as s3conn:
+                upload_id = s3conn.create_multipart_upload(key=file_info["name_in_bucket"])
+        except botocore.client.ClientError as err:
+            db.session.rollback()
+            raise S3ConnectionError(message=str(err)) from err
+
+        try:
+            project.multipart_uploads.append(
+                models.MultipartUpload(
+                    upload_id=upload_id,
+                    started_by=auth.current_user().username,
+                    created=dds_web.utils.current_time(),
+                    name=file_info["name"],
+                    name_in_bucket=file_info["name_in_bucket"],
+                    subpath=file_info["subpath"],
+                    size_original=file_info["size"],
+                    size_stored=file_info["size_processed"],
+                    compressed=file_info["compressed"],
+                    public_key=file_info["public_key"],
+                    salt=file_info["salt"],
+                    checksum=file_info["checksum"],
+                )
+            )
+            db.session.commit()
+        except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
+            db.session.rollback()
+
+            # Nothing else knows about the upload, so it would never be aborted
+            try:
+                with ApiS3Connector(project=project) as s3conn:
+                    s3conn.abort_multipart_upload(
+                        key=file_info["name_in_bucket"], upload_id=upload_id
+                    )
+            except (
+                botocore.exceptions.BotoCoreError,
+                botocore.client.ClientError,
+                S3ConnectionError,
+                DatabaseError,
+            ) as s3err:
+                flask.current_app.logger.warning(
+                    f"Could not abort the unsaved multipart upload {upload_id}: {s3err}"
+                )
+
+            raise DatabaseError(
+                message=str(err),
+                alt_message="Failed to save the multipart upload"
+                + (
+                    ": Database malfunction."
+                    if isinstance(err, sqlalchemy.exc.OperationalError)
+                    else "."
+                ),
+            ) from err
+
+        return {"upload_id": upload_id, "name_in_bucket": file_info["name_in_bucket"]}
+
+    @auth.login_required(role=["Unit Admin", "Unit Personnel"])
+    @logging_bind_request
+    @json_required
+    @handle_validation_errors
+    def delete(self):
+        """Abort a multipart upload, the uploaded parts are removed."""
+        project = project_schemas.ProjectRequiredSchema().load(flask.request.args)
+        upload = get_multipart_upload(
+            project=project, upload_id=flask.request.json.get("upload_id")
+        )
+
+        try:
+            with ApiS3Connector(project=project) as s3conn:
+                s3conn.abort_multipart_upload(key=upload.name_in_bucket, upload_id=upload.upload_id)
+        except botocore.client.ClientError as err:
+            raise S3ConnectionError(message=str(err)) from err
+
+        try:
+            db.session.delete(upload)
+            db.session.commit()
+        except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
+            db.session.rollback()
+            raise DatabaseError(
+                message=str(err),
+                alt_message="Failed to remove the multipart upload"
+                + (
+                    ": Database malfunction."
+                    if isinstance(err, sqlalchemy.exc.OperationalError)
+                    else "."
+                ),
+            ) from err
+
+        return {"message": f"Upload of '{upload.name}' aborted."}
+
+
+class MultipartUploadUrls(flask_restful.Resource):
+    """Gets presigned urls for uploading the parts of a multipart upload."""
+
+    @auth.login_required(role=["Unit Admin", "Unit Personnel"])
+    @logging_bind_request
+    @json_required
+    @handle_validation_errors
+    def post(self):
+        """Get presigned urls for the requested part numbers."""
+        project = project_schemas.ProjectRequiredSchema().load(flask.request.args)
+        check_eligibility_for_upload(status=project.current_status)
+        check_contents_not_removed(project=project)
+        upload = get_multipart_upload(
+            project=project, upload_id=flask.request.json.get("upload_id")
+        )
+
+        part_numbers = flask.request.json.get("part_numbers")
+        if (
+            not isinstance(part_numbers, list)
+            or not part_numbers
+            or not all(
+                isinstance(x, int) and not isinstance(x, bool) and 1 <= x <= MAX_PART_NUMBER
+                for x in part_numbers
+            )
+        ):
+            raise DDSArgumentError(
+                f"A list of part numbers between 1 and {MAX_PART_NUMBER} is required."
+            )
+        if len(part_numbers) > MAX_PARTS_PER_REQUEST:
+            raise DDSArgumentError(
+                f"At most {MAX_PARTS_PER_REQUEST} part urls can be requested at a time."
+            )
+
+        with ApiS3Connector(project=project) as s3conn:
+            urls = s3conn.generate_upload_part_urls(
+                key=upload.name_in_bucket, upload_id=upload.upload_id, part_numbers=part_numbers
+            )
+
+        return {"urls": {str(x): url for x, url in urls.items()}}
+
+
+class MultipartUploadComplete(flask_restful.Resource):
+    """Completes multipart uploads and adds the files to the database."""
+
+    @auth.login_required(role=["Unit Admin", "Unit Personnel"])
+    @logging_bind_request
+    @json_required
+    @handle_validation_errors
+    def post(self):
+        """Combine the uploaded parts and add the file to the database."""
+        project = project_schemas.ProjectRequiredSchema().load(flask.request.args)
+        check_eligibility_for_upload(status=project.current_status)
+        check_contents_not_removed(project=project)
+        parts = flask.request.json.get("parts")
+        if (
+            not isinstance(parts, list)
+            or not parts
+            or not all(
+                isinstance(x, dict) and x.get("part_number") and x.get("etag") for x in parts
+            )
+        ):
+            raise DDSArgumentError("A list of parts with part numbers and ETags is required.")
+
+        # The upload is locked until the file is added, a concurrent request for the same upload
+        # waits and then finds it removed
+        upload = get_multipart_upload(
+            project=project, upload_id=flask.request.json.get("upload_id"), lock=True
+        )
+        if db_tools.get_existing_names(project=project, names=[upload.name]):
+            db.session.rollback()
+            raise DDSArgumentError(f"File '{upload.name}' already exists in the database.")
+
+        try:
+            with ApiS3Connector(project=project) as s3conn:
+                s3conn.complete_multipart_upload(
+                    key=upload.name_in_bucket, upload_id=upload.upload_id, parts=parts
+                )
+        except botocore.client.ClientError as err:
+            db.session.rollback()
+            raise S3ConnectionError(message=str(err)) from err
+
+        try:
+            db_tools.insert_files_in_bulk(
+                project=project,
+                files_info=[
+                    {
+                        "name": upload.name,
+                        "name_in_bucket": upload.name_in_bucket,
+                        "subpath": upload.subpath,
+                        "size_original": upload.size_original,
+                        "size_stored": upload.size_stored,
+                        "compressed": upload.compressed,
+                        "public_key": upload.public_key,
+                        "salt": upload.salt,
+                        "checksum": upload.checksum,
+                    }
+                ],
+                time_uploaded=dds_web.utils.current_time(),
+            )
+            db.session.delete(upload)
+            db.session.commit()
+        except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
+            db.session.rollback()
+            raise DatabaseError(
+                message=str(err),
+                alt_message="Failed to add new file to database"
+                + (
+                    ": Database malfunction."
+                    if isinstance(err, sqlalchemy.exc.OperationalError)
+                    else "."
+                ),
+            ) from err
+
+        return {"message": f"File '{upload.name}' added to db."}
+
+
+####################################################################################################
+# FUNCTIONS ############################################################################ FUNCTIONS #
+####################################################################################################
+
+
+def get_multipart_upload(project, upload_id, lock=False):
+    """Get an unfinished multipart upload in the project.
+
+    With lock, the row is locked until the end of the transaction and read again, so that an
+    upload completed or aborted by another request is not found.
+    """
+    if not upload_id or not isinstance(upload_id, str):
+        raise DDSArgumentError("Upload id required.")
+
+    query = models.MultipartUpload.query.filter(
+        sqlalchemy.and_(
+            models.MultipartUpload.project_id == project.id,
+            models.MultipartUpload.upload_id == sqlalchemy.func.binary(upload_id),
+        )
+    )
+    if lock:
+        query = query.with_for_update().populate_existing()
+    upload = query.one_or_none()
+    if not upload:
+        raise DDSArgumentError("There is no such multipart upload in the project.")
+
+    return upload
+
+
+def abort_stale_multipart_uploads(older_than):
+    """Abort the multipart uploads started before older_than, and remove them from the database.
+
+    Returns the number of aborted uploads and a dict with the errors per upload id.
+    """
+    stale = (
+        models.MultipartUpload.query.filter(models.MultipartUpload.created < older_than)
+        .order_by(models.MultipartUpload.project_id)
+        .all()
+    )
+
+    aborted, errors = (0, {})
+    for project, uploads in itertools.groupby(stale, key=lambda x: x.project):
+        removed = 0
+        try:
+            with ApiS3Connector(project=project) as s3conn:
+                for upload in uploads:
+                    try:
+                        s3conn.abort_multipart_upload(
+                            key=upload.name_in_bucket, upload_id=upload.upload_id
+                        )
+                    except (botocore.exceptions.BotoCoreError, botocore.client.ClientError) as err:
+                        # Also connection errors and timeouts, the next uploads are still tried
+                        errors[upload.upload_id] = str(err)
+                        continue
+                    db.session.delete(upload)
+                    removed += 1
+            db.session.commit()
+        except (
+            sqlalchemy.exc.SQLAlchemyError,
+            sqlalchemy.exc.OperationalError,
+            S3ConnectionError,
+            DatabaseError,
+        ) as err:
+            db.session.rollback()
+            errors[project.public_id] = str(err)
+        else:
+            aborted += removed
+
+    return aborted, errors
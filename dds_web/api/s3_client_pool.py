@@ -0,0 +1,210 @@
+"""Process wide pool of S3 connections and caches of existing buckets and unit S3 settings."""
+
+####################################################################################################
+# IMPORTS ################################################################################ IMPORTS #
+####################################################################################################
+
+# Standard library
+import threading
+import time
+
+# Installed
+import boto3
+import botocore.config
+
+####################################################################################################
+# GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
+####################################################################################################
+
+BUCKET_CACHE_TTL = 60  # seconds
+UNIT_INFO_CACHE_TTL = 300  # seconds
+
+# HTTP connections per client (botocore default 10). The threads sharing a client, e.g. the
+# update-uploaded-file workers (16 by default) and a bucket teardown (8), each need one, otherwise
+# the requests wait for a free connection.
+MAX_POOL_CONNECTIONS = 32
+
+####################################################################################################
+# CLASSES ################################################################################ CLASSES #
+####################################################################################################
+
+
+class S3ClientPool:
+    """Reuses S3 clients, one per endpoint and access key.
+
+    Creating a boto3 session and client is expensive and every new botocore client opens its
+    own HTTP connections. Low level botocore clients are thread safe, so one client per unit is
+    shared by all requests and threads in the process. boto3 resources are not thread safe and
+    are not pooled - create them from the client's session in the thread using them if needed.
+    """
+
+    def __init__(self):
+        # (endpoint, access key) -> (secret key, client)
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_client(self, endpoint, access_key, secret_key):
+        """Get the S3 client for the credentials, created on the first use."""
+        key = (endpoint, access_key)
+        with self._lock:
+            secret, client = self._clients.get(key, (None, None))
+            if client is not None and secret == secret_key:
+                self.hits += 1
+                return client
+
+            # Not created yet or the secret key has changed
+            self.misses += 1
+            session = boto3.session.Session()
+            client = session.client(
+                service_name="s3",
+                endpoint_url=endpoint,
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                config=botocore.config.Config(max_pool_connections=MAX_POOL_CONNECTIONS),
+            )
+            self._clients[key] = (secret_key, client)
+
+        return client
+
+    def invalidate(self, endpoint, access_key):
+        """Remove the client for the credentials, e.g. when they have been changed."""
+        with self._lock:
+            self._clients.pop((endpoint, access_key), None)
+
+    def clear(self):
+        """Remove all clients and reset the statistics."""
+        with self._lock:
+            self._clients.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Get the number of pooled clients, hits and misses."""
+        with self._lock:
+            return {"size": len(self._clients), "hits": self.hits, "misses": self.misses}
+
+
+class BucketCache:
+    """Remembers for a short time which buckets are known to exist.
+
+    Saves a head_bucket request before each object operation. Buckets are added when they have
+    been checked or created and removed when they are deleted or reported missing by S3.
+    """
+
+    def __init__(self, ttl=BUCKET_CACHE_TTL):
+        self.ttl = ttl
+        # (endpoint, bucket) -> time the bucket was last seen
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def exists(self, endpoint, bucket):
+        """Check if the bucket has been seen within the ttl."""
+        with self._lock:
+            seen = self._buckets.get((endpoint, bucket))
+            if seen is not None and time.monotonic() - seen < self.ttl:
+                self.hits += 1
+                return True
+
+            self.misses += 1
+            self._buckets.pop((endpoint, bucket), None)
+            return False
+
+    def add(self, endpoint, bucket):
+        """Mark the bucket as existing."""
+        with self._lock:
+            self._buckets[(endpoint, bucket)] = time.monotonic()
+
+    def invalidate(self, endpoint, bucket):
+        """Forget the bucket, e.g. when it has been deleted."""
+        with self._lock:
+            self._buckets.pop((endpoint, bucket), None)
+
+    def clear(self):
+        """Forget all buckets and reset the statistics."""
+        with self._lock:
+            self._buckets.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Get the number of cached buckets, hits and misses."""
+        with self._lock:
+            return {"size": len(self._buckets), "hits": self.hits, "misses": self.misses}
+
+
+class UnitInfoCache:
+    """Keeps the S3 settings (endpoint, name and keys) of the units for a while.
+
+    The settings are needed for every S3 operation but are almost never changed. Each unit has a
+    version which is increased when the settings are invalidated, so settings which were read
+    from the database before an invalidation are not cached afterwards. Other processes see
+    changes when the ttl has passed.
+    """
+
+    def __init__(self, ttl=UNIT_INFO_CACHE_TTL):
+        self.ttl = ttl
+        # unit id -> (version, time loaded, settings)
+        self._units = {}
+        # unit id -> version, and the version for all units
+        self._versions = {}
+        self._all_version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _version(self, unit_id):
+        return (self._all_version, self._versions.get(unit_id, 0))
+
+    def get(self, unit_id, load):
+        """Get the settings of a unit, load() is called to read them if they are not cached."""
+        with self._lock:
+            version = self._version(unit_id=unit_id)
+            cached_version, loaded, info = self._units.get(unit_id, (None, None, None))
+            if cached_version == version and time.monotonic() - loaded < self.ttl:
+                self.hits += 1
+                return info
+            self.misses += 1
+
+        info = load()
+
+        with self._lock:
+            # Not cached if the unit has been invalidated while loading
+            if info is not None and self._version(unit_id=unit_id) == version:
+                self._units[unit_id] = (version, time.monotonic(), info)
+
+        return info
+
+    def invalidate(self, unit_id=None):
+        """Forget the settings of a unit, or of all units, e.g. when they have been changed."""
+        with self._lock:
+            if unit_id is None:
+                self._all_version += 1
+                self._units.clear()
+            else:
+                self._versions[unit_id] = self._versions.get(unit_id, 0) + 1
+                self._units.pop(unit_id, None)
+
+    def clear(self):
+        """Forget all units and reset the statistics."""
+        self.invalidate()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Get the number of cached units, hits and misses."""
+        with self._lock:
+            return {"size": len(self._units), "hits": self.hits, "misses": self.misses}
+
+
+####################################################################################################
+# GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
+####################################################################################################
+
+pool = S3ClientPool()
+buckets = BucketCache()
+units = UnitInfoCache()
@@ -11,6 +11,7 @@ import sqlalchemy
 # Own modules
 from dds_web.database import models
 import dds_web.utils
+import dds_web.api.db_tools
 from dds_web.api.schemas import project_schemas
 
 ####################################################################################################
@@ -18,8 +19,11 @@ from dds_web.api.schemas import project_schemas
 ####################################################################################################
 
 
-class NewFileSchema(project_schemas.ProjectRequiredSchema):
-    """Validates and creates a new file object."""
+class FileInfoSchema(marshmallow.Schema):
+    """Validates the information required to register a file."""
+
+    class Meta:
+        unknown = marshmallow.EXCLUDE
 
     # Length minimum 1 required, required=True accepts empty string
     name = marshmallow.fields.String(
@@ -101,6 +105,10 @@ class NewFileSchema(project_schemas.ProjectRequiredSchema):
         },
     )
 
+
+class NewFileSchema(project_schemas.ProjectRequiredSchema, FileInfoSchema):
+    """Validates and creates a new file object."""
+
     @marshmallow.validates_schema(skip_on_field_errors=True)
     def verify_file_not_exists(self, data, **kwargs):
         """Check that the file does not match anything already in the database."""
@@ -120,6 +128,12 @@ class NewFileSchema(project_schemas.ProjectRequiredSchema):
         if file:
             raise FileExistsError
 
+        # A multipart upload of the file would add it again when completed
+        if dds_web.api.db_tools.get_uploading_names(project=project, names=[data.get("name")]):
+            raise marshmallow.ValidationError(
+                f"An upload of '{data.get('name')}' is already in progress."
+            )
+
     @marshmallow.post_load
     def return_items(self, data, **kwargs):
         """Create file object."""
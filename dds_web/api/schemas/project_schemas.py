@@ -5,6 +5,7 @@
 ####################################################################################################
 
 # Standard Library
+import datetime
 import os
 import re
 
@@ -19,10 +20,12 @@ from dds_web import errors as ddserr
 from dds_web import auth
 from dds_web.database import models
 from dds_web.api import api_s3_connector
+from dds_web.api import project_listing
 from dds_web.api.schemas import sqlalchemyautoschemas
 from dds_web.api.schemas import custom_fields
 from dds_web.security.project_user_keys import generate_project_key_pair
 import dds_web.utils
+import dds_web.api.db_tools
 
 ####################################################################################################
 # VALIDATORS ########################################################################## VALIDATORS #
@@ -214,6 +217,68 @@ class ProjectRequiredSchema(marshmallow.Schema):
         return data.get("project_row")
 
 
+class ProjectListingSchema(marshmallow.Schema):
+    """Schema for the filters, sorting and page of a project listing."""
+
+    class Meta:
+        unknown = marshmallow.EXCLUDE
+
+    usage = marshmallow.fields.Boolean(required=False, load_default=False)
+    statuses = marshmallow.fields.List(
+        marshmallow.fields.String(validate=marshmallow.validate.OneOf(project_listing.STATUSES)),
+        required=False,
+        data_key="status",
+    )
+    active_only = marshmallow.fields.Boolean(required=False, load_default=False)
+    created_after = custom_fields.MyDateTimeField(required=False)
+    created_before = custom_fields.MyDateTimeField(required=False)
+    updated_after = custom_fields.MyDateTimeField(required=False)
+    updated_before = custom_fields.MyDateTimeField(required=False)
+    pi = marshmallow.fields.String(required=False)
+    sort = marshmallow.fields.String(
+        required=False,
+        load_default="id",
+        validate=marshmallow.validate.OneOf(project_listing.SORT_KEYS),
+    )
+    descending = marshmallow.fields.Boolean(required=False, load_default=False)
+    limit = marshmallow.fields.Integer(
+        required=False,
+        validate=marshmallow.validate.Range(min=1, max=project_listing.MAX_PAGE_SIZE),
+    )
+    cursor = marshmallow.fields.String(required=False)
+
+    @marshmallow.pre_load
+    def status_as_list(self, data, **kwargs):
+        """Allow a single status instead of a list."""
+        if isinstance(data.get("status"), str):
+            data = {**data, "status": [data["status"]]}
+
+        return data
+
+    @marshmallow.post_load
+    def decode_cursor(self, data, **kwargs):
+        """Compare dates in UTC and check that the cursor is from the same sorting."""
+        for field in ["created_after", "created_before", "updated_after", "updated_before"]:
+            if data.get(field) and data[field].tzinfo:
+                data[field] = data[field].astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+        if data.get("cursor"):
+            try:
+                data["cursor"] = project_listing.decode_cursor(cursor=data["cursor"])
+            except ValueError as err:
+                raise marshmallow.ValidationError(str(err), "cursor") from err
+
+            if (data["cursor"]["sort"], data["cursor"]["descending"]) != (
+                data["sort"],
+                data["descending"],
+            ):
+                raise marshmallow.ValidationError(
+                    "The cursor is from a listing with another sorting.", "cursor"
+                )
+
+        return data
+
+
 class ProjectContentSchema(ProjectRequiredSchema):
     """ """
 
@@ -222,23 +287,48 @@ class ProjectContentSchema(ProjectRequiredSchema):
     get_all = marshmallow.fields.Boolean(required=False, default=False)
 
     def find_contents(self, project, contents):
+        """Find the requested files and the contents of the requested folders.
 
+        The folders are all resolved with one query, the files are then grouped per folder.
+        """
         # All contents
         all_contents_query = models.File.query.filter(
             models.File.project_id == sqlalchemy.func.binary(project.id)
         )
 
-        # Get all files
-        files = all_contents_query.filter(models.File.name.in_(contents)).all()
-
-        # Get not found paths - may be folders
-        new_paths = set(contents).difference(x.name for x in files)
+        # Get all files - the database comparison is case insensitive, file names are not
+        requested = set(contents)
+        files = [
+            x
+            for x in all_contents_query.filter(models.File.name.in_(contents))
+            if x.name in requested
+        ]
+
+        # Get not found paths - may be folders. "a" and "a/" are the same folder, but both
+        # are returned if both are requested. "." is the project root.
+        new_paths = {}
+        for x in requested.difference(x.name for x in files):
+            folder = x.rstrip(os.sep) or "."
+            new_paths.setdefault(folder, []).append(x)
+        folder_contents = {x: [] for y in new_paths.values() for x in y}
+
+        # Get the contents of all folders with one query, one subpath range per folder
+        if new_paths:
+            root_requested = "." in new_paths
+            folder_query = all_contents_query
+            if not root_requested:
+                folder_query = folder_query.filter(
+                    sqlalchemy.or_(*(dds_web.api.db_tools.in_folder(folder=x) for x in new_paths))
+                )
 
-        # Get all folder contents
-        folder_contents = {
-            x: all_contents_query.filter(models.File.subpath.like(f"{x.rstrip(os.sep)}%")).all()
-            for x in new_paths
-        }
+            # Group per requested folder - a file can be in several requested folders
+            for file in folder_query:
+                folders = dds_web.api.db_tools.parent_folders(file.subpath)
+                if root_requested:
+                    folders.append(".")
+                for folder in folders:
+                    for requested_path in new_paths.get(folder, []):
+                        folder_contents[requested_path].append(file)
 
         # Not found
         not_found = {x: folder_contents.pop(x) for x, y in list(folder_contents.items()) if not y}
@@ -290,40 +380,33 @@ class ProjectContentSchema(ProjectRequiredSchema):
             ),
         )
 
-        # Connect to s3
-        with api_s3_connector.ApiS3Connector(project=project_row) as s3:
-            # Get the info and signed urls for all files
-            try:
-                found_files.update(
-                    {
-                        x.name: {
-                            **fileschema.dump(x),
-                            "url": s3.generate_get_url(key=x.name_in_bucket) if url else None,
-                        }
-                        for x in files
-                    }
-                )
+        # Sign all urls in one batch - s3 is only needed for the urls
+        urls = {}
+        if url:
+            with api_s3_connector.ApiS3Connector(project=project_row) as s3:
+                try:
+                    urls = s3.generate_get_urls(
+                        keys=[x.name_in_bucket for x in files]
+                        + [z.name_in_bucket for y in (folder_contents or {}).values() for z in y]
+                    )
+                except botocore.client.ClientError as clierr:
+                    raise ddserr.S3ConnectionError(
+                        message=str(clierr), alt_message="Could not generate presigned urls."
+                    )
+
+        # Get the info for all files
+        found_files.update(
+            {x.name: {**fileschema.dump(x), "url": urls.get(x.name_in_bucket)} for x in files}
+        )
+
+        if folder_contents:
+            # Get all info and signed urls for all folder contents found in the bucket
+            for x, y in folder_contents.items():
+                if x not in found_folder_contents:
+                    found_folder_contents[x] = {}
 
-                if folder_contents:
-                    # Get all info and signed urls for all folder contents found in the bucket
-                    for x, y in folder_contents.items():
-                        if x not in found_folder_contents:
-                            found_folder_contents[x] = {}
-
-                        found_folder_contents[x].update(
-                            {
-                                z.name: {
-                                    **fileschema.dump(z),
-                                    "url": s3.generate_get_url(key=z.name_in_bucket)
-                                    if url
-                                    else None,
-                                }
-                                for z in y
-                            }
-                        )
-            except botocore.client.ClientError as clierr:
-                raise ddserr.S3ConnectionError(
-                    message=str(clierr), alt_message="Could not generate presigned urls."
+                found_folder_contents[x].update(
+                    {z.name: {**fileschema.dump(z), "url": urls.get(z.name_in_bucket)} for z in y}
                 )
 
         return found_files, found_folder_contents, not_found
@@ -0,0 +1,317 @@
+"""Storage backends: the bucket and object operations used by the API, for S3 or in memory."""
+
+####################################################################################################
+# IMPORTS ################################################################################ IMPORTS #
+####################################################################################################
+
+# Standard library
+import abc
+import bisect
+import itertools
+import threading
+import time
+
+# Installed
+import botocore
+import flask
+
+# Own modules
+from dds_web.api import s3_client_pool
+from dds_web.api import url_signer
+
+####################################################################################################
+# GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
+####################################################################################################
+
+PAGE_SIZE = 1000  # max number of keys per list and delete request in s3
+
+####################################################################################################
+# CLASSES ################################################################################ CLASSES #
+####################################################################################################
+
+
+class StorageBackend(abc.ABC):
+    """The operations on buckets and objects which the API needs from the storage.
+
+    Errors are raised as botocore ClientErrors with the S3 error codes (e.g. NoSuchBucket) by all
+    backends, so that the callers handle them in the same way. A backend has to implement all
+    abstract methods, otherwise it cannot be created.
+    """
+
+    @abc.abstractmethod
+    def create_bucket(self, bucket):
+        """Create a bucket."""
+
+    @abc.abstractmethod
+    def head_bucket(self, bucket):
+        """Check that a bucket exists, raises a ClientError if it does not."""
+
+    @abc.abstractmethod
+    def delete_bucket(self, bucket):
+        """Delete an empty bucket."""
+
+    @abc.abstractmethod
+    def list_objects(self, bucket, page_size=PAGE_SIZE, start_after=None, continuation_token=None):
+        """List one page of keys, in S3 (UTF-8 byte) order.
+
+        Returns a dict with the keys and the token for the next page, None on the last page.
+        """
+
+    @abc.abstractmethod
+    def delete_objects(self, bucket, keys):
+        """Delete at most PAGE_SIZE objects, returns the errors per key."""
+
+    @abc.abstractmethod
+    def head_object(self, bucket, key):
+        """Get the size of an object, raises a ClientError with code 404 if it does not exist."""
+
+    @abc.abstractmethod
+    def create_multipart_upload(self, bucket, key):
+        """Start a multipart upload, returns the upload id."""
+
+    @abc.abstractmethod
+    def complete_multipart_upload(self, bucket, key, upload_id, parts):
+        """Combine the parts (dicts with part_number and etag) of an upload to the object."""
+
+    @abc.abstractmethod
+    def abort_multipart_upload(self, bucket, key, upload_id):
+        """Abort a multipart upload."""
+
+    @abc.abstractmethod
+    def get_url_signer(self, bucket):
+        """Get the signer of presigned urls to the objects in a bucket."""
+
+    def list_pages(self, bucket, start_after=None, page_size=PAGE_SIZE):
+        """Generate the keys in a bucket one page at a time, starting after a key if given."""
+        token = None
+        while True:
+            page = self.list_objects(
+                bucket=bucket,
+                page_size=page_size,
+                start_after=start_after if token is None else None,
+                continuation_token=token,
+            )
+            if page["keys"]:
+                yield page["keys"]
+
+            token = page["next_token"]
+            if not page["keys"] or token is None:
+                return
+
+
+class S3Backend(StorageBackend):
+    """Storage in an S3 service, with the pooled botocore client of the unit."""
+
+    def __init__(self, client, endpoint, access_key, secret_key):
+        self.client = client
+        self.endpoint = endpoint
+        self.access_key = access_key
+        self.secret_key = secret_key
+
+    def create_bucket(self, bucket):
+        self.client.create_bucket(Bucket=bucket)
+
+    def head_bucket(self, bucket):
+        self.client.head_bucket(Bucket=bucket)
+
+    def delete_bucket(self, bucket):
+        self.client.delete_bucket(Bucket=bucket)
+
+    def list_objects(self, bucket, page_size=PAGE_SIZE, start_after=None, continuation_token=None):
+        kwargs = {"Bucket": bucket, "MaxKeys": page_size}
+        if continuation_token:
+            kwargs["ContinuationToken"] = continuation_token
+        elif start_after:
+            kwargs["StartAfter"] = start_after
+
+        response = self.client.list_objects_v2(**kwargs)
+        return {
+            "keys": [x["Key"] for x in response.get("Contents", [])],
+            "next_token": (
+                response.get("NextContinuationToken") if response.get("IsTruncated") else None
+            ),
+        }
+
+    def delete_objects(self, bucket, keys):
+        response = self.client.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": x} for x in keys], "Quiet": True},
+        )
+        return {
+            x["Key"]: f"{x.get('Code')}: {x.get('Message')}" for x in response.get("Errors", [])
+        }
+
+    def head_object(self, bucket, key):
+        response = self.client.head_object(Bucket=bucket, Key=key)
+        return {"size": response.get("ContentLength")}
+
+    def create_multipart_upload(self, bucket, key):
+        return self.client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+
+    def complete_multipart_upload(self, bucket, key, upload_id, parts):
+        self.client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [{"PartNumber": x["part_number"], "ETag": x["etag"]} for x in parts]
+            },
+        )
+
+    def abort_multipart_upload(self, bucket, key, upload_id):
+        self.client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+
+    def get_url_signer(self, bucket):
+        return url_signer.get_signer(
+            endpoint=self.endpoint,
+            access_key=self.access_key,
+            secret_key=self.secret_key,
+            bucket=bucket,
+            region=self.client.meta.region_name or url_signer.DEFAULT_REGION,
+        )
+
+
+class LocalBackend(StorageBackend):
+    """Storage in memory, for development, tests and benchmarks without an S3 service.
+
+    Only the keys and sizes of the objects are kept. latency is the time in seconds each request
+    takes, per method name (e.g. {"list_objects": 0.05, "delete_objects": 0.5}), to get realistic
+    throughput in benchmarks. The urls are signed like for S3, for the endpoint given.
+    """
+
+    def __init__(self, latency=None, endpoint="http://localhost:9000"):
+        self.latency = latency or {}
+        self.endpoint = endpoint
+        # bucket -> {key: size}, changed with put_objects and the requests
+        self.buckets = {}
+        # bucket -> sorted UTF-8 encoded keys, until the objects are changed
+        self._sorted = {}
+        # upload id -> (bucket, key)
+        self.uploads = {}
+        self.requests = {}
+        self._upload_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _request(self, method, bucket=None):
+        """Count the request, wait for the latency and check that the bucket exists."""
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+        if self.latency.get(method):
+            time.sleep(self.latency[method])
+        if bucket is not None and bucket not in self.buckets:
+            raise client_error(code="NoSuchBucket", operation=method)
+
+    def put_objects(self, bucket, sizes):
+        """Add objects to a bucket, sizes is a dict with the keys and sizes. Not a request."""
+        with self._lock:
+            self.buckets.setdefault(bucket, {}).update(sizes)
+            self._sorted.pop(bucket, None)
+
+    def create_bucket(self, bucket):
+        self._request("create_bucket")
+        with self._lock:
+            if bucket in self.buckets:
+                raise client_error(code="BucketAlreadyOwnedByYou", operation="create_bucket")
+            self.buckets[bucket] = {}
+
+    def head_bucket(self, bucket):
+        self._request("head_bucket", bucket=bucket)
+
+    def delete_bucket(self, bucket):
+        self._request("delete_bucket", bucket=bucket)
+        with self._lock:
+            if self.buckets[bucket]:
+                raise client_error(code="BucketNotEmpty", operation="delete_bucket")
+            del self.buckets[bucket]
+
+    def list_objects(self, bucket, page_size=PAGE_SIZE, start_after=None, continuation_token=None):
+        self._request("list_objects", bucket=bucket)
+        after = (continuation_token or start_after or "").encode("utf-8")
+        with self._lock:
+            if bucket not in self._sorted:
+                self._sorted[bucket] = sorted(x.encode("utf-8") for x in self.buckets[bucket])
+            keys = self._sorted[bucket]
+            start = bisect.bisect_right(keys, after)
+            page = [x.decode("utf-8") for x in keys[start : start + page_size]]
+            truncated = start + page_size < len(keys)
+        return {"keys": page, "next_token": page[-1] if truncated else None}
+
+    def delete_objects(self, bucket, keys):
+        self._request("delete_objects", bucket=bucket)
+        with self._lock:
+            for key in keys:
+                self.buckets[bucket].pop(key, None)
+            self._sorted.pop(bucket, None)
+        return {}
+
+    def head_object(self, bucket, key):
+        self._request("head_object", bucket=bucket)
+        with self._lock:
+            if key not in self.buckets[bucket]:
+                raise client_error(code="404", operation="head_object")
+            return {"size": self.buckets[bucket][key]}
+
+    def create_multipart_upload(self, bucket, key):
+        self._request("create_multipart_upload", bucket=bucket)
+        with self._lock:
+            upload_id = f"upload-{next(self._upload_ids)}"
+            self.uploads[upload_id] = (bucket, key)
+        return upload_id
+
+    def complete_multipart_upload(self, bucket, key, upload_id, parts):
+        self._request("complete_multipart_upload", bucket=bucket)
+        with self._lock:
+            if self.uploads.get(upload_id) != (bucket, key):
+                raise client_error(code="NoSuchUpload", operation="complete_multipart_upload")
+            del self.uploads[upload_id]
+            self.buckets[bucket][key] = 0
+            self._sorted.pop(bucket, None)
+
+    def abort_multipart_upload(self, bucket, key, upload_id):
+        self._request("abort_multipart_upload", bucket=bucket)
+        with self._lock:
+            if self.uploads.pop(upload_id, None) is None:
+                raise client_error(code="NoSuchUpload", operation="abort_multipart_upload")
+
+    def get_url_signer(self, bucket):
+        return url_signer.get_signer(
+            endpoint=self.endpoint, access_key="local", secret_key="local", bucket=bucket
+        )
+
+
+####################################################################################################
+# FUNCTIONS ############################################################################ FUNCTIONS #
+####################################################################################################
+
+
+def client_error(code, operation, message=None):
+    """Create the error botocore raises for an S3 error code."""
+    return botocore.exceptions.ClientError(
+        {"Error": {"Code": code, "Message": message or code}}, operation
+    )
+
+
+def get_backend(endpoint, access_key, secret_key):
+    """Get the storage of a unit.
+
+    The STORAGE_BACKEND setting selects S3 ("s3", the default) or the process wide in memory
+    storage ("local").
+    """
+    if flask.current_app.config.get("STORAGE_BACKEND", "s3") == "local":
+        return local
+
+    return S3Backend(
+        client=s3_client_pool.pool.get_client(
+            endpoint=endpoint, access_key=access_key, secret_key=secret_key
+        ),
+        endpoint=endpoint,
+        access_key=access_key,
+        secret_key=secret_key,
+    )
+
+
+####################################################################################################
+# GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
+####################################################################################################
+
+local = LocalBackend()
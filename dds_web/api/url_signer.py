@@ -0,0 +1,191 @@
+"""Batch signing of presigned S3 urls."""
+
+####################################################################################################
+# IMPORTS ################################################################################ IMPORTS #
+####################################################################################################
+
+# Standard library
+import datetime
+import functools
+import hashlib
+import hmac
+import threading
+import urllib.parse
+
+####################################################################################################
+# GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
+####################################################################################################
+
+ALGORITHM = "AWS4-HMAC-SHA256"
+DEFAULT_REGION = "us-east-1"
+MAX_EXPIRES_IN = 604800  # 7 days in seconds - max for SigV4
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+####################################################################################################
+# CLASSES ################################################################################ CLASSES #
+####################################################################################################
+
+
+class PresignedUrlSigner:
+    """Signs presigned SigV4 GET urls for the objects in one bucket, path style addressing.
+
+    The urls are identical to the ones botocore generates with signature_version "s3v4", but
+    the derived signing key is only computed once per day (it only depends on the secret key,
+    date and region) and everything except the object key is prepared once per batch.
+    """
+
+    def __init__(self, endpoint, access_key, secret_key, bucket, region=DEFAULT_REGION):
+        url_parts = urllib.parse.urlsplit(endpoint)
+
+        # Host header - the port is left out if it is the default for the scheme
+        self.host = url_parts.hostname or ""
+        if ":" in self.host:
+            self.host = f"[{self.host}]"
+        if url_parts.port and url_parts.port != DEFAULT_PORTS.get(url_parts.scheme):
+            self.host += f":{url_parts.port}"
+
+        bucket_path = f"{url_parts.path.rstrip('/')}/{quote_path(bucket)}/"
+        self.base_url = f"{url_parts.scheme}://{url_parts.netloc}{bucket_path}"
+        self.canonical_path = bucket_path
+
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+
+        # Derived signing key for the current date - (date stamp, key)
+        self._signing_key = (None, None)
+        self._lock = threading.Lock()
+
+    def signing_key(self, date_stamp):
+        """Get the derived signing key for a date, only recomputed when the date changes."""
+        with self._lock:
+            cached_date, key = self._signing_key
+            if cached_date != date_stamp:
+                key = hmac_sha256(("AWS4" + self.secret_key).encode("utf-8"), date_stamp)
+                for part in [self.region, "s3", "aws4_request"]:
+                    key = hmac_sha256(key, part)
+                self._signing_key = (date_stamp, key)
+
+        return key
+
+    def prepare(self, expires_in, now):
+        """Prepare what is the same for all urls signed at the same time.
+
+        Returns the query string with the X-Amz parameters (except the signature), the start of
+        the string to sign and a hmac with the signing key.
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date_stamp = now.strftime("%Y%m%d")
+        scope = f"{date_stamp}/{self.region}/s3/aws4_request"
+
+        query_string = "&".join(
+            f"{name}={quote_value(value)}"
+            for name, value in [
+                ("X-Amz-Algorithm", ALGORITHM),
+                ("X-Amz-Credential", f"{self.access_key}/{scope}"),
+                ("X-Amz-Date", amz_date),
+                ("X-Amz-Expires", expires_in),
+                ("X-Amz-SignedHeaders", "host"),
+            ]
+        )
+        string_to_sign_prefix = f"{ALGORITHM}\n{amz_date}\n{scope}\n"
+        signer = hmac.new(self.signing_key(date_stamp=date_stamp), digestmod=hashlib.sha256)
+
+        return query_string, string_to_sign_prefix, signer
+
+    def generate_get_urls(self, keys, expires_in=MAX_EXPIRES_IN, now=None):
+        """Generate presigned GET urls for multiple object keys.
+
+        Returns a dict with the keys as keys and the urls as values.
+        """
+        # Everything but the object key is the same for all urls in the batch
+        query_string, string_to_sign_prefix, signer = self.prepare(expires_in=expires_in, now=now)
+        request_suffix = f"\n{query_string}\nhost:{self.host}\n\nhost\nUNSIGNED-PAYLOAD"
+
+        urls = {}
+        for key in keys:
+            path = quote_path(key)
+            canonical_request = f"GET\n{self.canonical_path}{path}{request_suffix}"
+            string_to_sign = string_to_sign_prefix + sha256_hex(canonical_request)
+
+            key_signer = signer.copy()
+            key_signer.update(string_to_sign.encode("utf-8"))
+            signature = key_signer.hexdigest()
+            urls[key] = f"{self.base_url}{path}?{query_string}&X-Amz-Signature={signature}"
+
+        return urls
+
+    def generate_upload_part_urls(
+        self, key, upload_id, part_numbers, expires_in=MAX_EXPIRES_IN, now=None
+    ):
+        """Generate presigned PUT urls for parts of a multipart upload.
+
+        Returns a dict with the part numbers as keys and the urls as values.
+        """
+        query_string, string_to_sign_prefix, signer = self.prepare(expires_in=expires_in, now=now)
+        path = quote_path(key)
+        upload_param = f"uploadId={quote_value(upload_id)}"
+
+        urls = {}
+        for part_number in part_numbers:
+            part_param = f"partNumber={int(part_number)}"
+
+            # The canonical query string is sorted by name - the X-Amz parameters come first
+            canonical_request = (
+                f"PUT\n{self.canonical_path}{path}\n{query_string}&{part_param}&{upload_param}"
+                f"\nhost:{self.host}\n\nhost\nUNSIGNED-PAYLOAD"
+            )
+            string_to_sign = string_to_sign_prefix + sha256_hex(canonical_request)
+
+            part_signer = signer.copy()
+            part_signer.update(string_to_sign.encode("utf-8"))
+            signature = part_signer.hexdigest()
+            urls[part_number] = (
+                f"{self.base_url}{path}?{upload_param}&{part_param}&{query_string}"
+                f"&X-Amz-Signature={signature}"
+            )
+
+        return urls
+
+    def generate_get_url(self, key, expires_in=MAX_EXPIRES_IN, now=None):
+        """Generate a presigned GET url for one object key."""
+        return self.generate_get_urls(keys=[key], expires_in=expires_in, now=now)[key]
+
+
+####################################################################################################
+# FUNCTIONS ############################################################################ FUNCTIONS #
+####################################################################################################
+
+
+def quote_path(value):
+    """Percent encode a bucket name or object key the way botocore does."""
+    return urllib.parse.quote(value, safe="/~")
+
+
+def quote_value(value):
+    """Percent encode a query string value."""
+    return urllib.parse.quote(str(value), safe="-_.~")
+
+
+def hmac_sha256(key, msg):
+    """Sign a message with a key."""
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+def sha256_hex(msg):
+    """Get the hex digest of a message."""
+    return hashlib.sha256(msg.encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=1024)
+def get_signer(endpoint, access_key, secret_key, bucket, region=DEFAULT_REGION):
+    """Get the signer for a unit endpoint, credentials and bucket, created once per process."""
+    return PresignedUrlSigner(
+        endpoint=endpoint,
+        access_key=access_key,
+        secret_key=secret_key,
+        bucket=bucket,
+        region=region,
+    )
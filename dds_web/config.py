@@ -64,6 +64,15 @@ class Config(object):
 
     INVITATION_EXPIRES_IN_HOURS = 7 * 24
 
+    # Process queued project deletions and archivals in the scheduler
+    RUN_PROJECT_JOBS = True
+
+    # Multipart uploads not completed within this time are aborted by the scheduler
+    MULTIPART_UPLOAD_TIMEOUT_HOURS = 48
+
+    # Storage of the unit buckets: "s3", or "local" for an in memory stand-in (development only)
+    STORAGE_BACKEND = os.environ.get("DDS_STORAGE_BACKEND", "s3")
+
     # 512MiB; at least 4GiB (0x400000) recommended in production
     ARGON_KD_MEMORY_COST = os.environ.get("ARGON_KD_MEMORY_COST", 0x80000)
 
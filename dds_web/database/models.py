@@ -6,8 +6,10 @@
 
 # Standard library
 import datetime
+import hashlib
 import os
 import time
+import types
 
 # Installed
 import sqlalchemy
@@ -224,7 +226,10 @@ class Project(db.Model):
 
     # Table setup
     __tablename__ = "projects"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        db.Index("ix_projects_current_status_deadline", "current_status", "current_deadline"),
+        {"extend_existing": True},
+    )
 
     # Columns
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -245,6 +250,19 @@ class Project(db.Model):
     released = db.Column(db.DateTime(), nullable=True)
     is_active = db.Column(db.Boolean, unique=False, nullable=False, default=True, index=True)
 
+    # Totals of the files in the project, maintained by the code adding and removing files,
+    # see dds_web.api.db_tools.update_project_counters
+    file_count = db.Column(db.BigInteger, unique=False, nullable=False, default=0)
+    bytes_stored = db.Column(db.BigInteger, unique=False, nullable=False, default=0)
+    bytes_original = db.Column(db.BigInteger, unique=False, nullable=False, default=0)
+
+    # Summary of the status history, kept in sync with project_statuses by the listeners below,
+    # see project_status_summary
+    current_status = db.Column(db.String(50), unique=False, nullable=True)
+    current_deadline = db.Column(db.DateTime(), nullable=True)
+    ever_available = db.Column(db.Boolean, unique=False, nullable=False, default=False)
+    expired_count = db.Column(db.Integer, unique=False, nullable=False, default=0)
+
     # Foreign keys & relationships
     unit_id = db.Column(db.Integer, db.ForeignKey("units.id", ondelete="RESTRICT"), nullable=True)
     responsible_unit = db.relationship("Unit", back_populates="projects")
@@ -257,6 +275,9 @@ class Project(db.Model):
 
     # Additional relationships
     files = db.relationship("File", back_populates="project")
+    folders = db.relationship(
+        "Folder", back_populates="project", passive_deletes=True, cascade="all, delete"
+    )
     file_versions = db.relationship("Version", back_populates="project")
     project_statuses = db.relationship(
         "ProjectStatuses", back_populates="project", passive_deletes=True, cascade="all, delete"
@@ -270,38 +291,21 @@ class Project(db.Model):
     project_invite_keys = db.relationship(
         "ProjectInviteKeys", back_populates="project", passive_deletes=True
     )
-
-    @property
-    def current_status(self):
-        """Return the current status of the project"""
-        return max(self.project_statuses, key=lambda x: x.date_created).status
+    jobs = db.relationship(
+        "ProjectJob", back_populates="project", passive_deletes=True, cascade="all, delete"
+    )
+    multipart_uploads = db.relationship(
+        "MultipartUpload", back_populates="project", passive_deletes=True, cascade="all, delete"
+    )
 
     @property
     def has_been_available(self):
         """Return True if the project has ever been in the status Available"""
-        result = False
-        if len([x for x in self.project_statuses if "Available" in x.status]) > 0:
-            result = True
-        return result
+        return bool(self.ever_available)
 
     @property
     def times_expired(self):
-        return len([x for x in self.project_statuses if "Expired" in x.status])
-
-    @property
-    def current_deadline(self):
-        """Return deadline for statuses that have a deadline"""
-        deadline = None
-        if self.current_status in ["Available", "Expired"]:
-            deadline = max(self.project_statuses, key=lambda x: x.date_created).deadline
-        elif self.current_status in ["In Progress"]:
-            if self.has_been_available:
-                list_available = list(
-                    filter(lambda x: x.status == "Available", self.project_statuses)
-                )
-                latest_available = max(list_available, key=lambda x: x.date_created)
-                deadline = latest_available.deadline
-        return deadline
+        return self.expired_count or 0
 
     @property
     def safespring_project(self):
@@ -311,15 +315,15 @@ class Project(db.Model):
 
     @property
     def size(self):
-        """Calculate size of project."""
+        """Get the stored size of the files in the project."""
 
-        return sum([f.size_stored for f in self.files])
+        return self.bytes_stored or 0
 
     @property
     def num_files(self):
         """Get number of files in project."""
 
-        return len(self.files)
+        return self.file_count or 0
 
     def __str__(self):
         """Called by str(), creates representation of object"""
@@ -340,6 +344,83 @@ def add_before_project_update(mapper, connection, target):
         target.last_updated_by = auth.current_user().username
 
 
+def project_status_summary(statuses):
+    """Get the current status, current deadline, ever available and expired count of a project.
+
+    statuses are the status rows (or objects with status, date_created and deadline) of the
+    project. The deadline of a project In Progress is the one of its latest release, if any.
+    """
+    if not statuses:
+        return {
+            "current_status": None,
+            "current_deadline": None,
+            "ever_available": False,
+            "expired_count": 0,
+        }
+
+    latest = max(statuses, key=lambda x: x.date_created)
+    available = [x for x in statuses if x.status == "Available"]
+    deadline = None
+    if latest.status in ["Available", "Expired"]:
+        deadline = latest.deadline
+    elif latest.status == "In Progress" and available:
+        deadline = max(available, key=lambda x: x.date_created).deadline
+
+    return {
+        "current_status": latest.status,
+        "current_deadline": deadline,
+        "ever_available": bool(available),
+        "expired_count": len([x for x in statuses if x.status == "Expired"]),
+    }
+
+
+def sync_project_status(project, statuses):
+    """Set the status summary columns of a project."""
+    for column, value in project_status_summary(statuses=statuses).items():
+        if getattr(project, column) != value:
+            setattr(project, column, value)
+
+
+@sqlalchemy.event.listens_for(Project.project_statuses, "append")
+def add_project_status(target, value, initiator):
+    """Update the status summary of the project when a status is added"""
+    statuses = list(target.project_statuses)
+    if not any(x is value for x in statuses):
+        statuses.append(value)
+    sync_project_status(project=target, statuses=statuses)
+
+
+@sqlalchemy.event.listens_for(Project.project_statuses, "remove")
+def remove_project_status(target, value, initiator):
+    """Update the status summary of the project when a status is removed"""
+    # The row may not be removed from the collection yet
+    statuses = [x for x in target.project_statuses if x is not value]
+    sync_project_status(project=target, statuses=statuses)
+
+
+@sqlalchemy.event.listens_for(ProjectStatuses.status, "set")
+@sqlalchemy.event.listens_for(ProjectStatuses.date_created, "set")
+@sqlalchemy.event.listens_for(ProjectStatuses.deadline, "set")
+def change_project_status(target, value, oldvalue, initiator):
+    """Update the status summary of the project when a status is changed"""
+    if target.project is None:
+        return
+
+    # The new value is not set on the row yet
+    statuses = [
+        types.SimpleNamespace(
+            **{
+                "status": x.status,
+                "date_created": x.date_created,
+                "deadline": x.deadline,
+                **({initiator.key: value} if x is target else {}),
+            }
+        )
+        for x in target.project.project_statuses
+    ]
+    sync_project_status(project=target.project, statuses=statuses)
+
+
 # Users #################################################################################### Users #
 
 
@@ -893,7 +974,15 @@ class File(db.Model):
 
     # Table setup
     __tablename__ = "files"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        db.Index(
+            "ix_files_project_id_subpath",
+            "project_id",
+            "subpath",
+            mysql_length={"subpath": 255},
+        ),
+        {"extend_existing": True},
+    )
 
     # Columns
     id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
@@ -926,6 +1015,173 @@ class File(db.Model):
         return f"<File {pathlib.Path(self.name).name}>"
 
 
+def folder_path_hash(path):
+    """Get the key identifying a folder path within a project, case sensitive like the paths."""
+    return hashlib.sha256(path.encode("utf-8")).hexdigest()
+
+
+class Folder(db.Model):
+    """
+    Data model for the folders within a project.
+
+    One row per folder which contains files, directly or in a subfolder, with the total
+    number of files and bytes below it. The rows are maintained by the code adding and
+    removing files, see dds_web.api.db_tools.
+
+    Primary key:
+    - id
+
+    Foreign key(s):
+    - project_id
+    """
+
+    # Table setup
+    __tablename__ = "folders"
+    __table_args__ = (
+        db.Index(
+            "ix_folders_project_id_parent",
+            "project_id",
+            "parent",
+            mysql_length={"parent": 255},
+        ),
+        db.Index("ix_folders_project_id_path_hash", "project_id", "path_hash", unique=True),
+        {"extend_existing": True},
+    )
+
+    # Columns
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+
+    # Foreign keys & relationships
+    project_id = db.Column(
+        db.Integer, db.ForeignKey("projects.id", ondelete="CASCADE"), nullable=False
+    )
+    project = db.relationship("Project", back_populates="folders")
+    # ---
+
+    # Additional columns
+    path = db.Column(db.Text, unique=False, nullable=False)
+    # Fixed length key for the path, which is too long for a unique index
+    path_hash = db.Column(
+        db.String(64),
+        unique=False,
+        nullable=False,
+        default=lambda context: folder_path_hash(context.get_current_parameters()["path"]),
+    )
+    parent = db.Column(db.Text, unique=False, nullable=False)  # "." for folders in root
+    num_files = db.Column(db.BigInteger, unique=False, nullable=False, default=0)
+    size_original = db.Column(db.BigInteger, unique=False, nullable=False, default=0)  # Bytes
+
+    def __repr__(self):
+        """Called by print, creates representation of object"""
+
+        return f"<Folder {self.path}>"
+
+
+class ProjectJob(db.Model):
+    """
+    Data model for queued removal of project contents, when a project is deleted or archived.
+
+    The contents are removed by a worker (dds_web.api.project_jobs), which adds the new status
+    of the project when the removal has completed.
+
+    Primary key:
+    - id
+
+    Foreign key(s):
+    - project_id
+    """
+
+    # Table setup
+    __tablename__ = "projectjobs"
+    __table_args__ = (
+        db.Index("ix_projectjobs_status_id", "status", "id"),
+        {"extend_existing": True},
+    )
+
+    # Columns
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+
+    # Foreign keys & relationships
+    project_id = db.Column(
+        db.Integer, db.ForeignKey("projects.id", ondelete="CASCADE"), nullable=False
+    )
+    project = db.relationship("Project", back_populates="jobs")
+    # ---
+
+    # Additional columns
+    new_status = db.Column(db.String(50), unique=False, nullable=False)  # Deleted or Archived
+    is_aborted = db.Column(db.Boolean, unique=False, nullable=False, default=False)
+    requested_by = db.Column(db.String(50), unique=False, nullable=True)
+    status = db.Column(db.String(50), unique=False, nullable=False, default="Queued")
+    created = db.Column(db.DateTime(), unique=False, nullable=False)
+    started = db.Column(db.DateTime(), unique=False, nullable=True)
+    finished = db.Column(db.DateTime(), unique=False, nullable=True)
+    last_update = db.Column(db.DateTime(), unique=False, nullable=True)
+    heartbeat = db.Column(db.DateTime(), unique=False, nullable=True)  # Updated while running
+    checkpoint = db.Column(db.Text, unique=False, nullable=True)  # Last removed key in bucket
+    objects_deleted = db.Column(db.BigInteger, unique=False, nullable=False, default=0)
+    error = db.Column(db.Text, unique=False, nullable=True)
+
+    def __repr__(self):
+        """Called by print, creates representation of object"""
+
+        return f"<ProjectJob {self.id}>"
+
+
+class MultipartUpload(db.Model):
+    """
+    Data model for multipart uploads which have been started but not completed.
+
+    The file information is kept here until the upload is completed, when the file is added
+    to the files table and the row is deleted. Uploads which are never completed are aborted
+    by a scheduled task.
+
+    Primary key:
+    - id
+
+    Foreign key(s):
+    - project_id
+    """
+
+    # Table setup
+    __tablename__ = "multipartuploads"
+    __table_args__ = (
+        db.Index("ix_multipartuploads_created", "created"),
+        {"extend_existing": True},
+    )
+
+    # Columns
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+
+    # Foreign keys & relationships
+    project_id = db.Column(
+        db.Integer, db.ForeignKey("projects.id", ondelete="CASCADE"), index=True, nullable=False
+    )
+    project = db.relationship("Project", back_populates="multipart_uploads")
+    # ---
+
+    # Additional columns
+    upload_id = db.Column(db.String(255), unique=True, nullable=False)  # From S3
+    started_by = db.Column(db.String(50), unique=False, nullable=True)
+    created = db.Column(db.DateTime(), unique=False, nullable=False)
+
+    # File information, see File
+    name = db.Column(db.Text, unique=False, nullable=False)
+    name_in_bucket = db.Column(db.Text, unique=False, nullable=False)
+    subpath = db.Column(db.Text, unique=False, nullable=False)
+    size_original = db.Column(db.BigInteger, unique=False, nullable=False)
+    size_stored = db.Column(db.BigInteger, unique=False, nullable=False)
+    compressed = db.Column(db.Boolean, nullable=False)
+    public_key = db.Column(db.String(64), unique=False, nullable=False)
+    salt = db.Column(db.String(32), unique=False, nullable=False)
+    checksum = db.Column(db.String(64), unique=False, nullable=False)
+
+    def __repr__(self):
+        """Called by print, creates representation of object"""
+
+        return f"<MultipartUpload {self.id}>"
+
+
 class Version(db.Model):
     """
     Data model for keeping track of all active and non active files. Used for invoicing.
@@ -940,7 +1196,10 @@ class Version(db.Model):
 
     # Table setup
     __tablename__ = "versions"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        db.Index("ix_versions_active_file_time_deleted", "active_file", "time_deleted"),
+        {"extend_existing": True},
+    )
 
     # Columns
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
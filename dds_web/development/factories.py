@@ -5,6 +5,7 @@ import flask
 
 from dds_web.database import models
 from dds_web import db
+from dds_web.api import db_tools
 
 STATUSES_PER_PROJECT = 5
 FILES_PER_PROJECT = 100
@@ -227,4 +228,9 @@ def create_all():
                 ProjectUserFactory(researchuser=user, project=project)
     flask.current_app.logger.info("Created project user associations")
 
+    for project in models.Project.query.all():
+        db_tools.rebuild_folder_index(project=project)
+        db_tools.recompute_project_counters(project=project)
+    flask.current_app.logger.info("Created folder index and project counters")
+
     db.session.commit()
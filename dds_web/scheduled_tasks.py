@@ -7,87 +7,125 @@ import flask
 scheduler = flask_apscheduler.APScheduler()
 
 
+# Number of due projects selected at a time by the status tasks
+STATUS_TASK_BATCH_SIZE = 100
+
+
+def change_due_projects(current_status, change, task, batch_size=STATUS_TASK_BATCH_SIZE):
+    """Give the active projects with a status whose deadline has passed a new status.
+
+    The due projects are selected batch_size at a time, with keyset pagination on the id and
+    the index on the current status and deadline. Each project is then locked, checked again,
+    changed and committed on its own, so an error only affects that project and the locks are
+    held briefly. change gets the project and returns its new status row, or None if the
+    change has been queued as a project job.
+
+    Returns the number of due, changed and failed projects and the time taken.
+    """
+    import time
+
+    import sqlalchemy
+    from dds_web import db
+    from dds_web.database import models
+    from dds_web.errors import LoggedHTTPException
+    from dds_web.utils import current_time, keyset_query
+
+    start = time.monotonic()
+    now = current_time()
+    due = sqlalchemy.and_(
+        models.Project.is_active.is_(True),
+        models.Project.current_status == current_status,
+        models.Project.current_deadline <= now,
+    )
+    metrics = {"due": 0, "changed": 0, "failed": 0}
+    errors = {}
+
+    for project_id in keyset_query(
+        db.session.query(models.Project.id).filter(due),
+        key=models.Project.id,
+        page_size=batch_size,
+    ):
+        metrics["due"] += 1
+
+        # Lock the project, it may have been changed since it was selected
+        project = (
+            db.session.query(models.Project)
+            .filter(sqlalchemy.and_(due, models.Project.id == project_id))
+            .with_for_update()
+            .one_or_none()
+        )
+        if project is None:
+            db.session.rollback()
+            continue
+
+        scheduler.app.logger.debug(
+            "Project: %s has status %s and deadline %s",
+            project.public_id,
+            project.current_status,
+            project.current_deadline,
+        )
+        public_id = project.public_id
+        unit = project.responsible_unit.name if project.responsible_unit else None
+        try:
+            new_status_row = change(project)
+            if new_status_row is not None:
+                project.project_statuses.append(new_status_row)
+            db.session.commit()
+            metrics["changed"] += 1
+            if new_status_row is not None:
+                scheduler.app.logger.debug(
+                    "Project: %s has status %s now!", public_id, project.current_status
+                )
+        except (
+            sqlalchemy.exc.OperationalError,
+            sqlalchemy.exc.SQLAlchemyError,
+            LoggedHTTPException,
+        ) as err:
+            scheduler.app.logger.exception(err)
+            db.session.rollback()
+            metrics["failed"] += 1
+            errors.setdefault(unit, {})[public_id] = str(err)
+
+    metrics["seconds"] = round(time.monotonic() - start, 3)
+    scheduler.app.logger.info(
+        "Task %s: %d due projects, %d changed, %d failed in %.3f s",
+        task,
+        metrics["due"],
+        metrics["changed"],
+        metrics["failed"],
+        metrics["seconds"],
+    )
+    for unit, projects in errors.items():
+        scheduler.app.logger.error(
+            f"Following projects of Unit '{unit}' encountered issues during the {task} task:"
+        )
+        for proj, error in projects.items():
+            scheduler.app.logger.error(f"Error for project '{proj}': {error} ")
+
+    return metrics
+
+
 @scheduler.task("cron", id="available_to_expired", hour=0, minute=1, misfire_grace_time=3600)
 # @scheduler.task("interval", id="available_to_expired", seconds=15, misfire_grace_time=1)
 def set_available_to_expired():
+    """Expire available projects whose deadlines are past"""
     scheduler.app.logger.debug("Task: Checking for Expiring projects.")
-    import sqlalchemy
 
-    from dds_web import db
-    from dds_web.database import models
-    from dds_web.errors import DatabaseError
     from dds_web.api.project import ProjectStatus
-    from dds_web.utils import current_time, page_query
+    from dds_web.utils import current_time
 
     with scheduler.app.app_context():
         expire = ProjectStatus()
 
-        errors = {}
-
-        try:
-            for unit in db.session.query(models.Unit).with_for_update().all():
-                errors[unit.name] = {}
-
-                days_in_expired = unit.days_in_expired
-
-                for project in page_query(
-                    db.session.query(models.Project)
-                    .filter(
-                        sqlalchemy.and_(
-                            models.Project.is_active == 1, models.Project.unit_id == unit.id
-                        )
-                    )
-                    .with_for_update()
-                ):
-
-                    if (
-                        project.current_status == "Available"
-                        and project.current_deadline <= current_time()
-                    ):
-                        scheduler.app.logger.debug("Handling expiring project")
-                        scheduler.app.logger.debug(
-                            "Project: %s has status %s and expires on: %s",
-                            project.public_id,
-                            project.current_status,
-                            project.current_deadline,
-                        )
-                        new_status_row = expire.expire_project(
-                            project=project,
-                            current_time=current_time(),
-                            deadline_in=days_in_expired,
-                        )
-
-                        project.project_statuses.append(new_status_row)
-
-                        try:
-                            db.session.commit()
-                            scheduler.app.logger.debug(
-                                "Project: %s has status Expired now!", project.public_id
-                            )
-                        except (
-                            sqlalchemy.exc.OperationalError,
-                            sqlalchemy.exc.SQLAlchemyError,
-                        ) as err:
-                            flask.current_app.logger.exception(err)
-                            db.session.rollback()
-                            errors[unit.name][project.public_id] = str(err)
-                        continue
-                    else:
-                        scheduler.app.logger.debug(
-                            "Nothing to do for Project: %s", project.public_id
-                        )
-        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
-            flask.current_app.logger.exception(err)
-            db.session.rollback()
-            raise
-
-        for unit, projects in errors.items():
-            if projects:
-                scheduler.app.logger.error(
-                    f"Following projects of Unit '{unit}' encountered issues during expiration process:"
-                )
-                for proj in errors[unit].keys():
-                    scheduler.app.logger.error(f"Error for project '{proj}': {errors[unit][proj]} ")
+        return change_due_projects(
+            current_status="Available",
+            change=lambda project: expire.expire_project(
+                project=project,
+                current_time=current_time(),
+                deadline_in=project.responsible_unit.days_in_expired,
+            ),
+            task="expiration",
+        )
 
 
 @scheduler.task("cron", id="expired_to_archived", hour=0, minute=1, misfire_grace_time=3600)
@@ -96,79 +134,53 @@ def set_expired_to_archived():
 
     scheduler.app.logger.debug("Task: Checking for projects to archive.")
 
-    import sqlalchemy
-    from dds_web import db
-    from dds_web.database import models
-    from dds_web.errors import DatabaseError
-    from dds_web.utils import current_time, page_query
+    from dds_web.api import project_jobs
     from dds_web.api.project import ProjectStatus
 
     with scheduler.app.app_context():
-
         archive = ProjectStatus()
-        errors = {}
 
-        try:
-            for unit in db.session.query(models.Unit).with_for_update().all():
-                errors[unit.name] = {}
-
-                for project in page_query(
-                    db.session.query(models.Project)
-                    .filter(
-                        sqlalchemy.and_(
-                            models.Project.is_active == 1, models.Project.unit_id == unit.id
-                        )
-                    )
-                    .with_for_update()
-                ):
-
-                    if (
-                        project.current_status == "Expired"
-                        and project.current_deadline <= current_time()
-                    ):
-                        scheduler.app.logger.debug("Handling project to archive")
-                        scheduler.app.logger.debug(
-                            "Project: %s has status %s and expired on: %s",
-                            project.public_id,
-                            project.current_status,
-                            project.current_deadline,
-                        )
-                        new_status_row, delete_message = archive.archive_project(
-                            project=project,
-                            current_time=current_time(),
-                        )
-                        scheduler.app.logger.debug(delete_message.strip())
-                        project.project_statuses.append(new_status_row)
-
-                        try:
-                            db.session.commit()
-                            scheduler.app.logger.debug(
-                                "Project: %s has status Archived now!", project.public_id
-                            )
-                        except (
-                            sqlalchemy.exc.OperationalError,
-                            sqlalchemy.exc.SQLAlchemyError,
-                        ) as err:
-                            scheduler.app.logger.exception(err)
-                            db.session.rollback()
-                            errors[unit.name][project.public_id] = str(err)
-                        continue
-                    else:
-                        scheduler.app.logger.debug(
-                            "Nothing to do for Project: %s", project.public_id
-                        )
-        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
-            scheduler.app.logger.exception(err)
-            db.session.rollback()
-            raise
+        def change(project):
+            # The contents are removed by a project job, which also adds the Archived status
+            archive.check_archive_possible(project=project)
+            job = project_jobs.enqueue(project=project, new_status="Archived")
+            scheduler.app.logger.debug(f"Project job {job.id} queued.")
 
-        for unit, projects in errors.items():
-            if projects:
-                scheduler.app.logger.error(
-                    f"Following projects of Unit '{unit}' encountered issues during archival process:"
-                )
-                for proj in errors[unit].keys():
-                    scheduler.app.logger.error(f"Error for project '{proj}': {errors[unit][proj]} ")
+        return change_due_projects(current_status="Expired", change=change, task="archival")
+
+
+@scheduler.task("interval", id="project_jobs", seconds=30, misfire_grace_time=30, max_instances=1)
+def process_project_jobs():
+    """Remove the contents of projects queued for deletion or archival"""
+    if not scheduler.app.config.get("RUN_PROJECT_JOBS"):
+        return
+
+    from dds_web.api import project_jobs
+
+    with scheduler.app.app_context():
+        for job in project_jobs.process_jobs():
+            if job.status == "Failed":
+                scheduler.app.logger.error(f"Project job {job.id} failed: {job.error}")
+            else:
+                scheduler.app.logger.info(f"Project job {job.id} done.")
+
+
+@scheduler.task("cron", id="abort_multipart_uploads", minute=30, misfire_grace_time=3600)
+def abort_multipart_uploads():
+    """Abort multipart uploads which have not been completed in time"""
+    from dds_web.api import s3
+    from dds_web.utils import current_time
+
+    scheduler.app.logger.debug("Task: Checking for stale multipart uploads.")
+    with scheduler.app.app_context():
+        aborted, errors = s3.abort_stale_multipart_uploads(
+            older_than=current_time()
+            - timedelta(hours=scheduler.app.config.get("MULTIPART_UPLOAD_TIMEOUT_HOURS", 48))
+        )
+        if aborted:
+            scheduler.app.logger.info(f"{aborted} multipart uploads aborted.")
+        for upload, error in errors.items():
+            scheduler.app.logger.error(f"Multipart upload {upload} not aborted: {error}")
 
 
 @scheduler.task("cron", id="delete_invite", hour=0, minute=1, misfire_grace_time=3600)
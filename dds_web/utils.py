@@ -5,6 +5,7 @@
 ####################################################################################################
 
 # Standard library
+import collections
 import datetime
 import os
 import re
@@ -16,6 +17,7 @@ import flask
 from dds_web.errors import AccessDeniedError
 import flask_mail
 import flask_login
+import sqlalchemy
 
 # # imports related to scheduling
 import atexit
@@ -353,16 +355,67 @@ def working_directory(path):
         os.chdir(current_path)
 
 
-def page_query(q):
-    offset = 0
+def keyset_condition(key, last_key, tiebreaker=None, last_tiebreaker=None, descending=False):
+    """Get the condition selecting the rows after the last row of a page, in the sort order.
+
+    key is the sort column and tiebreaker a unique column ordering rows with the same key.
+    """
+    after = key < last_key if descending else key > last_key
+    if tiebreaker is None:
+        return after
+
+    after_tiebreaker = tiebreaker < last_tiebreaker if descending else tiebreaker > last_tiebreaker
+    return sqlalchemy.or_(after, sqlalchemy.and_(key == last_key, after_tiebreaker))
+
+
+def keyset_query(query, key, tiebreaker=None, page_size=1000, descending=False, yield_per=None):
+    """Iterate over the results of a query in key order, one page at a time.
+
+    Each page starts after the key of the last row of the previous page (keyset pagination),
+    instead of skipping the previous rows with OFFSET. Every page is then found with the index
+    on the key, and rows changed while iterating are neither skipped nor repeated. The key
+    must be unique, e.g. the primary key, or an indexed column with a unique tiebreaker.
+
+    The rows of each page are loaded before they are yielded, so the session can be committed
+    while iterating, unless yield_per is given - then the page is streamed in chunks of that
+    size. Queries of one entity or column yield it, other queries yield named tuples with the
+    names of the selected entities and columns.
+    """
+    columns = [key] if tiebreaker is None else [key, tiebreaker]
+    num_selected = len(query.column_descriptions)
+    row_type = collections.namedtuple(
+        "KeysetRow", [x["name"] for x in query.column_descriptions], rename=True
+    )
+    paged = (
+        query.add_columns(*[x.label(f"keyset_{i}") for i, x in enumerate(columns)])
+        .order_by(None)
+        .order_by(*[x.desc() if descending else x for x in columns])
+    )
+
+    last = None
     while True:
-        r = False
-        for elem in q.limit(1000).offset(offset):
-            r = True
-            yield elem
-        offset += 1000
-        if not r:
-            break
+        page = paged
+        if last is not None:
+            page = page.filter(
+                keyset_condition(
+                    key=key,
+                    last_key=last[0],
+                    tiebreaker=tiebreaker,
+                    last_tiebreaker=last[-1],
+                    descending=descending,
+                )
+            )
+        page = page.limit(page_size)
+        rows = page.yield_per(yield_per) if yield_per else page.all()
+
+        count = 0
+        for row in rows:
+            count += 1
+            last = tuple(row[num_selected:])
+            yield row[0] if num_selected == 1 else row_type(*row[:num_selected])
+
+        if count < page_size:
+            return
 
 
 def create_one_time_password_email(user, hotp_value):
@@ -170,17 +170,23 @@ class DDSEndpoint:
 
     # S3Connector keys
     S3KEYS = BASE_ENDPOINT + "/s3/proj"
+    MULTIPART_UPLOAD = BASE_ENDPOINT + "/s3/multipart"
+    MULTIPART_UPLOAD_URLS = BASE_ENDPOINT + "/s3/multipart/urls"
+    MULTIPART_UPLOAD_COMPLETE = BASE_ENDPOINT + "/s3/multipart/complete"
 
     # File related urls
     FILE_NEW = BASE_ENDPOINT + "/file/new"
+    FILE_NEW_BATCH = BASE_ENDPOINT + "/file/new/batch"
     FILE_MATCH = BASE_ENDPOINT + "/file/match"
     FILE_INFO = BASE_ENDPOINT + "/file/info"
     FILE_INFO_ALL = BASE_ENDPOINT + "/file/all/info"
+    FILE_URLS = BASE_ENDPOINT + "/file/urls"
     FILE_UPDATE = BASE_ENDPOINT + "/file/update"
 
     # Project specific urls
     PROJECT_CREATE = BASE_ENDPOINT + "/proj/create"
     PROJECT_STATUS = BASE_ENDPOINT + "/proj/status"
+    PROJECT_JOB = BASE_ENDPOINT + "/proj/job"
     PROJECT_ACCESS = BASE_ENDPOINT + "/proj/access"
 
     # Listing urls
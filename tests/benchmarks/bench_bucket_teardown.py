@@ -0,0 +1,56 @@
+"""Benchmark removing the objects in a bucket serially and in parallel.
+
+Uses the in memory storage backend with a fixed latency per request, so no s3 service is
+needed. Deleting 1000 objects takes considerably longer than listing them:
+
+    python tests/benchmarks/bench_bucket_teardown.py [objects] [list latency ms] [delete latency ms]
+"""
+
+# Standard library
+import sys
+import time
+
+# Own
+from dds_web.api import bucket_teardown
+from dds_web.api import storage
+
+
+def serial(local):
+    """Previous implementation: list a page, delete it, list the next page."""
+    start = time.perf_counter()
+    deleted = 0
+    for keys in local.list_pages(bucket="benchmark"):
+        local.delete_objects(bucket="benchmark", keys=keys)
+        deleted += len(keys)
+    local.delete_bucket(bucket="benchmark")
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "objects_per_second": deleted / seconds}
+
+
+def main(num_objects=100000, list_latency_ms=50, delete_latency_ms=500):
+    def new_storage():
+        local = storage.LocalBackend(
+            latency={
+                "list_objects": list_latency_ms / 1000,
+                "delete_objects": delete_latency_ms / 1000,
+            }
+        )
+        local.put_objects(
+            bucket="benchmark", sizes={f"object_{i:09}": 1 for i in range(num_objects)}
+        )
+        return local
+
+    result = serial(local=new_storage())
+    print(f"    serial: {result['seconds']:6.2f} s, {result['objects_per_second']:>9.0f} objects/s")
+    for max_workers in [1, 4, 8, 16]:
+        result = bucket_teardown.BucketTeardown(
+            storage=new_storage(), bucket="benchmark", max_workers=max_workers
+        ).run()
+        print(
+            f"{max_workers:>2} threads: {result['seconds']:6.2f} s, "
+            f"{result['objects_per_second']:>9.0f} objects/s"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:4]))
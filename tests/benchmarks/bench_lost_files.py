@@ -0,0 +1,57 @@
+"""Benchmark comparing a bucket with the files in the database, as in `flask lost-files`.
+
+Compares the previous comparison of two sets with the merge join of the sorted keys in
+dds_web.api.lost_files. The bucket is in the in memory storage backend, with a fixed latency per
+list request, and the database keys are a sorted list, so neither s3 nor a database is needed:
+
+    python tests/benchmarks/bench_lost_files.py [objects] [list latency ms]
+"""
+
+# Standard library
+import sys
+import time
+import tracemalloc
+
+# Own
+from dds_web.api import lost_files
+from dds_web.api import storage
+
+
+def sets(local, db_keys):
+    """Previous implementation: all keys of both sides in memory."""
+    s3_keys = set(key for keys in local.list_pages(bucket="benchmark") for key in keys)
+    db_keys = set(db_keys)
+    return len(s3_keys - db_keys) + len(db_keys - s3_keys)
+
+
+def merge_join(local, db_keys):
+    """Streamed comparison of the sorted keys."""
+    return sum(
+        1
+        for _ in lost_files.merge_diff(
+            s3=lost_files.s3_keys(storage=local, bucket="benchmark"), database=iter(db_keys)
+        )
+    )
+
+
+def main(num_objects=1000000, list_latency_ms=20):
+    keys = sorted(f"{i:08x}/file_{i}.txt" for i in range(num_objects))
+    local = storage.LocalBackend(latency={"list_objects": list_latency_ms / 1000})
+    local.put_objects(bucket="benchmark", sizes={x: 1 for x in keys[1:]})
+    db_keys = keys[:-1]
+
+    for name, function in [("sets", sets), ("merge join", merge_join)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        lost = function(local=local, db_keys=db_keys)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{name:>10}: {seconds:6.2f} s, {num_objects / seconds:>9.0f} keys/s, "
+            f"peak memory {peak / 1024**2:7.1f} MiB, {lost} lost files"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:3]))
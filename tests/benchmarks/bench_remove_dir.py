@@ -0,0 +1,117 @@
+"""Benchmark closing versions and deleting file rows when removing a large folder.
+
+Compares the previous per file queries with the set based statements in
+dds_web.api.db_tools.delete_files_in_bulk. Uses the database configured for the app, which
+has to be MariaDB/MySQL (the queries use BINARY), e.g. in the development environment or the
+docker-compose test database (after `flask fill-db-wipe-tables`):
+
+    python tests/benchmarks/bench_remove_dir.py [number of files]
+
+The files are added to the first project in the database and removed again afterwards.
+"""
+
+# Standard library
+import sys
+import time
+
+# Installed
+import sqlalchemy
+
+# Own
+from dds_web import create_app, db
+from dds_web.api import db_tools
+from dds_web.database import models
+from dds_web.scheduled_tasks import scheduler
+import dds_web.utils
+
+FOLDER = "benchmark_remove_dir"
+BATCH_SIZE = 1000
+
+
+def add_files(project, num_files):
+    """Add files and their versions to the folder."""
+    db_tools.insert_files_in_bulk(
+        project=project,
+        files_info=[
+            {
+                "name": f"{FOLDER}/file_{i}",
+                "name_in_bucket": f"{FOLDER}_bucket_file_{i}",
+                "subpath": f"{FOLDER}/sub_{i % 100}",
+                "size_original": 1000,
+                "size_stored": 500,
+                "compressed": True,
+                "public_key": "p" * 64,
+                "salt": "s" * 32,
+                "checksum": "c" * 64,
+            }
+            for i in range(num_files)
+        ],
+        time_uploaded=dds_web.utils.current_time(),
+    )
+    db.session.commit()
+
+
+def files_in_folder(project):
+    """Get the files the same way RemoveDir does."""
+    return (
+        models.File.query.filter(
+            sqlalchemy.and_(
+                models.File.project_id == project.id,
+                models.File.subpath.like(f"{FOLDER}/%"),
+            )
+        )
+        .with_entities(
+            models.File.id,
+            models.File.name_in_bucket,
+            models.File.subpath,
+            models.File.size_original,
+            models.File.size_stored,
+        )
+        .all()
+    )
+
+
+def per_file(project, files):
+    """Previous implementation: one select per version and one delete per file."""
+    for i in range(0, len(files), BATCH_SIZE):
+        for entry in files[i : i + BATCH_SIZE]:
+            current_file_version = models.Version.query.filter(
+                sqlalchemy.and_(
+                    models.Version.active_file == entry.id,
+                    models.Version.time_deleted.is_(None),
+                )
+            ).first()
+            current_file_version.time_deleted = dds_web.utils.current_time()
+            db.session.delete(models.File.query.get(entry.id))
+        db.session.flush()
+
+
+def set_based(project, files):
+    """One update and one delete per batch."""
+    for i in range(0, len(files), BATCH_SIZE):
+        db_tools.delete_files_in_bulk(project=project, files=files[i : i + BATCH_SIZE])
+        db.session.flush()
+
+
+def main(num_files=100000):
+    app = create_app()
+    with app.app_context():
+        scheduler.shutdown()
+        project = models.Project.query.first()
+        add_files(project=project, num_files=num_files)
+        files = files_in_folder(project=project)
+        print(f"Files in folder: {len(files)}")
+
+        # Roll back after the first run so that both remove the same rows
+        for name, function in [("per file", per_file), ("set based", set_based)]:
+            start = time.perf_counter()
+            function(project=project, files=files)
+            print(f"{name:>10}: {time.perf_counter() - start:.2f} s")
+            if function is per_file:
+                db.session.rollback()
+
+        db.session.commit()
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:2]))
@@ -0,0 +1,51 @@
+"""Benchmark the batch url signer against botocore.
+
+Not collected by pytest, run with: python tests/benchmarks/bench_url_signer.py [number of keys]
+"""
+
+# Standard library
+import sys
+import time
+import uuid
+
+# Installed
+import boto3
+import botocore.config
+
+# Own
+from dds_web.api import url_signer
+
+
+def main(num_keys=100000):
+    keys = [f"{uuid.uuid4().hex}{uuid.uuid4().hex}" for _ in range(num_keys)]
+
+    client = boto3.session.Session().client(
+        "s3",
+        endpoint_url="https://s3.example.com",
+        region_name="us-east-1",
+        aws_access_key_id="access",
+        aws_secret_access_key="secret",
+        config=botocore.config.Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+    )
+    start = time.perf_counter()
+    for key in keys:
+        client.generate_presigned_url(
+            "get_object", Params={"Bucket": "bucket", "Key": key}, ExpiresIn=604800
+        )
+    botocore_time = time.perf_counter() - start
+
+    signer = url_signer.PresignedUrlSigner(
+        endpoint="https://s3.example.com", access_key="access", secret_key="secret", bucket="bucket"
+    )
+    start = time.perf_counter()
+    signer.generate_get_urls(keys=keys)
+    signer_time = time.perf_counter() - start
+
+    print(f"Keys: {num_keys}")
+    print(f"botocore:     {botocore_time:.2f} s ({num_keys / botocore_time:.0f} urls/s)")
+    print(f"batch signer: {signer_time:.2f} s ({num_keys / signer_time:.0f} urls/s)")
+    print(f"Speedup:      {botocore_time / signer_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:2]))
@@ -28,6 +28,8 @@ from dds_web.database.models import (
     DeletionRequest,
 )
 import dds_web.utils
+from dds_web.api import db_tools
+from dds_web.api import s3_client_pool
 from dds_web import create_app, db
 from dds_web.security.project_user_keys import (
     generate_project_key_pair,
@@ -88,6 +90,11 @@ def fill_basic_db(db):
         project=projects[3],
     )
 
+    # Files are added directly to the session - build the folder index and counters for them
+    for project in projects:
+        db_tools.rebuild_folder_index(project=project)
+        db_tools.recompute_project_counters(project=project)
+
     db.session.commit()
 
 
@@ -501,8 +508,20 @@ def module_client(setup_database):
                 db.engine.dispose()
 
 
+@pytest.fixture(autouse=True)
+def empty_s3_client_pool():
+    """Do not reuse S3 connections (or mocks of them), cached buckets or units between tests"""
+    s3_client_pool.pool.clear()
+    s3_client_pool.buckets.clear()
+    s3_client_pool.units.clear()
+    yield
+    s3_client_pool.pool.clear()
+    s3_client_pool.buckets.clear()
+    s3_client_pool.units.clear()
+
+
 @pytest.fixture()
 def boto3_session():
     """Create a mock boto3 session since no access permissions are in place for testing"""
-    with unittest.mock.patch.object(boto3.session.Session, "resource") as mock_session:
+    with unittest.mock.patch.object(boto3.session.Session, "client") as mock_session:
         yield mock_session
@@ -0,0 +1,199 @@
+# IMPORTS ################################################################################ IMPORTS #
+
+# Standard library
+import concurrent.futures
+import http
+import threading
+import unittest.mock
+
+# Installed
+import botocore
+import pytest
+
+# Own
+from dds_web.api import bucket_teardown
+from dds_web.api import storage
+import tests
+
+# TOOLS #################################################################################### TOOLS #
+
+
+class FailingStorage(storage.LocalBackend):
+    """Local storage where some objects cannot be deleted, or all requests fail after a while."""
+
+    def __init__(self, keys, fail_keys=(), fail_after_requests=None):
+        super().__init__()
+        self.put_objects(bucket="bucket", sizes={x: 1 for x in keys})
+        self.fail_keys = set(fail_keys)
+        self.fail_after_requests = fail_after_requests
+
+    @property
+    def objects(self):
+        return set(self.buckets.get("bucket", {}))
+
+    @property
+    def delete_requests(self):
+        return self.requests.get("delete_objects", 0)
+
+    @property
+    def bucket_deleted(self):
+        return "bucket" not in self.buckets
+
+    def delete_objects(self, bucket, keys):
+        if self.fail_after_requests and self.delete_requests >= self.fail_after_requests:
+            raise storage.client_error(code="ServiceUnavailable", operation="delete_objects")
+
+        errors = {x: "AccessDenied: Denied" for x in keys if x in self.fail_keys}
+        super().delete_objects(bucket=bucket, keys=[x for x in keys if x not in errors])
+        return errors
+
+
+class LateFuture(concurrent.futures.Future):
+    """A finished future which is reported as running the first time it is checked."""
+
+    def __init__(self):
+        super().__init__()
+        self.checked = False
+
+    def done(self):
+        if not self.checked:
+            self.checked = True
+            return False
+        return super().done()
+
+
+class LateExecutor(concurrent.futures.ThreadPoolExecutor):
+    """Executor where each page finishes between two checks of its future."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = LateFuture()
+        future.set_result(super().submit(fn, *args, **kwargs).result())
+        return future
+
+
+KEYS = [f"key_{i:05}" for i in range(2500)]
+
+# TESTS #################################################################################### TESTS #
+
+
+def test_teardown_removes_all_objects_and_bucket():
+    """All pages are deleted, then the bucket."""
+    local = FailingStorage(keys=KEYS)
+    checkpoints = []
+    result = bucket_teardown.BucketTeardown(
+        storage=local,
+        bucket="bucket",
+        page_size=100,
+        max_workers=4,
+        on_checkpoint=lambda checkpoint, _: checkpoints.append(checkpoint),
+    ).run()
+
+    assert result["deleted"] == len(KEYS)
+    assert not result["errors"]
+    assert result["objects_per_second"] > 0
+    assert local.delete_requests == 25
+    assert local.bucket_deleted
+    assert checkpoints == sorted(checkpoints)
+    assert checkpoints[-1] == result["checkpoint"] == KEYS[-1]
+
+
+def test_teardown_keeps_bucket_with_failed_objects():
+    """Objects which cannot be deleted are reported and the checkpoint stops before them."""
+    local = FailingStorage(keys=KEYS, fail_keys=["key_01234"])
+    result = bucket_teardown.BucketTeardown(
+        storage=local, bucket="bucket", page_size=100, max_workers=4
+    ).run()
+
+    assert result["errors"] == {"key_01234": "AccessDenied: Denied"}
+    assert result["deleted"] == len(KEYS) - 1
+    assert result["checkpoint"] == "key_01199"
+    assert not local.bucket_deleted
+    assert local.objects == {"key_01234"}
+
+
+def test_teardown_page_finished_while_listing():
+    """A page which finishes while the futures are checked does not stop the listing."""
+    local = FailingStorage(keys=KEYS)
+    with unittest.mock.patch.object(
+        bucket_teardown.concurrent.futures, "ThreadPoolExecutor", LateExecutor
+    ):
+        result = bucket_teardown.BucketTeardown(
+            storage=local, bucket="bucket", page_size=100, max_workers=4
+        ).run()
+
+    assert result["deleted"] == len(KEYS)
+    assert not result["errors"]
+    assert local.bucket_deleted
+
+
+def test_teardown_checkpoint_saved_outside_lock():
+    """A slow checkpoint callback does not hold up the deletion of the other pages."""
+    local = FailingStorage(keys=KEYS)
+    all_deleted = threading.Event()
+    checkpoints = []
+
+    def slow_save(checkpoint, _):
+        # The first call waits until the other threads have deleted all pages
+        if not checkpoints:
+            assert all_deleted.wait(timeout=10)
+        checkpoints.append(checkpoint)
+
+    def delete_objects(bucket, keys):
+        errors = FailingStorage.delete_objects(local, bucket=bucket, keys=keys)
+        if not local.objects:
+            all_deleted.set()
+        return errors
+
+    local.delete_objects = delete_objects
+    result = bucket_teardown.BucketTeardown(
+        storage=local, bucket="bucket", page_size=100, max_workers=4, on_checkpoint=slow_save
+    ).run()
+
+    assert result["deleted"] == len(KEYS)
+    assert checkpoints == sorted(checkpoints)
+    assert checkpoints[-1] == KEYS[-1]
+
+
+def test_teardown_resumes_from_checkpoint():
+    """An interrupted teardown continues after the last checkpoint."""
+    local = FailingStorage(keys=KEYS, fail_after_requests=10)
+    checkpoints = []
+    with pytest.raises(botocore.exceptions.ClientError):
+        bucket_teardown.BucketTeardown(
+            storage=local,
+            bucket="bucket",
+            page_size=100,
+            max_workers=1,
+            on_checkpoint=lambda checkpoint, _: checkpoints.append(checkpoint),
+        ).run()
+
+    assert checkpoints[-1] == "key_00999"
+    assert not local.bucket_deleted
+
+    local.fail_after_requests = None
+    local.requests.clear()
+    result = bucket_teardown.BucketTeardown(
+        storage=local, bucket="bucket", page_size=100, checkpoint=checkpoints[-1]
+    ).run()
+    assert result["deleted"] == len(KEYS) - 1000
+    assert local.delete_requests == 15
+    assert local.bucket_deleted
+
+
+def test_delete_project_removes_bucket(client, boto3_session):
+    """Deleting a project tears down its bucket through the s3 client."""
+    s3_client = boto3_session.return_value
+    s3_client.list_objects_v2.return_value = {
+        "Contents": [{"Key": "name_in_bucket_1"}, {"Key": "name_in_bucket_2"}],
+        "IsTruncated": False,
+    }
+    s3_client.delete_objects.return_value = {}
+
+    response = client.delete(
+        tests.DDSEndpoint.REMOVE_PROJ_CONT,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "public_project_id"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert s3_client.delete_objects.call_count == 1
+    assert s3_client.delete_bucket.call_count == 1
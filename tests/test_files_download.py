@@ -5,6 +5,9 @@ import http
 import json
 import unittest
 
+# Installed
+import botocore
+
 # Own
 from dds_web.api import api_s3_connector
 from dds_web.database import models
@@ -152,9 +155,9 @@ def test_file_download(client, boto3_session):
     assert response.status_code == http.HTTPStatus.OK
 
     with unittest.mock.patch(
-        "dds_web.api.api_s3_connector.ApiS3Connector.generate_get_url"
+        "dds_web.api.api_s3_connector.ApiS3Connector.generate_get_urls"
     ) as mock_url:
-        mock_url.return_value = "url"
+        mock_url.side_effect = lambda keys: {x: "url" for x in keys}
         response = client.get(
             tests.DDSEndpoint.FILE_INFO,
             headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
@@ -228,9 +231,9 @@ def test_files_find_all_for_download(client, boto3_session):
     assert response.status_code == http.HTTPStatus.OK
 
     with unittest.mock.patch(
-        "dds_web.api.api_s3_connector.ApiS3Connector.generate_get_url"
+        "dds_web.api.api_s3_connector.ApiS3Connector.generate_get_urls"
     ) as mock_url:
-        mock_url.return_value = "url"
+        mock_url.side_effect = lambda keys: {x: "url" for x in keys}
         response = client.get(
             tests.DDSEndpoint.FILE_INFO_ALL,
             headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
@@ -292,3 +295,225 @@ def test_files_find_all_for_download(client, boto3_session):
             assert f"filename_a{i+1}" in files
             assert f"filename_b{i+1}" in files
         unittest.TestCase().assertDictEqual(expected_output, files)
+
+
+def test_file_download_all_paginated_and_streamed(client, boto3_session):
+    """Get the file info for all files one page at a time and as a stream."""
+    response = client.post(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(client),
+        query_string={"project": "public_project_id"},
+        json={"new_status": "Available"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+
+    project = models.Project.query.filter_by(public_id="public_project_id").one_or_none()
+    all_files = {x.name for x in project.files}
+    assert len(all_files) == 12
+
+    with unittest.mock.patch(
+        "dds_web.api.api_s3_connector.ApiS3Connector.generate_get_urls"
+    ) as mock_url:
+        mock_url.side_effect = lambda keys: {x: "url" for x in keys}
+
+        # Invalid page size
+        response = client.get(
+            tests.DDSEndpoint.FILE_INFO_ALL,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+            query_string={"project": "public_project_id"},
+            json={"limit": 0},
+        )
+        assert response.status_code == http.HTTPStatus.BAD_REQUEST
+        assert "The limit must be an integer" in response.json["message"]
+
+        # Pages of 5 files
+        paged_files = {}
+        cursor = None
+        for _ in range(3):
+            response = client.get(
+                tests.DDSEndpoint.FILE_INFO_ALL,
+                headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+                query_string={"project": "public_project_id"},
+                json={"limit": 5, "cursor": cursor},
+            )
+            assert response.status_code == http.HTTPStatus.OK
+            assert not set(response.json["files"]).intersection(paged_files)
+            paged_files.update(response.json["files"])
+            cursor = response.json["next_cursor"]
+        assert cursor is None
+        assert set(paged_files) == all_files
+        assert all(x["url"] == "url" for x in paged_files.values())
+
+        # NDJSON stream
+        response = client.get(
+            tests.DDSEndpoint.FILE_INFO_ALL,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+            query_string={"project": "public_project_id"},
+            json={"stream": True},
+        )
+        assert response.status_code == http.HTTPStatus.OK
+        assert response.mimetype == "application/x-ndjson"
+        *streamed_files, trailer = [json.loads(x) for x in response.data.decode().splitlines()]
+        assert trailer == {"complete": True, "num_files": len(all_files)}
+        assert len(streamed_files) == len(all_files)
+        for entry in streamed_files:
+            name = entry.pop("name")
+            assert entry == paged_files[name]
+
+
+def test_file_download_stream_empty_and_failing(client, boto3_session):
+    """An empty project is an error before the stream starts, later errors end the stream."""
+    response = client.get(
+        tests.DDSEndpoint.FILE_INFO_ALL,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json={"stream": True},
+    )
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+    assert "The project is empty" in response.json["message"]
+
+    with unittest.mock.patch(
+        "dds_web.api.api_s3_connector.ApiS3Connector.generate_get_urls"
+    ) as mock_url:
+        mock_url.side_effect = botocore.exceptions.ClientError(
+            {"Error": {"Code": "500", "Message": "Error"}}, "generate_get_urls"
+        )
+        response = client.get(
+            tests.DDSEndpoint.FILE_INFO_ALL,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(client),
+            query_string={"project": "public_project_id"},
+            json={"stream": True},
+        )
+        assert response.status_code == http.HTTPStatus.OK
+        lines = [json.loads(x) for x in response.data.decode().splitlines()]
+        assert lines == [
+            {"complete": False, "error": "Could not get the info on all project files."}
+        ]
+
+
+def test_file_download_metadata_only_and_urls(client, boto3_session):
+    """List the file info without urls and then request the urls for some of the files."""
+    response = client.post(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(client),
+        query_string={"project": "public_project_id"},
+        json={"new_status": "Available"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+
+    with unittest.mock.patch(
+        "dds_web.api.api_s3_connector.ApiS3Connector.generate_get_urls"
+    ) as mock_url:
+        mock_url.side_effect = lambda keys: {x: f"url_{x}" for x in keys}
+
+        # No connection to s3 without urls
+        with unittest.mock.patch("dds_web.api.storage.get_backend") as mock_backend:
+            response = client.get(
+                tests.DDSEndpoint.FILE_INFO,
+                headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+                query_string={"project": "public_project_id", "metadata_only": True},
+                json=["filename1"],
+            )
+            assert response.status_code == http.HTTPStatus.OK
+            assert response.json["files"]["filename1"]["url"] is None
+
+            response = client.get(
+                tests.DDSEndpoint.FILE_INFO_ALL,
+                headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+                query_string={"project": "public_project_id", "metadata_only": "true"},
+            )
+            assert response.status_code == http.HTTPStatus.OK
+            files = response.json["files"]
+            assert all(x["url"] is None for x in files.values())
+
+            response = client.get(
+                tests.DDSEndpoint.FILE_INFO_ALL,
+                headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+                query_string={"project": "public_project_id", "metadata_only": "true"},
+                json={"stream": True},
+            )
+            assert response.status_code == http.HTTPStatus.OK
+            assert json.loads(response.data.decode().splitlines()[0])["url"] is None
+        mock_backend.assert_not_called()
+        mock_url.assert_not_called()
+
+        # Request the urls just in time
+        keys = [files["filename1"]["name_in_bucket"], files["filename2"]["name_in_bucket"]]
+        response = client.get(
+            tests.DDSEndpoint.FILE_URLS,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+            query_string={"project": "public_project_id"},
+            json=keys + ["not_a_file_in_project"],
+        )
+        assert response.status_code == http.HTTPStatus.OK
+        assert response.json["urls"] == {x: f"url_{x}" for x in keys}
+        assert response.json["not_found"] == ["not_a_file_in_project"]
+
+        # Not a list
+        response = client.get(
+            tests.DDSEndpoint.FILE_URLS,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+            query_string={"project": "public_project_id"},
+            json={"keys": keys},
+        )
+        assert response.status_code == http.HTTPStatus.BAD_REQUEST
+        assert "A list of file keys" in response.json["message"]
+
+
+def test_file_download_multiple_folders(client, boto3_session):
+    """Get the contents of several, partly overlapping, folders."""
+    response = client.post(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(client),
+        query_string={"project": "public_project_id"},
+        json={"new_status": "Available"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+
+    with unittest.mock.patch(
+        "dds_web.api.api_s3_connector.ApiS3Connector.generate_get_urls"
+    ) as mock_url:
+        mock_url.side_effect = lambda keys: {x: "url" for x in keys}
+        response = client.get(
+            tests.DDSEndpoint.FILE_INFO,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+            query_string={"project": "public_project_id"},
+            json=["sub/path/to/folder1", "sub/path/to/", "sub/path/to/folder", "filename1"],
+        )
+    assert response.status_code == http.HTTPStatus.OK
+    assert list(response.json["files"]) == ["filename1"]
+    folder_contents = response.json["folder_contents"]
+    assert set(folder_contents["sub/path/to/folder1"]) == {"filename_a1"}
+    assert set(folder_contents["sub/path/to/"]) == {
+        f"filename_{x}{i + 1}" for x in ["a", "b"] for i in range(5)
+    }
+    # Only complete folder names match
+    assert "sub/path/to/folder" not in folder_contents
+
+
+def test_file_download_same_folder_and_root(client, boto3_session):
+    """A folder requested with and without a trailing slash, and the project root."""
+    response = client.post(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(client),
+        query_string={"project": "public_project_id"},
+        json={"new_status": "Available"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+
+    project = models.Project.query.filter_by(public_id="public_project_id").one_or_none()
+    with unittest.mock.patch(
+        "dds_web.api.api_s3_connector.ApiS3Connector.generate_get_urls"
+    ) as mock_url:
+        mock_url.side_effect = lambda keys: {x: "url" for x in keys}
+        response = client.get(
+            tests.DDSEndpoint.FILE_INFO,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+            query_string={"project": "public_project_id"},
+            json=["sub/path/to/folder1", "sub/path/to/folder1/", "."],
+        )
+    assert response.status_code == http.HTTPStatus.OK
+    folder_contents = response.json["folder_contents"]
+    assert set(folder_contents["sub/path/to/folder1"]) == {"filename_a1"}
+    assert set(folder_contents["sub/path/to/folder1/"]) == {"filename_a1"}
+    assert set(folder_contents["."]) == {x.name for x in project.files}
@@ -1,6 +1,7 @@
 import http
 import json
 import time
+import unittest.mock
 
 import pytest
 import marshmallow
@@ -8,6 +9,7 @@ import marshmallow
 from dds_web import db
 import dds_web.utils
 from dds_web.database import models
+from dds_web.api import db_tools, files
 import tests
 
 FIRST_NEW_FILE = {
@@ -847,3 +849,372 @@ def test_new_file_wrong_status(client):
 
     assert response.status_code == http.HTTPStatus.BAD_REQUEST
     assert "Project not in right status to upload/modify files" in response.json.get("message")
+
+
+def test_new_file_batch_not_list(client):
+    """The batch endpoint requires a list of files."""
+    response = client.post(
+        tests.DDSEndpoint.FILE_NEW_BATCH,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=FIRST_NEW_FILE,
+    )
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+    assert "A list of files is required." in response.json["message"]
+
+
+def test_new_file_batch(client):
+    """Add multiple files in one request and get the result per file."""
+
+    project_1 = project_row(project_id="file_testing_project")
+    assert project_1
+
+    # Add one file first to check that existing files are reported
+    response = client.post(
+        tests.DDSEndpoint.FILE_NEW,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=FIRST_NEW_FILE,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+
+    new_files = []
+    for i in range(3):
+        new_file = FIRST_NEW_FILE.copy()
+        new_file["name"] = f"batch_file_{i}"
+        new_file["name_in_bucket"] = f"batch_bucket_file_{i}"
+        new_files.append(new_file)
+    invalid_file = FIRST_NEW_FILE.copy()
+    invalid_file["name"] = "invalid_batch_file"
+    invalid_file["salt"] = "test"
+
+    response = client.post(
+        tests.DDSEndpoint.FILE_NEW_BATCH,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=[*new_files, FIRST_NEW_FILE, invalid_file],
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert sorted(response.json["added"]) == sorted(x["name"] for x in new_files)
+    assert "already exists" in response.json["not_added"][FIRST_NEW_FILE["name"]]
+    assert "salt" in response.json["not_added"][invalid_file["name"]]
+
+    for new_file in new_files:
+        assert file_in_db(test_dict=new_file, project=project_1.id)
+        file_row = models.File.query.filter_by(name=new_file["name"], project_id=project_1.id).one()
+        assert len(file_row.versions) == 1
+        assert file_row.versions[0].size_stored == new_file["size_processed"]
+    assert not file_in_db(test_dict=invalid_file, project=project_1.id)
+
+    # Names which are not strings are reported per entry
+    response = client.post(
+        tests.DDSEndpoint.FILE_NEW_BATCH,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=[{**FIRST_NEW_FILE, "name": ["list_name"]}],
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert not response.json["added"]
+    assert "name" in response.json["not_added"]["Entry 0"]
+
+
+def test_folder_index_updated(client, boto3_session):
+    """The folder rows should follow the files added to and removed from the project."""
+
+    project_1 = project_row(project_id="file_testing_project")
+    assert project_1
+
+    def folders_in_db():
+        return {
+            x.path: (x.parent, x.num_files, x.size_original)
+            for x in models.Folder.query.filter_by(project_id=project_1.id).all()
+        }
+
+    file_in_subfolder = FIRST_NEW_FILE.copy()
+    file_in_subfolder["name"] = "file_in_subfolder"
+    file_in_subfolder["name_in_bucket"] = "bucketfile_in_subfolder"
+    file_in_subfolder["subpath"] = "subpath/subfolder"
+
+    for new_file in [FIRST_NEW_FILE, file_in_subfolder]:
+        response = client.post(
+            tests.DDSEndpoint.FILE_NEW,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+            query_string={"project": "file_testing_project"},
+            json=new_file,
+        )
+        assert response.status_code == http.HTTPStatus.OK
+
+    assert folders_in_db() == {
+        "subpath": (".", 2, 2000),
+        "subpath/subfolder": ("subpath", 1, 1000),
+    }
+
+    response = client.get(
+        tests.DDSEndpoint.LIST_FILES,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json={"subpath": "subpath"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert sorted(response.json["files_folders"], key=lambda x: x["name"]) == [
+        {"folder": False, "name": "filename1"},
+        {"folder": True, "name": "subfolder"},
+    ]
+
+    # Overwrite with a larger file
+    response = client.put(
+        tests.DDSEndpoint.FILE_NEW,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json={**FIRST_NEW_FILE, "size": 3000},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert folders_in_db() == {
+        "subpath": (".", 2, 4000),
+        "subpath/subfolder": ("subpath", 1, 1000),
+    }
+
+    response = client.delete(
+        tests.DDSEndpoint.REMOVE_FILE,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=[file_in_subfolder["name"]],
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert folders_in_db() == {"subpath": (".", 1, 3000)}
+
+    response = client.delete(
+        tests.DDSEndpoint.REMOVE_FOLDER,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=["subpath"],
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert not folders_in_db()
+
+
+def test_folder_index_single_row_per_folder(client):
+    """Separate updates for the same folder should add to one row, not create a new one."""
+
+    project_1 = project_row(project_id="file_testing_project")
+    assert project_1
+
+    for _ in range(2):
+        db_tools.update_folder_index(project=project_1, added=[("shared/folder", 100)])
+        db.session.commit()
+
+    folders = models.Folder.query.filter_by(project_id=project_1.id).all()
+    assert sorted((x.path, x.num_files, x.size_original) for x in folders) == [
+        ("shared", 2, 200),
+        ("shared/folder", 2, 200),
+    ]
+    assert all(x.path_hash == models.folder_path_hash(x.path) for x in folders)
+
+    db_tools.update_folder_index(project=project_1, removed=[("shared/folder", 100)] * 2)
+    db.session.commit()
+    assert not models.Folder.query.filter_by(project_id=project_1.id).all()
+
+
+def test_project_counters_updated(client, boto3_session):
+    """The number of files and bytes of the project should follow the files."""
+
+    project_1 = project_row(project_id="file_testing_project")
+    assert project_1
+
+    def counters():
+        db.session.refresh(project_1)
+        return project_1.file_count, project_1.bytes_stored, project_1.bytes_original
+
+    assert counters() == (0, 0, 0)
+
+    batch = []
+    for i in range(2):
+        new_file = FIRST_NEW_FILE.copy()
+        new_file["name"] = f"counted_file_{i}"
+        new_file["name_in_bucket"] = f"counted_bucketfile_{i}"
+        batch.append(new_file)
+
+    response = client.post(
+        tests.DDSEndpoint.FILE_NEW,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=FIRST_NEW_FILE,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    response = client.post(
+        tests.DDSEndpoint.FILE_NEW_BATCH,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=batch,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert counters() == (3, 1500, 3000)
+    assert project_1.num_files == 3
+    assert project_1.size == 1500
+
+    # Overwrite with a larger file
+    response = client.put(
+        tests.DDSEndpoint.FILE_NEW,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json={**FIRST_NEW_FILE, "size": 3000, "size_processed": 2000},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert counters() == (3, 3000, 5000)
+
+    response = client.delete(
+        tests.DDSEndpoint.REMOVE_FILE,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=[batch[0]["name"]],
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert counters() == (2, 2500, 4000)
+
+    response = client.delete(
+        tests.DDSEndpoint.REMOVE_FOLDER,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=["subpath"],
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert counters() == (0, 0, 0)
+
+
+def test_recompute_project_counters(client):
+    """The command sets the counters from the files in the database."""
+
+    project = project_row(project_id="public_project_id")
+    num_files = models.File.query.filter_by(project_id=project.id).count()
+    assert num_files
+    assert project.file_count == num_files
+    bytes_stored = project.bytes_stored
+
+    project.file_count = project.bytes_stored = project.bytes_original = 0
+    db.session.commit()
+
+    result = client.application.test_cli_runner().invoke(
+        args=["recompute-project-counters", "--project", "public_project_id"]
+    )
+    assert result.exit_code == 0
+
+    project = project_row(project_id="public_project_id")
+    assert project.file_count == num_files
+    assert project.bytes_stored == bytes_stored
+    assert project.bytes_original == sum(
+        x.size_original for x in models.File.query.filter_by(project_id=project.id)
+    )
+
+    result = client.application.test_cli_runner().invoke(
+        args=["recompute-project-counters", "--project", "nonexistent"]
+    )
+    assert result.exit_code == 1
+
+
+def test_remove_multiple_files(client, boto3_session):
+    """Remove multiple files with one s3 request and report the failures per file."""
+
+    project_1 = project_row(project_id="file_testing_project")
+    assert project_1
+
+    new_files = []
+    for i in range(3):
+        new_file = FIRST_NEW_FILE.copy()
+        new_file["name"] = f"file_to_remove_{i}"
+        new_file["name_in_bucket"] = f"bucketfile_to_remove_{i}"
+        new_files.append(new_file)
+
+    response = client.post(
+        tests.DDSEndpoint.FILE_NEW_BATCH,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=new_files,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    version_ids = {
+        x["name"]: models.File.query.filter_by(name=x["name"], project_id=project_1.id)
+        .one()
+        .versions[0]
+        .id
+        for x in new_files
+    }
+
+    # The second file cannot be deleted from the bucket
+    s3_client = boto3_session.return_value
+    s3_client.delete_objects.return_value = {
+        "Errors": [
+            {"Key": "bucketfile_to_remove_1", "Code": "AccessDenied", "Message": "Access Denied"}
+        ]
+    }
+
+    response = client.delete(
+        tests.DDSEndpoint.REMOVE_FILE,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=[x["name"] for x in new_files] + ["nonexistent_file"],
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert response.json["not_exists"] == ["nonexistent_file"]
+    assert response.json["not_removed"] == {"file_to_remove_1": "AccessDenied: Access Denied"}
+    assert s3_client.delete_objects.call_count == 1
+
+    assert not file_in_db(test_dict=new_files[0], project=project_1.id)
+    assert file_in_db(test_dict=new_files[1], project=project_1.id)
+    assert not file_in_db(test_dict=new_files[2], project=project_1.id)
+
+    # Versions of removed files are closed
+    for name, version_id in version_ids.items():
+        version = models.Version.query.get(version_id)
+        if name == "file_to_remove_1":
+            assert version.time_deleted is None
+            assert version.active_file is not None
+        else:
+            assert version.time_deleted is not None
+            assert version.active_file is None
+
+
+def test_remove_folder_in_chunks(client, boto3_session):
+    """Remove a folder one chunk of files at a time and report the progress per chunk."""
+
+    project_1 = project_row(project_id="file_testing_project")
+    assert project_1
+
+    subpaths = ["rm_folder"] * 3 + ["rm_folder/sub"] * 2 + ["rm_folderX", "RM_FOLDER"]
+    new_files = []
+    for i, subpath in enumerate(subpaths):
+        new_file = FIRST_NEW_FILE.copy()
+        new_file["name"] = f"{subpath}/file_{i}"
+        new_file["name_in_bucket"] = f"bucketfile_rm_folder_{i}"
+        new_file["subpath"] = subpath
+        new_files.append(new_file)
+
+    response = client.post(
+        tests.DDSEndpoint.FILE_NEW_BATCH,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=new_files,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+
+    with unittest.mock.patch.object(files.RemoveDir, "BATCH_SIZE", 2):
+        response = client.delete(
+            tests.DDSEndpoint.REMOVE_FOLDER,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+            query_string={"project": "file_testing_project"},
+            json=["rm_folder", "rm_nonexistent"],
+        )
+    assert response.status_code == http.HTTPStatus.OK
+    assert not response.json["not_removed"]
+    assert response.json["not_exists"] == ["rm_nonexistent"]
+    assert response.json["nr_deleted"] == 5
+    assert sum(response.json["nr_deleted_per_chunk"]["rm_folder"]) == 5
+    assert all(x <= 2 for x in response.json["nr_deleted_per_chunk"]["rm_folder"])
+
+    # The bucket is only checked before the first chunk
+    assert boto3_session.return_value.head_bucket.call_count == 1
+
+    # Only the files in the folder and its subfolders are removed
+    for new_file in new_files:
+        assert file_in_db(test_dict=new_file, project=project_1.id) == (
+            new_file["subpath"] in ["rm_folderX", "RM_FOLDER"]
+        )
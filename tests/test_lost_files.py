@@ -0,0 +1,128 @@
+# IMPORTS ################################################################################ IMPORTS #
+
+# Standard library
+import json
+import unittest.mock
+
+# Installed
+import pytest
+import sqlalchemy
+
+# Own
+from dds_web import lost_files_s3_db
+from dds_web.api import lost_files
+from dds_web.api import storage
+from dds_web.database import models
+
+# TOOLS #################################################################################### TOOLS #
+
+
+def local_storage_with_lost_files():
+    """Buckets matching the database, except for one lost file on each side in one project."""
+    local = storage.LocalBackend()
+    project = models.Project.query.filter_by(public_id="public_project_id").one()
+    for other in models.Project.query:
+        keys = {x.name_in_bucket for x in other.files}
+        if other == project:
+            keys = keys - {"name_in_bucket_1"} | {"not_in_db"}
+        local.put_objects(bucket=other.bucket, sizes=dict.fromkeys(keys, 1))
+    return local, project
+
+
+# TESTS #################################################################################### TESTS #
+
+
+def test_merge_diff():
+    """Keys only on one side are reported, in S3 (byte) order."""
+    s3 = ["a", "b", "d", "ä", "ö"]
+    database = ["B", "b", "c", "d", "ö", "✓"]
+    assert list(lost_files.merge_diff(s3=iter(s3), database=iter(database))) == [
+        ("db", "B"),
+        ("s3", "a"),
+        ("db", "c"),
+        ("s3", "ä"),
+        ("db", "✓"),
+    ]
+    assert list(lost_files.merge_diff(s3=iter([]), database=iter([]))) == []
+
+
+def test_merge_diff_unsorted_input():
+    """Keys which are not in S3 order would give the wrong result."""
+    with pytest.raises(ValueError):
+        list(lost_files.merge_diff(s3=iter(["b", "a"]), database=iter([])))
+
+
+def test_lost_files_list_json(client):
+    """The lost files and a summary per project are printed as JSON lines."""
+    local, project = local_storage_with_lost_files()
+    with unittest.mock.patch("dds_web.api.storage.get_backend", return_value=local):
+        result = client.application.test_cli_runner().invoke(
+            lost_files_s3_db, ["list", "--json", "--workers", "3"]
+        )
+
+    assert result.exit_code == 1
+    lines = [json.loads(x) for x in result.output.splitlines()]
+    files = sorted((x["key"], x["in"]) for x in lines if x["type"] == "file")
+    assert files == [("name_in_bucket_1", "db"), ("not_in_db", "s3")]
+
+    summaries = {x["project"]: x for x in lines if x["type"] == "project"}
+    assert len(summaries) == models.Project.query.count()
+    assert summaries[project.public_id]["in_db_only"] == 1
+    assert summaries[project.public_id]["in_s3_only"] == 1
+    assert not any(x["error"] for x in summaries.values())
+    assert not local.requests.get("delete_objects")
+
+
+def test_lost_files_delete(client):
+    """Objects only in the bucket and files only in the database are deleted."""
+    local, project = local_storage_with_lost_files()
+    del local.buckets["bucket"]
+    num_files = models.File.query.filter_by(project_id=project.id).count()
+    with unittest.mock.patch("dds_web.api.storage.get_backend", return_value=local):
+        result = client.application.test_cli_runner().invoke(
+            lost_files_s3_db, ["delete", "--json", "--workers", "1"]
+        )
+
+    assert result.exit_code == 0
+    summaries = {x["project"]: x for x in map(json.loads, result.output.splitlines())}
+    assert summaries["file_testing_project"]["error"] == "NoSuchBucket"
+    assert "not_in_db" not in local.buckets[project.bucket]
+    assert local.requests["delete_objects"] == 1
+    assert not models.File.query.filter_by(name_in_bucket="name_in_bucket_1").count()
+    assert models.File.query.filter_by(project_id=project.id).count() == num_files - 1
+
+
+def test_lost_files_delete_db_error(client):
+    """A database error while deleting is rolled back and fails the command."""
+    local, project = local_storage_with_lost_files()
+    num_files = models.File.query.filter_by(project_id=project.id).count()
+    error = sqlalchemy.exc.OperationalError("statement", {}, "error")
+    with unittest.mock.patch("dds_web.api.storage.get_backend", return_value=local):
+        with unittest.mock.patch("dds_web.api.db_tools.delete_files_in_bulk", side_effect=error):
+            result = client.application.test_cli_runner().invoke(
+                lost_files_s3_db, ["delete", "--json", "--workers", "1"]
+            )
+
+    assert result.exit_code == 1
+    summaries = {x["project"]: x for x in map(json.loads, result.output.splitlines())}
+    assert summaries[project.public_id]["error"]
+    assert models.File.query.filter_by(project_id=project.id).count() == num_files
+
+
+def test_lost_files_delete_s3_errors(client):
+    """Objects which could not be deleted are reported and fail the command."""
+    local, project = local_storage_with_lost_files()
+
+    def delete_objects(bucket, keys):
+        return {x: "AccessDenied: Denied" for x in keys}
+
+    local.delete_objects = delete_objects
+    with unittest.mock.patch("dds_web.api.storage.get_backend", return_value=local):
+        result = client.application.test_cli_runner().invoke(
+            lost_files_s3_db, ["delete", "--json", "--workers", "1"]
+        )
+
+    assert result.exit_code == 1
+    summaries = {x["project"]: x for x in map(json.loads, result.output.splitlines())}
+    assert summaries[project.public_id]["not_deleted"] == {"not_in_db": "AccessDenied: Denied"}
+    assert "not_in_db" in local.buckets[project.bucket]
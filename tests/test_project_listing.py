@@ -1,13 +1,21 @@
 # IMPORTS ################################################################################ IMPORTS #
 
 # Standard library
+import contextlib
+import datetime
 import http
 import json
 import pytest
 import marshmallow
 import unittest
 
+# Installed
+import sqlalchemy
+
 # Own
+import dds_web.utils
+from dds_web import db
+from dds_web.api.project import UserProjects
 from dds_web.database import models
 import tests
 
@@ -18,6 +26,52 @@ proj_data = {"pi": "piName", "title": "Test proj", "description": "A longer proj
 proj_query = {"project": "public_project_id"}
 proj_query_restricted = {"project": "restricted_project_id"}
 
+# TOOLS #################################################################################### TOOLS #
+
+
+@contextlib.contextmanager
+def count_queries():
+    """Count the statements sent to the database in the block."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sqlalchemy.event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        sqlalchemy.event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def add_unit_projects(unit, number):
+    """Add projects with a status, a file version and a key for the unit admin to a unit."""
+    unitadmin = models.User.query.get("unitadmin")
+    for i in range(number):
+        project = models.Project(
+            public_id=f"listing_project_{i}",
+            title=f"listing project {i}",
+            description="Project for testing the listing.",
+            pi="PI",
+            bucket=f"listingproject{i}",
+            unit_id=unit.id,
+        )
+        project.project_statuses.append(
+            models.ProjectStatuses(status="In Progress", date_created=dds_web.utils.current_time())
+        )
+        project.file_versions.append(
+            models.Version(
+                size_stored=100,
+                time_uploaded=dds_web.utils.current_time() - datetime.timedelta(hours=i),
+            )
+        )
+        project.project_user_keys.append(
+            models.ProjectUserKeys(user=unitadmin, key=f"key{i}".encode())
+        )
+        db.session.add(project)
+    db.session.commit()
+
+
 # TESTS #################################################################################### TESTS #
 
 
@@ -197,3 +251,172 @@ def test_list_researchusers_not_in_proj_by_researchuser(client):
     token = tests.UserAuth(tests.USER_CREDENTIALS["researchuser2"]).token(client)
     response = client.get(tests.DDSEndpoint.LIST_PROJ_USERS, query_string=proj_query, headers=token)
     assert response.status_code == http.HTTPStatus.FORBIDDEN
+
+
+def test_list_proj_same_as_per_project(client):
+    """The listing has the same values as the properties of each project."""
+
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    response = client.get(tests.DDSEndpoint.LIST_PROJ, headers=token, json={"usage": True})
+    assert response.status_code == http.HTTPStatus.OK
+
+    unitadmin = models.User.query.get("unitadmin")
+    listed = {x["Project ID"]: x for x in response.json["project_info"]}
+    assert sorted(listed) == sorted(x.public_id for x in unitadmin.projects)
+    for project in unitadmin.projects:
+        info = listed[project.public_id]
+        assert info["Status"] == project.current_status
+        assert info["Size"] == sum(x.size_stored for x in project.files)
+        assert info["Access"] == (
+            models.ProjectUserKeys.query.filter_by(
+                project_id=project.id, user_id="unitadmin"
+            ).count()
+            > 0
+        )
+        usage, cost = UserProjects.project_usage(project=project)
+        assert info["Usage"] == pytest.approx(usage, rel=1e-3)
+        assert info["Cost"] == pytest.approx(cost, rel=1e-3)
+
+    response = client.get(
+        tests.DDSEndpoint.LIST_PROJ,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert sorted(x["Project ID"] for x in response.json["project_info"]) == sorted(
+        x.public_id for x in models.User.query.get("researchuser").projects
+    )
+
+
+def test_list_proj_number_of_queries(client):
+    """The number of queries does not depend on the number of projects."""
+
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    unit = models.User.query.get("unitadmin").unit
+
+    def list_projects():
+        # Start from the same session state, nothing loaded
+        db.session.expire_all()
+        with count_queries() as statements:
+            response = client.get(tests.DDSEndpoint.LIST_PROJ, headers=token, json={"usage": True})
+        assert response.status_code == http.HTTPStatus.OK
+        return response.json["project_info"], len(statements)
+
+    projects_before, queries_before = list_projects()
+    add_unit_projects(unit=unit, number=20)
+    projects_after, queries_after = list_projects()
+
+    assert len(projects_after) == len(projects_before) + 20
+    assert queries_after == queries_before
+    listed = {x["Project ID"]: x for x in projects_after}
+    assert listed["listing_project_3"]["Status"] == "In Progress"
+    assert listed["listing_project_3"]["Access"]
+    assert listed["listing_project_3"]["Usage"] == pytest.approx(100 * 3)
+
+
+def test_list_proj_filters(client):
+    """Only the projects matching all filters are listed."""
+
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    unit = models.User.query.get("unitadmin").unit
+    add_unit_projects(unit=unit, number=5)
+    project = models.Project.query.filter_by(public_id="listing_project_1").one()
+    project.project_statuses.append(
+        models.ProjectStatuses(
+            status="Available",
+            date_created=dds_web.utils.current_time() + datetime.timedelta(seconds=1),
+            deadline=dds_web.utils.current_time() + datetime.timedelta(days=30),
+        )
+    )
+    project.pi = "other_pi@mailtrap.io"
+    models.Project.query.filter_by(public_id="listing_project_2").one().is_active = False
+    db.session.commit()
+
+    def listed(**filters):
+        response = client.get(tests.DDSEndpoint.LIST_PROJ, headers=token, json=filters)
+        assert response.status_code == http.HTTPStatus.OK
+        return sorted(x["Project ID"] for x in response.json["project_info"])
+
+    all_projects = listed()
+    assert listed(status="Available") == ["listing_project_1"]
+    assert listed(status=["Available", "In Progress"]) == all_projects
+    assert listed(pi="other_pi@mailtrap.io") == ["listing_project_1"]
+    assert "listing_project_2" not in listed(active_only=True)
+    assert len(listed(active_only=True)) == len(all_projects) - 1
+    assert listed(created_after="2000-01-01T00:00:00") == all_projects
+    assert listed(created_before="2000-01-01T00:00:00") == []
+    assert listed(updated_after="2000-01-01T00:00:00+02:00", status="Available") == [
+        "listing_project_1"
+    ]
+
+
+def test_list_proj_pages(client):
+    """Following the cursors gives every project once, in the requested order."""
+
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    unit = models.User.query.get("unitadmin").unit
+    add_unit_projects(unit=unit, number=12)
+    models.Project.query.filter_by(public_id="listing_project_4").one().title = "same title"
+    models.Project.query.filter_by(public_id="listing_project_5").one().title = "same title"
+    db.session.commit()
+
+    for sort, descending in [("title", True), ("created", False), ("status", False)]:
+        response = client.get(
+            tests.DDSEndpoint.LIST_PROJ,
+            headers=token,
+            json={"sort": sort, "descending": descending},
+        )
+        assert response.status_code == http.HTTPStatus.OK
+        assert response.json["next_cursor"] is None
+        everything = [x["Project ID"] for x in response.json["project_info"]]
+
+        pages = []
+        cursor = None
+        while True:
+            response = client.get(
+                tests.DDSEndpoint.LIST_PROJ,
+                headers=token,
+                json={
+                    "sort": sort,
+                    "descending": descending,
+                    "limit": 5,
+                    **({"cursor": cursor} if cursor else {}),
+                },
+            )
+            assert response.status_code == http.HTTPStatus.OK
+            assert len(response.json["project_info"]) <= 5
+            pages.append([x["Project ID"] for x in response.json["project_info"]])
+            cursor = response.json["next_cursor"]
+            if cursor is None:
+                break
+
+        assert [x for page in pages for x in page] == everything
+        assert len(pages) == -(-len(everything) // 5)
+
+    titles = [
+        x["Title"]
+        for x in client.get(
+            tests.DDSEndpoint.LIST_PROJ, headers=token, json={"sort": "title", "descending": True}
+        ).json["project_info"]
+    ]
+    assert titles == sorted(titles, reverse=True)
+
+
+def test_list_proj_invalid_options(client):
+    """Unknown filter values and broken cursors are bad requests."""
+
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    response = client.get(tests.DDSEndpoint.LIST_PROJ, headers=token, json={"limit": 1})
+    assert response.status_code == http.HTTPStatus.OK
+    cursor = response.json["next_cursor"]
+    assert cursor
+
+    for options in [
+        {"status": "Unknown"},
+        {"sort": "size"},
+        {"limit": 0},
+        {"created_after": "yesterday"},
+        {"cursor": "not a cursor"},
+        {"cursor": cursor, "sort": "title"},
+    ]:
+        response = client.get(tests.DDSEndpoint.LIST_PROJ, headers=token, json=options)
+        assert response.status_code == http.HTTPStatus.BAD_REQUEST, options
@@ -10,6 +10,7 @@ import unittest.mock
 
 # Installed
 import boto3
+import botocore
 import flask_mail
 
 # Own
@@ -17,6 +18,7 @@ import dds_web
 import tests
 from tests.test_files_new import project_row, file_in_db, FIRST_NEW_FILE
 from tests.test_project_creation import proj_data_with_existing_users, create_unit_admins
+from dds_web.api import project_jobs
 from dds_web.database import models
 
 # CONFIG ################################################################################## CONFIG #
@@ -40,10 +42,23 @@ fields_set_to_null = [
 ]
 
 
+# TOOLS #################################################################################### TOOLS #
+
+
+def process_project_jobs(response):
+    """Run the job queued by the status change in the response."""
+    assert response.status_code == http.HTTPStatus.OK
+    assert response.json["job_id"]
+
+    jobs = project_jobs.process_jobs()
+    assert [x.id for x in jobs] == [response.json["job_id"]]
+    assert jobs[0].status == "Done"
+
+
 @pytest.fixture(scope="module")
 def test_project(module_client):
     """Create a shared test project"""
-    with unittest.mock.patch.object(boto3.session.Session, "resource") as mock_session:
+    with unittest.mock.patch.object(boto3.session.Session, "client") as mock_session:
         response = module_client.post(
             tests.DDSEndpoint.PROJECT_CREATE,
             headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(module_client),
@@ -145,7 +160,7 @@ def test_set_project_to_deleted_from_in_progress(module_client, boto3_session):
         json=new_status,
     )
 
-    assert response.status_code == http.HTTPStatus.OK
+    process_project_jobs(response=response)
     assert project.current_status == "Deleted"
     for field, value in vars(project).items():
         if field in fields_set_to_null:
@@ -186,7 +201,7 @@ def test_archived_project(module_client, boto3_session):
         json=new_status,
     )
 
-    assert response.status_code == http.HTTPStatus.OK
+    process_project_jobs(response=response)
     assert project.current_status == "Archived"
 
     assert not max(project.project_statuses, key=lambda x: x.date_created).is_aborted
@@ -239,7 +254,7 @@ def test_aborted_project(module_client, boto3_session):
         json=new_status,
     )
 
-    assert response.status_code == http.HTTPStatus.OK
+    process_project_jobs(response=response)
     assert project.current_status == "Archived"
     assert max(project.project_statuses, key=lambda x: x.date_created).is_aborted
     assert not file_in_db(test_dict=FIRST_NEW_FILE, project=project.id)
@@ -326,7 +341,7 @@ def test_abort_from_in_progress_once_made_available(module_client, boto3_session
         json=new_status,
     )
 
-    assert response.status_code == http.HTTPStatus.OK
+    process_project_jobs(response=response)
     assert project.current_status == "Archived"
     assert max(project.project_statuses, key=lambda x: x.date_created).is_aborted
     assert not file_in_db(test_dict=FIRST_NEW_FILE, project=project.id)
@@ -378,7 +393,7 @@ def test_check_invalid_transitions_from_in_progress(module_client, boto3_session
         json=new_status,
     )
 
-    assert response.status_code == http.HTTPStatus.OK
+    process_project_jobs(response=response)
     assert project.current_status == "Archived"
 
 
@@ -667,7 +682,7 @@ def test_set_project_to_archived(module_client, test_project, boto3_session):
         json=new_status,
     )
 
-    assert response.status_code == http.HTTPStatus.OK
+    process_project_jobs(response=response)
     assert project.current_status == "Archived"
     assert not max(project.project_statuses, key=lambda x: x.date_created).is_aborted
     assert not file_in_db(test_dict=FIRST_NEW_FILE, project=project.id)
@@ -727,3 +742,248 @@ def test_invalid_transitions_from_archived(module_client, test_project):
     assert response.status_code == http.HTTPStatus.BAD_REQUEST
     assert project.current_status == "Archived"
     assert "Cannot change status for a project" in response.json["message"]
+
+
+def test_project_job_queued_and_reported(module_client, boto3_session):
+    """Archiving returns a job, the status changes when the job has removed the contents"""
+    response = module_client.post(
+        tests.DDSEndpoint.PROJECT_CREATE,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(module_client),
+        json=proj_data,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    project_id = response.json.get("project_id")
+    project = project_row(project_id=project_id)
+
+    s3_client = boto3_session.return_value
+    s3_client.list_objects_v2.return_value = {
+        "Contents": [{"Key": "object_1"}, {"Key": "object_2"}],
+        "IsTruncated": False,
+    }
+    s3_client.delete_objects.return_value = {}
+
+    response = module_client.post(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(module_client),
+        query_string={"project": project_id},
+        json={"new_status": "Archived"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    job_id = response.json["job_id"]
+
+    # Nothing removed yet
+    assert project.current_status == "In Progress"
+    assert not project.is_active
+    assert s3_client.delete_objects.call_count == 0
+
+    response = module_client.get(
+        tests.DDSEndpoint.PROJECT_JOB,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(module_client),
+        query_string={"project": project_id, "job_id": job_id},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert response.json["status"] == "Queued"
+    assert response.json["new_status"] == "Archived"
+
+    # No other status changes while the job is pending
+    response = module_client.post(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(module_client),
+        query_string={"project": project_id},
+        json={"new_status": "Available"},
+    )
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+    assert "being removed" in response.json["message"]
+
+    # No uploads to the bucket which is being removed
+    response = module_client.post(
+        tests.DDSEndpoint.FILE_NEW,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(module_client),
+        query_string={"project": project_id},
+        json=FIRST_NEW_FILE,
+    )
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+    assert "being removed" in response.json["message"]
+
+    jobs = project_jobs.process_jobs()
+    assert [x.id for x in jobs] == [job_id]
+    assert project.current_status == "Archived"
+    assert s3_client.delete_objects.call_count == 1
+
+    # Latest job if no job id is given
+    response = module_client.get(
+        tests.DDSEndpoint.PROJECT_JOB,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(module_client),
+        query_string={"project": project_id},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert response.json["job_id"] == job_id
+    assert response.json["status"] == "Done"
+    assert response.json["objects_deleted"] == 2
+    assert models.ProjectJob.query.get(job_id).checkpoint == "object_2"
+
+
+def test_project_job_failed(module_client, boto3_session):
+    """A failed job keeps the project status and the project can be archived again"""
+    response = module_client.post(
+        tests.DDSEndpoint.PROJECT_CREATE,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(module_client),
+        json=proj_data,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    project_id = response.json.get("project_id")
+    project = project_row(project_id=project_id)
+
+    s3_client = boto3_session.return_value
+    s3_client.list_objects_v2.return_value = {"Contents": [{"Key": "object_1"}]}
+    s3_client.delete_objects.return_value = {
+        "Errors": [{"Key": "object_1", "Code": "AccessDenied", "Message": "Access Denied"}]
+    }
+
+    response = module_client.post(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(module_client),
+        query_string={"project": project_id},
+        json={"new_status": "Archived"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+
+    jobs = project_jobs.process_jobs()
+    assert len(jobs) == 1 and jobs[0].status == "Failed"
+    assert jobs[0].error
+    assert project.current_status == "In Progress"
+    assert project.is_active
+    assert s3_client.delete_bucket.call_count == 0
+
+    # Archive again once the objects can be deleted
+    s3_client.delete_objects.return_value = {}
+    response = module_client.post(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(module_client),
+        query_string={"project": project_id},
+        json={"new_status": "Archived"},
+    )
+    process_project_jobs(response=response)
+    assert project.current_status == "Archived"
+
+
+def test_project_job_claimed_by_heartbeat(module_client, boto3_session):
+    """A running job is only claimed by another worker when its heartbeat has stopped"""
+    response = module_client.post(
+        tests.DDSEndpoint.PROJECT_CREATE,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(module_client),
+        json=proj_data,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    project = project_row(project_id=response.json.get("project_id"))
+
+    now = dds_web.utils.current_time()
+    job = project_jobs.enqueue(project=project, new_status="Archived")
+    job.status = "Running"
+    job.last_update = now - 2 * project_jobs.STALE_AFTER
+    job.heartbeat = now
+    dds_web.db.session.commit()
+
+    # No progress for long, but still running
+    assert project_jobs.claim_next_job() is None
+
+    job.heartbeat = now - 2 * project_jobs.STALE_AFTER
+    dds_web.db.session.commit()
+    claimed = project_jobs.claim_next_job()
+    assert claimed.id == job.id
+    assert claimed.heartbeat > job.last_update
+
+    assert project_jobs.run_job(job=claimed).status == "Done"
+    assert project.current_status == "Archived"
+
+
+def test_project_job_bucket_already_removed(module_client, boto3_session):
+    """A job run again after the bucket was removed continues with the database"""
+    response = module_client.post(
+        tests.DDSEndpoint.PROJECT_CREATE,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(module_client),
+        json=proj_data,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    project = project_row(project_id=response.json.get("project_id"))
+
+    s3_client = boto3_session.return_value
+    s3_client.head_bucket.side_effect = botocore.exceptions.ClientError(
+        {"Error": {"Code": "404"}}, "HeadBucket"
+    )
+    s3_client.list_objects_v2.side_effect = botocore.exceptions.ClientError(
+        {"Error": {"Code": "NoSuchBucket"}}, "ListObjectsV2"
+    )
+
+    # Not started - the missing bucket is an error
+    job = project_jobs.enqueue(project=project, new_status="Archived")
+    dds_web.db.session.commit()
+    assert project_jobs.run_job(job=job).status == "Failed"
+    assert project.current_status == "In Progress"
+
+    # Interrupted after the last checkpoint
+    job = project_jobs.enqueue(project=project, new_status="Archived")
+    job.checkpoint = "object_2"
+    job.objects_deleted = 2
+    dds_web.db.session.commit()
+    assert project_jobs.run_job(job=job).status == "Done"
+    assert project.current_status == "Archived"
+    assert s3_client.delete_bucket.call_count == 0
+
+
+def test_status_summary_follows_status_changes(module_client, boto3_session):
+    """The current status, deadline, availability and expiry count are kept on the project."""
+
+    response = module_client.post(
+        tests.DDSEndpoint.PROJECT_CREATE,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(module_client),
+        json=proj_data,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    project_id = response.json.get("project_id")
+    project = project_row(project_id=project_id)
+    assert (project.current_status, project.current_deadline) == ("In Progress", None)
+    assert not project.ever_available and project.expired_count == 0
+
+    def change_status(new_status):
+        time.sleep(1)
+        response = module_client.post(
+            tests.DDSEndpoint.PROJECT_STATUS,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(module_client),
+            query_string={"project": project_id},
+            json=new_status,
+        )
+        assert response.status_code == http.HTTPStatus.OK
+        dds_web.db.session.refresh(project)
+        assert {
+            x: getattr(project, x)
+            for x in ["current_status", "current_deadline", "ever_available", "expired_count"]
+        } == models.project_status_summary(statuses=project.project_statuses)
+
+    change_status({"new_status": "Available", "deadline": 10, "send_email": False})
+    released_deadline = project.current_deadline
+    assert project.current_status == "Available" and project.ever_available
+    assert released_deadline > dds_web.utils.current_time()
+
+    change_status({"new_status": "In Progress"})
+    assert project.current_status == "In Progress"
+    assert project.current_deadline == released_deadline
+
+    change_status({"new_status": "Available", "deadline": 10, "send_email": False})
+    change_status({"new_status": "Expired", "deadline": 5})
+    assert project.current_status == "Expired" and project.expired_count == 1
+
+    # Removing the latest status goes back to the one before
+    expired = max(project.project_statuses, key=lambda x: x.date_created)
+    project.project_statuses.remove(expired)
+    assert project.current_status == "Available" and project.expired_count == 0
+    project.project_statuses.append(expired)
+    assert project.current_status == "Expired" and project.expired_count == 1
+    dds_web.db.session.commit()
+
+    # Due projects are found with the indexed columns alone
+    due = models.Project.query.filter(
+        models.Project.current_status == "Expired",
+        models.Project.current_deadline <= project.current_deadline,
+    ).all()
+    assert project in due
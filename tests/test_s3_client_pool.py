@@ -0,0 +1,189 @@
+# IMPORTS ################################################################################ IMPORTS #
+
+# Standard library
+import concurrent.futures
+import http
+import time
+import unittest.mock
+
+# Installed
+import botocore
+
+# Own
+from dds_web.api import s3_client_pool
+import tests
+
+# TESTS #################################################################################### TESTS #
+
+
+def test_pool_reuses_clients():
+    """One client per endpoint and access key, recreated when the secret key changes."""
+    pool = s3_client_pool.S3ClientPool()
+
+    first = pool.get_client(endpoint="http://s3.example.com", access_key="a", secret_key="s")
+    assert isinstance(first, botocore.client.BaseClient)
+    assert first.meta.config.max_pool_connections == s3_client_pool.MAX_POOL_CONNECTIONS
+    assert (
+        pool.get_client(endpoint="http://s3.example.com", access_key="a", secret_key="s") is first
+    )
+    assert pool.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+    # Other credentials and endpoints
+    other_key = pool.get_client(endpoint="http://s3.example.com", access_key="b", secret_key="s")
+    other_endpoint = pool.get_client(
+        endpoint="http://s3.example.org", access_key="a", secret_key="s"
+    )
+    assert other_key is not first and other_endpoint is not first
+    assert pool.stats() == {"size": 3, "hits": 1, "misses": 3}
+
+    # Changed secret key
+    changed = pool.get_client(endpoint="http://s3.example.com", access_key="a", secret_key="new")
+    assert changed is not first
+    assert pool.stats() == {"size": 3, "hits": 1, "misses": 4}
+
+    # Invalidated
+    pool.invalidate(endpoint="http://s3.example.com", access_key="a")
+    assert (
+        pool.get_client(endpoint="http://s3.example.com", access_key="a", secret_key="new")
+        is not changed
+    )
+    assert pool.stats() == {"size": 3, "hits": 1, "misses": 5}
+
+    pool.clear()
+    assert pool.stats() == {"size": 0, "hits": 0, "misses": 0}
+
+
+def test_pool_threads_share_client():
+    """Concurrent requests for the same credentials get the same client."""
+    pool = s3_client_pool.S3ClientPool()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(
+            executor.map(
+                lambda _: pool.get_client(
+                    endpoint="http://s3.example.com", access_key="a", secret_key="s"
+                ),
+                range(50),
+            )
+        )
+
+    assert len(set(id(x) for x in clients)) == 1
+    assert pool.stats() == {"size": 1, "hits": 49, "misses": 1}
+
+
+def test_connection_reused_between_requests(client, boto3_session):
+    """The S3 client is only created once for requests to the same unit."""
+    response = client.post(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(client),
+        query_string={"project": "public_project_id"},
+        json={"new_status": "Available"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+
+    with unittest.mock.patch(
+        "dds_web.api.api_s3_connector.ApiS3Connector.generate_get_urls"
+    ) as mock_url:
+        mock_url.side_effect = lambda keys: {x: "url" for x in keys}
+        for _ in range(3):
+            response = client.get(
+                tests.DDSEndpoint.FILE_INFO_ALL,
+                headers=tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client),
+                query_string={"project": "public_project_id"},
+            )
+            assert response.status_code == http.HTTPStatus.OK
+
+    assert boto3_session.call_count == 1
+    assert s3_client_pool.pool.stats()["hits"] == 2
+
+
+def test_bucket_cache():
+    """Buckets are remembered for the ttl, per endpoint, until invalidated."""
+    cache = s3_client_pool.BucketCache(ttl=60)
+    assert not cache.exists(endpoint="e", bucket="b")
+
+    cache.add(endpoint="e", bucket="b")
+    assert cache.exists(endpoint="e", bucket="b")
+    assert not cache.exists(endpoint="other", bucket="b")
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 2}
+
+    cache.invalidate(endpoint="e", bucket="b")
+    assert not cache.exists(endpoint="e", bucket="b")
+
+    # Expired
+    cache.add(endpoint="e", bucket="b")
+    with unittest.mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+        assert not cache.exists(endpoint="e", bucket="b")
+    assert cache.stats()["size"] == 0
+
+
+def test_bucket_removed_from_cache_on_no_such_bucket(client, boto3_session):
+    """A bucket which S3 reports as missing is checked again in the next request."""
+    s3_client = boto3_session.return_value
+    s3_client.delete_objects.side_effect = botocore.exceptions.ClientError(
+        {"Error": {"Code": "NoSuchBucket", "Message": "The bucket does not exist"}},
+        "DeleteObjects",
+    )
+
+    for _ in range(2):
+        response = client.delete(
+            tests.DDSEndpoint.REMOVE_FILE,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+            query_string={"project": "public_project_id"},
+            json=["filename1"],
+        )
+        assert response.status_code == http.HTTPStatus.OK
+        assert "NoSuchBucket" in response.json["not_removed"]["filename1"]
+
+    assert s3_client.head_bucket.call_count == 2
+    assert s3_client_pool.buckets.stats()["size"] == 0
+
+
+def test_unit_info_cache():
+    """Unit settings are loaded once per ttl, and again after invalidation."""
+    cache = s3_client_pool.UnitInfoCache(ttl=60)
+    load = unittest.mock.Mock(return_value=("endpoint", "name", "access", "secret"))
+
+    for _ in range(3):
+        assert cache.get(unit_id=1, load=load) == ("endpoint", "name", "access", "secret")
+    assert load.call_count == 1
+    assert cache.stats() == {"size": 1, "hits": 2, "misses": 1}
+
+    cache.invalidate(unit_id=1)
+    cache.get(unit_id=1, load=load)
+    cache.get(unit_id=2, load=load)
+    assert load.call_count == 3
+
+    cache.invalidate()
+    cache.get(unit_id=2, load=load)
+    assert load.call_count == 4
+
+    # Expired
+    with unittest.mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+        cache.get(unit_id=2, load=load)
+    assert load.call_count == 5
+
+
+def test_unit_info_cache_invalidated_while_loading():
+    """Settings read before an invalidation are not cached."""
+    cache = s3_client_pool.UnitInfoCache(ttl=60)
+
+    def load_and_invalidate():
+        cache.invalidate(unit_id=1)
+        return ("old endpoint", "name", "access", "secret")
+
+    assert cache.get(unit_id=1, load=load_and_invalidate)[0] == "old endpoint"
+    assert cache.stats()["size"] == 0
+    assert cache.get(unit_id=1, load=lambda: ("new endpoint", "n", "a", "s"))[0] == "new endpoint"
+
+
+def test_unit_info_cached_between_requests(client, boto3_session):
+    """The unit settings are only read from the database once for requests to the same unit."""
+    for _ in range(3):
+        response = client.get(
+            tests.DDSEndpoint.S3KEYS,
+            headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+            query_string={"project": "file_testing_project"},
+        )
+        assert response.status_code == http.HTTPStatus.OK
+
+    assert s3_client_pool.units.stats() == {"size": 1, "hits": 2, "misses": 1}
@@ -0,0 +1,263 @@
+# IMPORTS ################################################################################ IMPORTS #
+
+# Standard library
+import datetime
+import http
+import unittest.mock
+import urllib.parse
+
+# Installed
+import botocore
+import sqlalchemy
+
+# Own
+import dds_web.utils
+from dds_web import db
+from dds_web.api import s3
+from dds_web.database import models
+import tests
+
+# CONFIG ################################################################################## CONFIG #
+
+LARGE_FILE = {
+    "name": "large_file.tar",
+    "name_in_bucket": "large_file_in_bucket",
+    "subpath": "large",
+    "size": 50 * 1024**3,
+    "size_processed": 40 * 1024**3,
+    "compressed": True,
+    "public_key": "p" * 64,
+    "salt": "s" * 32,
+    "checksum": "c" * 64,
+}
+
+# TOOLS #################################################################################### TOOLS #
+
+
+def mock_s3_client(boto3_session):
+    """Set up the mocked s3 client to start uploads."""
+    s3_client = boto3_session.return_value
+    s3_client.meta.region_name = None
+    s3_client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    return s3_client
+
+
+def request(client, method, endpoint, json):
+    """Make a request as unit admin to a multipart upload endpoint."""
+    return getattr(client, method)(
+        endpoint,
+        headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
+        query_string={"project": "file_testing_project"},
+        json=json,
+    )
+
+
+# TESTS #################################################################################### TESTS #
+
+
+def test_multipart_upload(client, boto3_session):
+    """Start an upload, get part urls and complete it - the file is only added on completion."""
+    s3_client = mock_s3_client(boto3_session=boto3_session)
+
+    response = request(client, "post", tests.DDSEndpoint.MULTIPART_UPLOAD, json=LARGE_FILE)
+    assert response.status_code == http.HTTPStatus.OK
+    assert response.json["upload_id"] == "upload-1"
+    s3_client.create_multipart_upload.assert_called_once_with(
+        Bucket="bucket", Key="large_file_in_bucket"
+    )
+    assert not models.File.query.filter_by(name="large_file.tar").one_or_none()
+
+    response = request(
+        client,
+        "post",
+        tests.DDSEndpoint.MULTIPART_UPLOAD_URLS,
+        json={"upload_id": "upload-1", "part_numbers": [1, 2, 3]},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert list(response.json["urls"]) == ["1", "2", "3"]
+    url = urllib.parse.urlsplit(response.json["urls"]["2"])
+    assert url.path.endswith("/bucket/large_file_in_bucket")
+    assert urllib.parse.parse_qs(url.query)["partNumber"] == ["2"]
+    assert urllib.parse.parse_qs(url.query)["uploadId"] == ["upload-1"]
+
+    parts = [{"part_number": x, "etag": f"etag{x}"} for x in [1, 2, 3]]
+    response = request(
+        client,
+        "post",
+        tests.DDSEndpoint.MULTIPART_UPLOAD_COMPLETE,
+        json={"upload_id": "upload-1", "parts": parts},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    s3_client.complete_multipart_upload.assert_called_once()
+    assert s3_client.complete_multipart_upload.call_args.kwargs["MultipartUpload"]["Parts"][1] == {
+        "PartNumber": 2,
+        "ETag": "etag2",
+    }
+
+    new_file = models.File.query.filter_by(name="large_file.tar").one()
+    assert new_file.size_original == LARGE_FILE["size"]
+    assert len(new_file.versions) == 1
+    assert not models.MultipartUpload.query.count()
+
+
+def test_multipart_upload_abort(client, boto3_session):
+    """Aborting an upload removes the parts in S3 and the upload."""
+    s3_client = mock_s3_client(boto3_session=boto3_session)
+    request(client, "post", tests.DDSEndpoint.MULTIPART_UPLOAD, json=LARGE_FILE)
+
+    response = request(
+        client, "delete", tests.DDSEndpoint.MULTIPART_UPLOAD, json={"upload_id": "upload-1"}
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    s3_client.abort_multipart_upload.assert_called_once_with(
+        Bucket="bucket", Key="large_file_in_bucket", UploadId="upload-1"
+    )
+    assert not models.MultipartUpload.query.count()
+
+    # The upload is gone
+    response = request(
+        client,
+        "post",
+        tests.DDSEndpoint.MULTIPART_UPLOAD_COMPLETE,
+        json={"upload_id": "upload-1", "parts": [{"part_number": 1, "etag": "etag1"}]},
+    )
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+    assert "no such multipart upload" in response.json["message"]
+    assert not models.File.query.filter_by(name="large_file.tar").one_or_none()
+
+
+def test_new_file_with_open_upload(client, boto3_session):
+    """A file with an unfinished multipart upload can not be added another way."""
+    mock_s3_client(boto3_session=boto3_session)
+    request(client, "post", tests.DDSEndpoint.MULTIPART_UPLOAD, json=LARGE_FILE)
+
+    response = request(client, "post", tests.DDSEndpoint.FILE_NEW, json=LARGE_FILE)
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+    assert "already in progress" in response.json
+
+    response = request(client, "post", tests.DDSEndpoint.FILE_NEW_BATCH, json=[LARGE_FILE])
+    assert response.status_code == http.HTTPStatus.OK
+    assert response.json["added"] == []
+    assert "already in progress" in response.json["not_added"][LARGE_FILE["name"]]
+    assert not models.File.query.filter_by(name=LARGE_FILE["name"]).count()
+
+
+def test_multipart_upload_not_saved(client, boto3_session):
+    """An upload which can not be saved in the database is aborted in S3."""
+    s3_client = mock_s3_client(boto3_session=boto3_session)
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    error = sqlalchemy.exc.OperationalError("statement", {}, "error")
+    with unittest.mock.patch.object(db.session, "commit", side_effect=error):
+        response = client.post(
+            tests.DDSEndpoint.MULTIPART_UPLOAD,
+            headers=token,
+            query_string={"project": "file_testing_project"},
+            json=LARGE_FILE,
+        )
+
+    assert response.status_code == http.HTTPStatus.INTERNAL_SERVER_ERROR
+    s3_client.abort_multipart_upload.assert_called_once_with(
+        Bucket="bucket", Key="large_file_in_bucket", UploadId="upload-1"
+    )
+    assert not models.MultipartUpload.query.count()
+
+
+def test_multipart_upload_invalid_requests(client, boto3_session):
+    """Existing files, open uploads, invalid part numbers and missing parts are refused."""
+    s3_client = mock_s3_client(boto3_session=boto3_session)
+    project = models.Project.query.filter_by(public_id="file_testing_project").one()
+    project.files.append(
+        models.File(
+            name="existing.txt",
+            name_in_bucket="existing_in_bucket",
+            subpath=".",
+            size_original=10,
+            size_stored=5,
+            compressed=False,
+            public_key="p" * 64,
+            salt="s" * 32,
+            checksum="c" * 64,
+        )
+    )
+    db.session.commit()
+
+    response = request(
+        client,
+        "post",
+        tests.DDSEndpoint.MULTIPART_UPLOAD,
+        json={**LARGE_FILE, "name": "existing.txt"},
+    )
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+    assert "already exists" in response.json["message"]
+    s3_client.create_multipart_upload.assert_not_called()
+
+    request(client, "post", tests.DDSEndpoint.MULTIPART_UPLOAD, json=LARGE_FILE)
+
+    # Only one upload at a time per file
+    response = request(client, "post", tests.DDSEndpoint.MULTIPART_UPLOAD, json=LARGE_FILE)
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+    assert "already in progress" in response.json["message"]
+    s3_client.create_multipart_upload.assert_called_once()
+
+    for part_numbers in [[], [0], [10001], ["1"], list(range(1, 1002))]:
+        response = request(
+            client,
+            "post",
+            tests.DDSEndpoint.MULTIPART_UPLOAD_URLS,
+            json={"upload_id": "upload-1", "part_numbers": part_numbers},
+        )
+        assert response.status_code == http.HTTPStatus.BAD_REQUEST
+
+    response = request(
+        client,
+        "post",
+        tests.DDSEndpoint.MULTIPART_UPLOAD_COMPLETE,
+        json={"upload_id": "upload-1", "parts": [{"part_number": 1}]},
+    )
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+    s3_client.complete_multipart_upload.assert_not_called()
+    assert models.MultipartUpload.query.count() == 1
+
+
+def test_abort_stale_multipart_uploads(client, boto3_session):
+    """Uploads which have not been completed in time are aborted."""
+    s3_client = mock_s3_client(boto3_session=boto3_session)
+    request(client, "post", tests.DDSEndpoint.MULTIPART_UPLOAD, json=LARGE_FILE)
+    upload = models.MultipartUpload.query.one()
+
+    aborted, errors = s3.abort_stale_multipart_uploads(older_than=upload.created)
+    assert (aborted, errors) == (0, {})
+    s3_client.abort_multipart_upload.assert_not_called()
+
+    aborted, errors = s3.abort_stale_multipart_uploads(
+        older_than=upload.created + datetime.timedelta(hours=1)
+    )
+    assert (aborted, errors) == (1, {})
+    s3_client.abort_multipart_upload.assert_called_once_with(
+        Bucket="bucket", Key="large_file_in_bucket", UploadId="upload-1"
+    )
+    assert not models.MultipartUpload.query.count()
+
+
+def test_abort_stale_multipart_uploads_connection_error(client, boto3_session):
+    """A connection error is reported for the upload and does not stop the sweep."""
+    s3_client = mock_s3_client(boto3_session=boto3_session)
+    request(client, "post", tests.DDSEndpoint.MULTIPART_UPLOAD, json=LARGE_FILE)
+    s3_client.create_multipart_upload.return_value = {"UploadId": "upload-2"}
+    request(
+        client,
+        "post",
+        tests.DDSEndpoint.MULTIPART_UPLOAD,
+        json={**LARGE_FILE, "name": "other.tar", "name_in_bucket": "other_in_bucket"},
+    )
+    s3_client.abort_multipart_upload.side_effect = [
+        botocore.exceptions.EndpointConnectionError(endpoint_url="https://s3"),
+        {},
+    ]
+
+    aborted, errors = s3.abort_stale_multipart_uploads(
+        older_than=dds_web.utils.current_time() + datetime.timedelta(hours=1)
+    )
+    assert aborted == 1
+    assert len(errors) == 1
+    assert models.MultipartUpload.query.count() == 1
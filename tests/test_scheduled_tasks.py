@@ -11,6 +11,9 @@ from dds_web import db
 from dds_web.database import models
 from dds_web.utils import current_time
 
+from dds_web.api import project_jobs
+from dds_web.api.project import ProjectStatus
+from dds_web.errors import DDSArgumentError
 from dds_web.scheduled_tasks import set_available_to_expired, set_expired_to_archived, delete_invite
 
 
@@ -65,7 +68,19 @@ def test_set_expired_to_archived(_: MagicMock, client: flask.testing.FlaskClient
         i += len([project for project in unit.projects if project.current_status == "Expired"])
     assert i == 5
 
-    set_expired_to_archived()
+    metrics = set_expired_to_archived()
+    assert metrics["changed"] == 5
+
+    # The contents are removed by project jobs, the status changes when they are done
+    projects: List = models.Project.query.all()
+    assert all(project.current_status == "Expired" for project in projects)
+    assert not any(project.is_active for project in projects)
+    assert all(project_jobs.unfinished_job(project=project) for project in projects)
+    assert set_expired_to_archived()["due"] == 0
+
+    jobs = project_jobs.process_jobs()
+    assert len(jobs) == 5
+    assert all(job.status == "Done" for job in jobs)
 
     units: List = db.session.query(models.Unit).all()
 
@@ -79,6 +94,42 @@ def test_set_expired_to_archived(_: MagicMock, client: flask.testing.FlaskClient
     assert j == 5
 
 
+def test_only_due_projects_expired(client: flask.testing.FlaskClient) -> None:
+    """Only Available projects past their deadline are expired, a failure does not stop the rest."""
+    projects: List = models.Project.query.order_by(models.Project.id).all()
+    for index, project in enumerate(projects):
+        for status in project.project_statuses:
+            status.status = "Available"
+            # Every second project is not due yet
+            status.deadline = current_time() + timedelta(weeks=-1 if index % 2 == 0 else 1)
+    db.session.commit()
+    public_ids = [x.public_id for x in projects]
+    due = public_ids[::2]
+    assert len(due) == 3
+
+    expire_project = ProjectStatus.expire_project
+
+    def fail_for_one_project(self, project, **kwargs):
+        if project.public_id == due[1]:
+            raise DDSArgumentError(message="Cannot expire this project.")
+        return expire_project(self, project=project, **kwargs)
+
+    with mock.patch.object(ProjectStatus, "expire_project", fail_for_one_project):
+        metrics = set_available_to_expired()
+
+    assert metrics["due"] == 3
+    assert metrics["changed"] == 2
+    assert metrics["failed"] == 1
+    assert metrics["seconds"] >= 0
+    statuses = {x.public_id: x.current_status for x in models.Project.query.all()}
+    assert statuses == {
+        x: "Expired" if x in due and x != due[1] else "Available" for x in public_ids
+    }
+
+    # Only the project which failed is still due
+    assert set_available_to_expired()["due"] == 1
+
+
 def test_delete_invite(client: flask.testing.FlaskClient) -> None:
     assert len(db.session.query(models.Invite).all()) == 2
     delete_invite()
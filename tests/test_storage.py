@@ -0,0 +1,115 @@
+# IMPORTS ################################################################################ IMPORTS #
+
+# Standard library
+import time
+import urllib.parse
+
+# Installed
+import botocore
+import pytest
+
+# Own
+from dds_web.api import storage
+from dds_web.api.api_s3_connector import ApiS3Connector
+from dds_web.database import models
+
+# TESTS #################################################################################### TESTS #
+
+
+def test_incomplete_backend_cannot_be_created():
+    """A backend missing some of the operations fails when it is created."""
+
+    class ListOnly(storage.StorageBackend):
+        def list_objects(self, bucket, page_size=storage.PAGE_SIZE, **kwargs):
+            return {"keys": [], "next_token": None}
+
+    with pytest.raises(TypeError):
+        ListOnly()
+
+
+def test_local_backend():
+    """The local storage behaves like S3 for the operations used by the API."""
+    local = storage.LocalBackend()
+    local.create_bucket(bucket="bucket")
+    local.head_bucket(bucket="bucket")
+    with pytest.raises(botocore.exceptions.ClientError) as err:
+        local.create_bucket(bucket="bucket")
+
+    local.put_objects(bucket="bucket", sizes={"b": 2, "a": 1, "ä": 3, "z": 4})
+    assert local.head_object(bucket="bucket", key="ä") == {"size": 3}
+    with pytest.raises(botocore.exceptions.ClientError) as err:
+        local.head_object(bucket="bucket", key="missing")
+    assert err.value.response["Error"]["Code"] == "404"
+
+    # Listed in byte order, in pages
+    assert list(local.list_pages(bucket="bucket", page_size=3)) == [["a", "b", "z"], ["ä"]]
+    assert list(local.list_pages(bucket="bucket", start_after="b")) == [["z", "ä"]]
+
+    with pytest.raises(botocore.exceptions.ClientError) as err:
+        local.delete_bucket(bucket="bucket")
+    assert err.value.response["Error"]["Code"] == "BucketNotEmpty"
+
+    assert local.delete_objects(bucket="bucket", keys=["a", "b", "z", "ä"]) == {}
+    local.delete_bucket(bucket="bucket")
+    with pytest.raises(botocore.exceptions.ClientError) as err:
+        local.list_objects(bucket="bucket")
+    assert err.value.response["Error"]["Code"] == "NoSuchBucket"
+    assert local.requests["delete_objects"] == 1
+
+
+def test_local_backend_latency():
+    """Each request takes the configured time."""
+    local = storage.LocalBackend(latency={"head_bucket": 0.05})
+    local.put_objects(bucket="bucket", sizes={})
+
+    start = time.perf_counter()
+    local.head_bucket(bucket="bucket")
+    local.list_objects(bucket="bucket")
+    assert 0.05 <= time.perf_counter() - start < 0.5
+
+
+def test_s3_backend(boto3_session):
+    """The requests are passed on to the boto3 client."""
+    s3_client = boto3_session.return_value
+    s3_client.list_objects_v2.return_value = {
+        "Contents": [{"Key": "a"}, {"Key": "b"}],
+        "IsTruncated": True,
+        "NextContinuationToken": "token",
+    }
+    s3_client.delete_objects.return_value = {
+        "Errors": [{"Key": "b", "Code": "AccessDenied", "Message": "Denied"}]
+    }
+    backend = storage.S3Backend(
+        client=boto3_session.return_value,
+        endpoint="https://s3.example.com",
+        access_key="a",
+        secret_key="s",
+    )
+
+    assert backend.list_objects(bucket="bucket", page_size=2, start_after="0") == {
+        "keys": ["a", "b"],
+        "next_token": "token",
+    }
+    s3_client.list_objects_v2.assert_called_once_with(Bucket="bucket", MaxKeys=2, StartAfter="0")
+
+    assert backend.delete_objects(bucket="bucket", keys=["a", "b"]) == {"b": "AccessDenied: Denied"}
+    s3_client.delete_objects.assert_called_once_with(
+        Bucket="bucket", Delete={"Objects": [{"Key": "a"}, {"Key": "b"}], "Quiet": True}
+    )
+
+
+def test_local_storage_setting(client):
+    """The connector uses the in memory storage when configured."""
+    client.application.config["STORAGE_BACKEND"] = "local"
+    try:
+        project = models.Project.query.filter_by(public_id="file_testing_project").one()
+        with ApiS3Connector(project=project) as s3conn:
+            assert s3conn.storage is storage.local
+            s3conn.create_bucket()
+            assert s3conn.remove_multiple(items=["not_there"]) == {}
+            url = s3conn.generate_get_url(key="file")
+            assert urllib.parse.urlsplit(url).netloc == "localhost:9000"
+            s3conn.remove_bucket()
+        assert project.bucket not in storage.local.buckets
+    finally:
+        client.application.config["STORAGE_BACKEND"] = "s3"
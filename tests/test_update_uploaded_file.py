@@ -0,0 +1,102 @@
+# IMPORTS ################################################################################ IMPORTS #
+
+# Standard library
+import json
+import unittest.mock
+
+# Installed
+import botocore
+import sqlalchemy
+
+# Own
+from dds_web import update_uploaded_file_with_log
+from dds_web.api import db_tools
+from dds_web.database import models
+
+# TOOLS #################################################################################### TOOLS #
+
+
+def log_entry(name, failed_op="add_file_db"):
+    """Entry in the cli log for a file which was uploaded but not added to the database."""
+    return {
+        "status": {"failed_op": failed_op},
+        "path_remote": f"bucket_{name}",
+        "subpath": "recovered",
+        "size_raw": 100,
+        "size_processed": 50,
+        "compressed": False,
+        "public_key": "public_key",
+        "salt": "salt",
+        "checksum": "checksum",
+    }
+
+
+def head_object(Bucket, Key):
+    """Only the objects with "missing" in the name are not in S3."""
+    if "missing" in Key:
+        raise botocore.exceptions.ClientError({"Error": {"Code": "404"}}, "HeadObject")
+    return {}
+
+
+# TESTS #################################################################################### TESTS #
+
+
+def test_update_uploaded_file(client, boto3_session, tmp_path):
+    """Files in S3 are added in bulk, missing and existing files are reported."""
+    project = models.Project.query.filter_by(public_id="public_project_id").one()
+    existing = project.files[0].name
+    num_files = len(project.files)
+
+    log = {f"file_{i}.txt": log_entry(name=f"file_{i}") for i in range(25)}
+    log["missing.txt"] = log_entry(name="missing")
+    log[existing] = log_entry(name="existing")
+    log["uploaded.txt"] = log_entry(name="uploaded", failed_op=None)
+    log_file = tmp_path / "log.json"
+    log_file.write_text(json.dumps(log))
+
+    boto3_session.return_value.head_object.side_effect = head_object
+    result = client.application.test_cli_runner().invoke(
+        update_uploaded_file_with_log,
+        ["--project", project.public_id, "--path-to-log-file", str(log_file), "-w", "4"],
+    )
+    assert result.exit_code == 0
+    assert boto3_session.return_value.head_object.call_count == 26
+
+    project = models.Project.query.filter_by(public_id="public_project_id").one()
+    assert len(project.files) == num_files + 25
+    recovered = models.File.query.filter_by(project_id=project.id, subpath="recovered").all()
+    assert sorted(x.name for x in recovered) == sorted(f"file_{i}.txt" for i in range(25))
+    assert all(len(x.versions) == 1 and x.compressed for x in recovered)
+    assert not models.File.query.filter_by(name="missing.txt").count()
+    assert not models.File.query.filter_by(name="uploaded.txt").count()
+
+
+def test_update_uploaded_file_batch_fails(client, boto3_session, tmp_path):
+    """A failing batch is rolled back, the next batch is added and the command fails."""
+    project = models.Project.query.filter_by(public_id="public_project_id").one()
+    num_files = len(project.files)
+
+    log = {f"file_{i:04}.txt": log_entry(name=f"file_{i}") for i in range(1500)}
+    log_file = tmp_path / "log.json"
+    log_file.write_text(json.dumps(log))
+
+    insert_files_in_bulk = db_tools.insert_files_in_bulk
+    calls = []
+
+    def fail_first_batch(**kwargs):
+        calls.append(len(kwargs["files_info"]))
+        if len(calls) == 1:
+            raise sqlalchemy.exc.OperationalError("statement", {}, "error")
+        return insert_files_in_bulk(**kwargs)
+
+    boto3_session.return_value.head_object.side_effect = head_object
+    with unittest.mock.patch("dds_web.api.db_tools.insert_files_in_bulk", fail_first_batch):
+        result = client.application.test_cli_runner().invoke(
+            update_uploaded_file_with_log,
+            ["--project", project.public_id, "--path-to-log-file", str(log_file)],
+        )
+    assert result.exit_code == 1
+    assert calls == [1000, 500]
+
+    project = models.Project.query.filter_by(public_id="public_project_id").one()
+    assert len(project.files) == num_files + 500
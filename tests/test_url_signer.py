@@ -0,0 +1,149 @@
+# IMPORTS ################################################################################ IMPORTS #
+
+# Standard library
+import datetime
+import unittest.mock
+import urllib.parse
+
+# Installed
+import boto3
+import botocore.config
+import pytest
+
+# Own
+from dds_web.api import url_signer
+
+# CONFIG ################################################################################## CONFIG #
+
+KEYS = [
+    "simple",
+    "folder/subfolder/file.txt",
+    "with space+plus~tilde",
+    "special!*'()&=;$,@[]#?%",
+    "unicode/åäö_ü_✓.txt",
+    "/leading/and/trailing/",
+]
+
+# TOOLS #################################################################################### TOOLS #
+
+
+def botocore_presigned_urls(endpoint, operation, params, now, region="us-east-1"):
+    """Generate presigned urls with botocore at a fixed time, one per dict of parameters."""
+    client = boto3.session.Session().client(
+        "s3",
+        endpoint_url=endpoint,
+        region_name=region,
+        aws_access_key_id="access",
+        aws_secret_access_key="secret",
+        config=botocore.config.Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+    )
+    with unittest.mock.patch("botocore.auth.datetime") as mock_datetime:
+        mock_datetime.datetime.utcnow.return_value = now
+        return [
+            client.generate_presigned_url(operation, Params=x, ExpiresIn=604800) for x in params
+        ]
+
+
+def botocore_urls(endpoint, bucket, keys, now, region="us-east-1"):
+    """Generate presigned get urls with botocore at a fixed time."""
+    urls = botocore_presigned_urls(
+        endpoint=endpoint,
+        operation="get_object",
+        params=[{"Bucket": bucket, "Key": x} for x in keys],
+        now=now,
+        region=region,
+    )
+    return dict(zip(keys, urls))
+
+
+# TESTS #################################################################################### TESTS #
+
+
+@pytest.mark.parametrize(
+    "endpoint,region",
+    [
+        ("https://s3.example.com", "us-east-1"),
+        ("https://s3.example.com:443", "us-east-1"),
+        ("http://s3.example.com:8080", "sto2"),
+        ("https://S3.Example.com:8443/prefix", "us-east-1"),
+    ],
+)
+def test_signer_matches_botocore(endpoint, region):
+    """The urls should be identical to the ones generated by botocore."""
+    now = datetime.datetime(2022, 5, 3, 13, 37, 42)
+    signer = url_signer.PresignedUrlSigner(
+        endpoint=endpoint,
+        access_key="access",
+        secret_key="secret",
+        bucket="bucket-name",
+        region=region,
+    )
+
+    assert signer.generate_get_urls(keys=KEYS, now=now) == botocore_urls(
+        endpoint=endpoint, bucket="bucket-name", keys=KEYS, now=now, region=region
+    )
+
+
+def test_signer_signing_key_per_day():
+    """The derived signing key should only be recomputed when the date changes."""
+    signer = url_signer.PresignedUrlSigner(
+        endpoint="https://s3.example.com", access_key="access", secret_key="secret", bucket="b"
+    )
+    first_day = datetime.datetime(2022, 5, 3, 23, 59, 59)
+    second_day = first_day + datetime.timedelta(seconds=1)
+
+    with unittest.mock.patch.object(
+        url_signer, "hmac_sha256", wraps=url_signer.hmac_sha256
+    ) as mock_hmac:
+        signer.generate_get_urls(keys=KEYS, now=first_day)
+        signer.generate_get_url(key="other", now=first_day)
+        assert mock_hmac.call_count == 4
+
+        url = signer.generate_get_url(key="other", now=second_day)
+        assert mock_hmac.call_count == 8
+
+    assert (
+        url
+        == botocore_urls(
+            endpoint="https://s3.example.com", bucket="b", keys=["other"], now=second_day
+        )["other"]
+    )
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    assert query["X-Amz-Date"] == ["20220504T000000Z"]
+    assert query["X-Amz-Expires"] == ["604800"]
+
+
+@pytest.mark.parametrize("key", KEYS)
+def test_upload_part_urls_match_botocore(key):
+    """The upload part urls should be identical to the ones generated by botocore."""
+    now = datetime.datetime(2022, 5, 3, 13, 37, 42)
+    upload_id = "2~iCw_lDY8VoNIJ/+Hu=5Bs"
+    signer = url_signer.PresignedUrlSigner(
+        endpoint="http://s3.example.com:8080",
+        access_key="access",
+        secret_key="secret",
+        bucket="bucket-name",
+        region="sto2",
+    )
+
+    urls = signer.generate_upload_part_urls(
+        key=key, upload_id=upload_id, part_numbers=[1, 2, 10000], now=now
+    )
+    assert list(urls.values()) == botocore_presigned_urls(
+        endpoint="http://s3.example.com:8080",
+        operation="upload_part",
+        params=[
+            {"Bucket": "bucket-name", "Key": key, "UploadId": upload_id, "PartNumber": x}
+            for x in urls
+        ],
+        now=now,
+        region="sto2",
+    )
+
+
+def test_get_signer_cached():
+    """The same signer should be returned for the same endpoint, credentials and bucket."""
+    args = {"endpoint": "https://s3.example.com", "access_key": "a", "secret_key": "s"}
+    signer = url_signer.get_signer(**args, bucket="bucket1")
+    assert url_signer.get_signer(**args, bucket="bucket1") is signer
+    assert url_signer.get_signer(**args, bucket="bucket2") is not signer
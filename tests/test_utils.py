@@ -0,0 +1,72 @@
+# IMPORTS ################################################################################ IMPORTS #
+
+# Installed
+import sqlalchemy
+
+# Own
+from dds_web import db
+from dds_web import utils
+from dds_web.database import models
+
+# TESTS #################################################################################### TESTS #
+
+
+def test_keyset_query_pages(client):
+    """All rows are yielded once, in key order, whatever the page size."""
+    expected = models.Project.query.order_by(models.Project.id).all()
+    assert len(expected) > 2
+
+    for page_size in [1, 2, len(expected), len(expected) + 1]:
+        assert (
+            list(
+                utils.keyset_query(models.Project.query, key=models.Project.id, page_size=page_size)
+            )
+            == expected
+        )
+
+    assert list(
+        utils.keyset_query(
+            models.Project.query, key=models.Project.id, page_size=2, descending=True, yield_per=1
+        )
+    ) == list(reversed(expected))
+
+
+def test_keyset_query_tiebreaker(client):
+    """A column with duplicate values is paged with a unique tiebreaker."""
+    key = sqlalchemy.func.coalesce(models.Project.pi, "")
+    expected = (
+        db.session.query(models.Project.public_id, models.Unit.public_id)
+        .join(models.Unit, models.Unit.id == models.Project.unit_id)
+        .order_by(key.desc(), models.Project.id.desc())
+        .all()
+    )
+    assert len({x.pi for x in models.Project.query}) < len(expected)
+
+    rows = list(
+        utils.keyset_query(
+            db.session.query(models.Project.public_id, models.Unit.public_id).join(
+                models.Unit, models.Unit.id == models.Project.unit_id
+            ),
+            key=key,
+            tiebreaker=models.Project.id,
+            page_size=2,
+            descending=True,
+        )
+    )
+    assert rows == [tuple(x) for x in expected]
+    assert rows[0].public_id == expected[0][0]
+
+
+def test_keyset_query_rows_changed_while_iterating(client):
+    """Rows leaving the filtered set during the iteration do not make others be skipped."""
+    query = db.session.query(models.Project.id).filter(models.Project.is_active.is_(True))
+    expected = [x.id for x in query.order_by(models.Project.id)]
+
+    seen = []
+    for project_id in utils.keyset_query(query, key=models.Project.id, page_size=2):
+        seen.append(project_id)
+        models.Project.query.get(project_id).is_active = False
+        db.session.commit()
+
+    assert seen == expected
+    assert not query.count()